@@ -1,10 +1,33 @@
 import requests
+import asyncio
 import json
+import gzip
+import random
+import heapq
 import time
 import signal
+import threading
+import queue
+import hmac
+import hashlib
+import socket
+import sqlite3
 import sys
 import os
+import contextvars
+import glob
+import itertools
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
+from urllib.parse import urlencode, urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 
@@ -14,7 +37,9 @@ REDMINE_API_KEY = os.getenv("REDMINE_API_KEY", "<redmine-api-key>")
 # Slack App設定
 SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN", "<slack-bot-token>")
 SLACK_CHANNEL_ID = os.getenv("SLACK_CHANNEL_ID", "<slack-channel-id>")
-# 前回チェック時刻を保存するファイル
+# Slack Web APIのURL（ベンチマークなどで代替のサーバーに向ける場合に変更する）
+SLACK_API_URL = os.getenv("SLACK_API_URL", "https://slack.com/api/")
+# 取得済みチケットの最新作成時刻（ハイウォーターマーク）を保存するファイル
 LAST_CHECK_FILE = os.getenv("LAST_CHECK_FILE", "last_check.txt")
 # 通知済みチケットIDを保存するファイル
 NOTIFIED_TICKETS_FILE = os.getenv("NOTIFIED_TICKETS_FILE", "notified_tickets.txt")
@@ -42,6 +67,19 @@ else:
         # 不正な環境変数は無視して全プロジェクト通知にフォールバック
         NOTIFY_PROJECT_IDS = []
 
+# 通知先のチャンネルとメンションをプロジェクト・トラッカー・優先度の組み合わせごとに定めるルールファイル（JSON）
+# 空の場合は SLACK_CHANNEL_ID と NOTIFY_TRACKER_IDS / NOTIFY_PROJECT_IDS を1つのルールとして使う
+ROUTING_RULES_FILE = os.getenv("ROUTING_RULES_FILE", "")
+# 1つのプロセスで複数のRedmineサーバーを扱う場合のインスタンス定義ファイル（JSON）
+# 空の場合は REDMINE_URL のサーバーを上記の設定で扱う
+INSTANCES_FILE = os.getenv("INSTANCES_FILE", "")
+
+# 実行エンジン（sync: 1つのループで順に実行, async: asyncioで各処理を並行して実行）
+ENGINE = os.getenv("ENGINE", "sync").strip().lower()
+# 非同期エンジンでSlackへの通知を同時に送信する最大数
+SLACK_MAX_CONCURRENCY = max(int(os.getenv("SLACK_MAX_CONCURRENCY", "4")), 1)
+# 未着手チケットの再通知を有効にするか
+PENDING_NOTIFICATION_ENABLED = os.getenv("PENDING_NOTIFICATION_ENABLED", "false").strip().lower() == "true"
 # 未着手通知間隔（秒）（デフォルト：1時間＝3600秒）
 PENDING_NOTIFICATION_INTERVAL_SECONDS = int(os.getenv("PENDING_NOTIFICATION_INTERVAL_SECONDS", "<pending-notification-interval-seconds>"))
 # 完了したチケットを保存するファイルファイル
@@ -54,12 +92,98 @@ TRACKER_MAPPING_FILE = os.getenv("TRACKER_MAPPING_FILE", "tracker_mapping.txt")
 CREATION_TIME_MAPPING_FILE = os.getenv("CREATION_TIME_MAPPING_FILE", "creation_time_mapping.txt")
 # チケットIDと再通知メッセージIDのマッピングを保存するファイル
 PENDING_MESSAGE_MAPPING_FILE = os.getenv("PENDING_MESSAGE_MAPPING_FILE", "pending_message_mapping.txt")
+# 状態変更を追記するジャーナルファイル（空にするとジャーナルを使わず周期ごとにファイルを書き出す）
+STATE_JOURNAL_FILE = os.getenv("STATE_JOURNAL_FILE", "state_journal.txt")
+# ジャーナルをスナップショットファイルに圧縮するサイズの閾値（バイト）
+STATE_JOURNAL_COMPACT_BYTES = int(os.getenv("STATE_JOURNAL_COMPACT_BYTES", "1048576"))
+# 状態の保存先（file: テキストファイル, sqlite: SQLiteデータベース）
+STATE_BACKEND = os.getenv("STATE_BACKEND", "file").strip().lower()
+# STATE_BACKEND=sqlite の場合に使用するデータベースファイル
+STATE_DB_FILE = os.getenv("STATE_DB_FILE", "state.db")
+# 完了したチケットを追跡状態に残す日数（過ぎたものは通知済み・完了の記録から取り除く, 0の場合は取り除かない）
+COMPLETED_RETENTION_DAYS = float(os.getenv("COMPLETED_RETENTION_DAYS", "90"))
 # Redmine担当者とSlackユーザネームのマッピング（JSON形式）
 USER_MAPPING_JSON = os.getenv("USER_MAPPING_JSON", '{"Redmine上の担当者名": "SlackのメンバーID"}')
 # 完了時のSlackリアクション絵文字
 SLACK_COMPLETION_EMOJI = os.getenv("SLACK_COMPLETION_EMOJI", "white_check_mark")
 # 削除時のSlackリアクション絵文字
 SLACK_DELETION_EMOJI = os.getenv("SLACK_DELETION_EMOJI", "wastebasket")
+# DIGEST_WINDOW_SECONDS の間の新規チケットがこの件数を超えた場合に、チャンネル・トラッカーごとに1つのメッセージにまとめて通知する
+# （0の場合はまとめない）
+DIGEST_THRESHOLD = int(os.getenv("DIGEST_THRESHOLD", "0"))
+# まとめて通知するかを判定する期間（秒）
+DIGEST_WINDOW_SECONDS = float(os.getenv("DIGEST_WINDOW_SECONDS", "300"))
+# まとめたメッセージ1件に載せる最大チケット数
+DIGEST_MAX_TICKETS = max(int(os.getenv("DIGEST_MAX_TICKETS", "50")), 1)
+# 新規チケット取得時にハイウォーターマークから遡る秒数（時刻のずれ対策）
+CURSOR_OVERLAP_SECONDS = int(os.getenv("CURSOR_OVERLAP_SECONDS", "120"))
+# /issues.json の1ページあたりの取得件数（Redmineの上限は100）
+REDMINE_PAGE_SIZE = min(int(os.getenv("REDMINE_PAGE_SIZE", "100")), 100)
+# 新規チケット取得で1周期に取得する最大ページ数（残りは次の周期に取得する）
+REDMINE_MAX_PAGES_PER_CYCLE = int(os.getenv("REDMINE_MAX_PAGES_PER_CYCLE", "10"))
+# トラッカー・プロジェクトの複数指定をRedmineの「|」区切りで1回の検索にまとめるか
+# （false の場合はIDの組み合わせごとに検索する）
+REDMINE_FILTER_PIPE_SYNTAX = os.getenv("REDMINE_FILTER_PIPE_SYNTAX", "true").strip().lower() == "true"
+# Slack APIがレート制限・一時的なエラーを返した場合の最大再試行回数
+SLACK_MAX_RETRIES = int(os.getenv("SLACK_MAX_RETRIES", "5"))
+# Slack APIのメソッドごとのレート制限（1秒あたりの回数, 連続で送信できる回数）
+SLACK_RATE_LIMITS = {
+    "chat_postMessage": (1.0, 3),     # 特別枠: 1チャンネルあたり毎秒1件程度
+    "reactions_add": (50 / 60, 5),    # Tier 3: 毎分50回程度
+    "chat_delete": (50 / 60, 5),      # Tier 3: 毎分50回程度
+}
+# 上記以外のメソッドのレート制限（Tier 2: 毎分20回程度）
+SLACK_DEFAULT_RATE_LIMIT = (20 / 60, 1)
+# 完了チェックで1リクエストにまとめるチケット数
+BULK_FETCH_CHUNK_SIZE = int(os.getenv("BULK_FETCH_CHUNK_SIZE", "100"))
+# チケットを個別に取得する際の最大同時リクエスト数
+REDMINE_MAX_CONCURRENCY = max(int(os.getenv("REDMINE_MAX_CONCURRENCY", "4")), 1)
+# Redmineへの接続プールのサイズ
+REDMINE_POOL_SIZE = int(os.getenv("REDMINE_POOL_SIZE", "10"))
+# Redmineの取得結果（チケットと一覧のページ）をキャッシュする最大件数（0で無効）
+REDMINE_CACHE_SIZE = int(os.getenv("REDMINE_CACHE_SIZE", "1000"))
+# Redmineの取得結果をキャッシュする本文の合計の最大サイズ（バイト）
+REDMINE_CACHE_MAX_BYTES = int(os.getenv("REDMINE_CACHE_MAX_BYTES", "16777216"))
+# Redmineへの接続タイムアウト（秒）
+REDMINE_CONNECT_TIMEOUT = float(os.getenv("REDMINE_CONNECT_TIMEOUT", "5"))
+# Redmineからの応答の読み込みタイムアウト（秒）
+REDMINE_READ_TIMEOUT = float(os.getenv("REDMINE_READ_TIMEOUT", "30"))
+# RedmineのWebhookを受け付けるポート（0の場合は無効でポーリングのみ）
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "0"))
+# Webhookを受け付けるパス
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Webhookの送信元を確認するトークン（X-Webhook-Tokenヘッダーまたはtokenクエリ, 空の場合は確認しない）
+WEBHOOK_TOKEN = os.getenv("WEBHOOK_TOKEN", "")
+# Webhook有効時に取りこぼしを確認するポーリングの周期（秒）
+WEBHOOK_RECONCILE_INTERVAL = int(os.getenv("WEBHOOK_RECONCILE_INTERVAL", "300"))
+# 通知済みチケットの完了確認の周期（秒, 省略時はPOLLING_INTERVALと同じ）
+SWEEP_INTERVAL = int(os.getenv("SWEEP_INTERVAL", str(POLLING_INTERVAL)))
+# 変化がない間に周期を延ばす倍率（1の場合は延ばさない）
+IDLE_BACKOFF_FACTOR = max(float(os.getenv("IDLE_BACKOFF_FACTOR", "2")), 1.0)
+# 変化がない間に延ばす新規チケット取得の周期の上限（秒）
+MAX_POLLING_INTERVAL = int(os.getenv("MAX_POLLING_INTERVAL", "300"))
+# 変化がない間に延ばす完了確認の周期の上限（秒）
+MAX_SWEEP_INTERVAL = int(os.getenv("MAX_SWEEP_INTERVAL", "900"))
+# 最後の更新からの経過時間に対する完了確認の間隔の比率（0.1の場合、1時間更新のないチケットは6分ごと, 0の場合は毎回確認）
+COMPLETION_CHECK_AGE_RATIO = float(os.getenv("COMPLETION_CHECK_AGE_RATIO", "0.1"))
+# 更新のないチケットの完了確認の間隔の上限（秒）
+COMPLETION_CHECK_MAX_INTERVAL = int(os.getenv("COMPLETION_CHECK_MAX_INTERVAL", "3600"))
+# Prometheus形式のメトリクスを /metrics で公開するポート（0の場合は無効）
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# 周期ごとのトレースをJSON Linesで書き出すファイル（"-" の場合は標準出力, 空の場合は無効）
+TRACE_LOG_FILE = os.getenv("TRACE_LOG_FILE", "")
+# 所要時間がこの秒数を超えた周期は入れ子のスパンもすべて書き出す
+TRACE_SLOW_CYCLE_SECONDS = float(os.getenv("TRACE_SLOW_CYCLE_SECONDS", "10"))
+# Redmine・Slackへのリクエストと応答を記録するファイル（gzip圧縮のJSON Lines, 空の場合は記録しない）
+RECORD_FILE = os.getenv("RECORD_FILE", "")
+# 複数のレプリカでチケットを分担する場合の共有ディレクトリ（リースファイルとバケットごとの状態を置く, 空の場合は分担しない）
+SHARD_DIR = os.getenv("SHARD_DIR", "")
+# チケットIDを振り分けるバケットの数（レプリカ数より十分に大きくする。運用開始後は変更しない）
+SHARD_BUCKETS = max(int(os.getenv("SHARD_BUCKETS", "16")), 1)
+# バケットのリースの有効期間（秒）。この時間ハートビートのないレプリカのバケットは他のレプリカが引き継ぐ
+SHARD_LEASE_SECONDS = float(os.getenv("SHARD_LEASE_SECONDS", "30"))
+# リースの所有者として記録するインスタンスID（省略時はホスト名, Kubernetesではポッド名）
+SHARD_INSTANCE_ID = os.getenv("SHARD_INSTANCE_ID", "") or socket.gethostname()
 
 # ユーザーマッピングを読み込む
 try:
@@ -68,838 +192,3790 @@ except json.JSONDecodeError:
     print("ユーザーマッピングのJSON形式が不正です。")
 
 # Slack Web APIクライアントを初期化
-slack_client = WebClient(token=SLACK_BOT_TOKEN)
+slack_client = WebClient(token=SLACK_BOT_TOKEN, base_url=SLACK_API_URL)
 
 # --- 関数 ---
-def get_new_issues(last_check_time):
+class Metrics:
     """
-    指定した時刻以降に作成されたRedmineのチケットを取得する
+    Prometheusのテキスト形式で出力する最小限のメトリクス（カウンター・ゲージ・ヒストグラム）
+    ゲージには出力時に値を計算する関数も登録できる
     """
-    api_url = f"{REDMINE_URL}/issues.json"
-    headers = {
-        "X-Redmine-API-Key": REDMINE_API_KEY
-    }
-    
-    # Redmine API用の日時フォーマットに変換 (YYYY-MM-DD)
-    try:
-        dt = datetime.fromisoformat(last_check_time.replace('Z', '+00:00'))
-        formatted_time = dt.strftime('%Y-%m-%d')
-    except:
-        # フォーマット変換に失敗した場合は現在時刻から1時間前を使用
-        dt = datetime.now(timezone.utc) - timedelta(hours=1)
-        formatted_time = dt.strftime('%Y-%m-%d')
-    
-    params = {
-        "sort": "created_on:desc",
-        "created_on": f">={formatted_time}",
-        "limit": 100  # 最大100件取得
-    }
+    # ヒストグラムのバケットの上限（秒）
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
 
-    try:
-        response = requests.get(api_url, headers=headers, params=params)
-        if response.status_code != 200:
-            print(f"Response Text: {response.text}")
-        response.raise_for_status() # HTTPエラーが発生した場合に例外を発生させる
-        data = response.json()
-        all_issues = data.get("issues", [])
-        
-        # 前回チェック時刻以降のチケットをフィルタリング
-        filtered_issues = []
-        last_check_dt = datetime.fromisoformat(last_check_time.replace('Z', '+00:00'))
-        
-        for issue in all_issues:
-            try:
-                # チケットの作成日時を解析
-                created_on = datetime.fromisoformat(issue['created_on'].replace('Z', '+00:00'))
-                
-                # 前回チェック時刻以降かチェック
-                if created_on > last_check_dt:
-                    filtered_issues.append(issue)
-                    print(f"New ticket #{issue['id']} found: {created_on}")
-            except Exception as e:
-                print(f"Date parsing error for ticket #{issue['id']}: {e}")
-                continue
-        
-        print(f"New tickets: {len(filtered_issues)}")
-        return filtered_issues
-    except requests.exceptions.RequestException as e:
-        print(f"Redmine API call error: {e}")
-        return []
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._meta = {}          # 名前 -> (種類, 説明)
+        self._values = {}        # 名前 -> {ラベル: 値}（カウンター・ゲージ）
+        self._histograms = {}    # 名前 -> {ラベル: [バケットごとの累積件数..., 合計, 件数]}
+        self._callbacks = {}     # 名前 -> [(ラベルの辞書, 値), ...] を返す関数
 
-def load_notified_tickets():
-    """
-    通知済みチケットIDのリストを読み込む
-    """
-    try:
-        with open(NOTIFIED_TICKETS_FILE, "r") as f:
-            content = f.read().strip()
-            if content:
-                return set(int(line.strip()) for line in content.split('\n') if line.strip())
-            return set()
-    except FileNotFoundError:
-        return set()
+    def describe(self, name, kind, help_text, callback=None):
+        self._meta[name] = (kind, help_text)
+        if callback:
+            self._callbacks[name] = callback
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._values.setdefault(name, {})
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values.setdefault(name, {})[key] = value
+
+    def get(self, name, **labels):
+        with self._lock:
+            return self._values.get(name, {}).get(tuple(sorted(labels.items())))
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._histograms.setdefault(name, {}).setdefault(key, [0] * (len(self.BUCKETS) + 2))
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (
+            f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), chr(92) + "n")}"'
+            for key, value in pairs
+        )
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self):
+        """
+        すべてのメトリクスをPrometheusのテキスト形式にする
+        """
+        lines = []
+        for name, (kind, help_text) in sorted(self._meta.items()):
+            full_name = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            if name in self._callbacks:
+                try:
+                    samples = [(tuple(sorted(labels.items())), value) for labels, value in self._callbacks[name]()]
+                except Exception as e:
+                    print(f"  ERROR: Failed to collect metric {full_name}: {e}")
+                    samples = []
+            else:
+                with self._lock:
+                    samples = list(self._values.get(name, {}).items())
+                    histograms = {key: list(counts) for key, counts in self._histograms.get(name, {}).items()}
+                for key, counts in sorted(histograms.items()):
+                    for bound, count in zip(self.BUCKETS, counts):
+                        lines.append(f"{full_name}_bucket{self._format_labels(key, [('le', bound)])} {count}")
+                    lines.append(f"{full_name}_bucket{self._format_labels(key, [('le', '+Inf')])} {counts[-1]}")
+                    lines.append(f"{full_name}_sum{self._format_labels(key)} {counts[-2]}")
+                    lines.append(f"{full_name}_count{self._format_labels(key)} {counts[-1]}")
+            for key, value in sorted(samples):
+                lines.append(f"{full_name}{self._format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+# 監視用のメトリクス（METRICS_PORTを指定した場合に /metrics で公開する）
+metrics = Metrics("redmine_notifier")
+metrics.describe("redmine_request_duration_seconds", "histogram", "Latency of Redmine API requests")
+metrics.describe("redmine_requests_total", "counter", "Redmine API requests by endpoint and outcome")
+metrics.describe("slack_call_duration_seconds", "histogram", "Latency of Slack Web API calls")
+metrics.describe("slack_requests_total", "counter", "Slack Web API calls by method and outcome")
+metrics.describe("job_duration_seconds", "histogram", "Duration of the new-ticket poll and the open-ticket sweep")
 
-def save_notified_ticket(ticket_id):
+class Span:
+    """
+    処理の区間（スパン）の所要時間と、区間内のリクエスト数・チケット数を記録する
+    同じ名前の子スパンに繰り返し入った場合は1つのスパンに時間と回数を積み上げる
+    """
+    def __init__(self, name):
+        self.name = name
+        self.duration = 0.0
+        self.entries = 0
+        self.counts = {}
+        self.children = {}        # 名前 -> 子スパン（開始順）
+        self._lock = threading.Lock()
+
+    def child(self, name):
+        with self._lock:
+            if name not in self.children:
+                self.children[name] = Span(name)
+            return self.children[name]
+
+    def add(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.counts[key] = self.counts.get(key, 0) + value
+
+    def total_counts(self):
+        """
+        子スパンを含めた件数の合計を返す
+        """
+        with self._lock:
+            totals = dict(self.counts)
+            children = list(self.children.values())
+        for child in children:
+            for key, value in child.total_counts().items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def to_dict(self):
+        record = {"span": self.name, "duration_ms": round(self.duration * 1000, 1), "entries": self.entries}
+        record.update(self.total_counts())
+        if self.children:
+            record["spans"] = [child.to_dict() for child in self.children.values()]
+        return record
+
+# 実行中のスパン（asyncio.to_threadなどで実行したワーカースレッドにも引き継がれる）
+current_span = contextvars.ContextVar("current_span", default=None)
+trace_lock = threading.Lock()
+
+@contextmanager
+def trace_cycle(name, **attrs):
     """
-    通知済みチケットIDをファイルに追加する
+    1周期分のスパンを開始し、終了時にJSON Linesで1行出力する
+    所要時間がTRACE_SLOW_CYCLE_SECONDSを超えた場合は入れ子のスパンもすべて出力する
     """
-    notified_tickets = load_notified_tickets()
-    notified_tickets.add(ticket_id)
-    
-    with open(NOTIFIED_TICKETS_FILE, "w") as f:
-        for ticket_id in sorted(notified_tickets):
-            f.write(f"{ticket_id}\n")
+    if not TRACE_LOG_FILE:
+        yield None
+        return
 
+    span = Span(name)
+    token = current_span.set(span)
+    started_at = datetime.now(timezone.utc)
+    start = time.monotonic()
+    try:
+        yield span
+    finally:
+        span.duration = time.monotonic() - start
+        span.entries = 1
+        current_span.reset(token)
+        slow = span.duration >= TRACE_SLOW_CYCLE_SECONDS
+        record = {"time": started_at.isoformat(), **attrs, **span.to_dict(), "slow": slow}
+        if not slow:
+            record.pop("spans", None)
+        write_trace_record(record)
 
-def load_completed_tickets():
+@contextmanager
+def trace_span(name, **counts):
     """
-    完了したチケットIDのセットを読み込む
+    実行中のスパンの子スパンを開始する（周期のスパンの外では何もしない）
     """
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    span = parent.child(name)
+    span.add(**counts)
+    token = current_span.set(span)
+    start = time.monotonic()
     try:
-        with open(COMPLETED_TICKETS_FILE, "r") as f:
-            content = f.read().strip()
-            if content:
-                return set(int(line.strip()) for line in content.split('\n') if line.strip())
-            return set()
-    except FileNotFoundError:
-        return set()
+        yield span
+    finally:
+        current_span.reset(token)
+        with span._lock:
+            span.duration += time.monotonic() - start
+            span.entries += 1
 
-def save_completed_ticket(ticket_id):
+def trace_count(**counts):
     """
-    完了したチケットIDをファイルに追加する
+    実行中のスパンにリクエスト数やチケット数を加算する
     """
-    completed_tickets = load_completed_tickets()
-    completed_tickets.add(ticket_id)
-    
-    with open(COMPLETED_TICKETS_FILE, "w") as f:
-        for ticket_id in sorted(completed_tickets):
-            f.write(f"{ticket_id}\n")
+    span = current_span.get()
+    if span is not None:
+        span.add(**counts)
 
-def load_message_mapping():
+def trace_iter(name, iterable):
     """
-    チケットIDとSlackメッセージIDのマッピングを読み込む
+    要素を1つ取り出すごとの時間を name のスパンに積み上げながら順に返す
     """
-    try:
-        with open(MESSAGE_MAPPING_FILE, "r") as f:
-            content = f.read().strip()
-            if content:
-                message_mapping = {}
-                for line in content.split('\n'):
-                    if line.strip():
-                        parts = line.strip().split(',')
-                        if len(parts) == 2:
-                            ticket_id = int(parts[0])
-                            message_id = parts[1]
-                            message_mapping[ticket_id] = message_id
-                return message_mapping
-            return {}
-    except FileNotFoundError:
-        return {}
+    iterator = iter(iterable)
+    while True:
+        with trace_span(name):
+            item = next(iterator, None)
+        if item is None:
+            return
+        yield item
 
-def save_message_mapping(ticket_id, message_id):
+def write_trace_record(record):
     """
-    チケットIDとSlackメッセージIDのマッピングを保存する
+    トレースの1レコードをJSON LinesでTRACE_LOG_FILE（"-" の場合は標準出力）に書き出す
     """
-    message_mapping = load_message_mapping()
-    message_mapping[ticket_id] = message_id
-    
-    with open(MESSAGE_MAPPING_FILE, "w") as f:
-        for ticket_id, message_id in message_mapping.items():
-            f.write(f"{ticket_id},{message_id}\n")
+    line = json.dumps(record, ensure_ascii=False)
+    with trace_lock:
+        if TRACE_LOG_FILE == "-":
+            print(line)
+        else:
+            with open(TRACE_LOG_FILE, "a") as f:
+                f.write(line + "\n")
+
+class Recorder:
+    """
+    Redmine・Slackへのリクエストと応答の組を時刻付きでgzip圧縮のJSON Linesに記録する
+    記録したファイルは bench/replay.py でネットワークを使わずに再生できる
+    """
+    # 再生時に記録時と同じ動作をさせるために記録しておく設定
+    SETTINGS = (
+        "POLLING_INTERVAL", "SWEEP_INTERVAL", "NOTIFY_TRACKER_IDS", "NOTIFY_PROJECT_IDS",
+        "PENDING_NOTIFICATION_ENABLED", "PENDING_NOTIFICATION_INTERVAL_SECONDS", "CURSOR_OVERLAP_SECONDS",
+        "REDMINE_PAGE_SIZE", "REDMINE_MAX_PAGES_PER_CYCLE", "REDMINE_FILTER_PIPE_SYNTAX", "BULK_FETCH_CHUNK_SIZE",
+        "IDLE_BACKOFF_FACTOR", "MAX_POLLING_INTERVAL", "MAX_SWEEP_INTERVAL",
+        "COMPLETION_CHECK_AGE_RATIO", "COMPLETION_CHECK_MAX_INTERVAL",
+        "SLACK_CHANNEL_ID", "ROUTING_RULES_FILE", "SLACK_COMPLETION_EMOJI", "SLACK_DELETION_EMOJI", "USER_MAPPING_JSON",
+        "DIGEST_THRESHOLD", "DIGEST_WINDOW_SECONDS", "DIGEST_MAX_TICKETS",
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self._file is not None
+
+    def start(self, high_water_mark):
+        """
+        記録を開始する
+        再生を同じ状態から始められるように、設定と追跡中のチケットを最初のレコードに書き出す
+        """
+        self._file = gzip.open(self.path, "at", encoding="utf-8")
+        tickets = [
+            [ticket_id, state.get_messages(ticket_id), state.get_tracker(ticket_id),
+             state.get_creation_time(ticket_id), state.get_pending_messages(ticket_id)]
+            for ticket_id in state.open_tickets()
+        ]
+        settings = {name: os.environ[name] for name in self.SETTINGS if name in os.environ}
+        self.write("start", high_water_mark=high_water_mark.isoformat(), settings=settings, tickets=tickets)
+
+    def write(self, kind, **fields):
+        fields.setdefault("time", time.time())
+        line = json.dumps({"type": kind, **fields}, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + "\n")
 
-def remove_message_mapping(ticket_id):
+    def record_redmine(self, sent_at, path, params, response, error=None):
+        """
+        Redmine APIへのGETリクエストと応答（またはエラー）を、リクエストの送信時刻で記録する
+        """
+        if response is None:
+            self.write("redmine", time=sent_at, path=path, params=params, status=None, error=type(error).__name__)
+            return
+        try:
+            body = response.json() if response.content else None
+        except ValueError:
+            body = None
+        self.write("redmine", time=sent_at, path=path, params=params, status=response.status_code,
+                   etag=response.headers.get("ETag"), body=body)
+
+    def record_slack(self, method, kwargs, status, data):
+        """
+        Slack Web APIの呼び出しと応答を記録する（投稿したメッセージの再掲は省く）
+        """
+        data = {key: value for key, value in dict(data or {}).items() if key != "message"}
+        self.write("slack", method=method, args=kwargs, status=status, response=data)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+# Redmine・Slackとの通信の記録（RECORD_FILE が設定されている場合のみ記録する）
+recorder = Recorder(RECORD_FILE)
+
+def freeze_json_object(pairs):
     """
-    チケットIDのメッセージマッピングを削除する
+    json.loads の object_pairs_hook として、オブジェクトを変更できないマッピング（配列はタプル）にする
     """
-    message_mapping = load_message_mapping()
-    if ticket_id in message_mapping:
-        del message_mapping[ticket_id]
-        
-        with open(MESSAGE_MAPPING_FILE, "w") as f:
-            for ticket_id, message_id in message_mapping.items():
-                f.write(f"{ticket_id},{message_id}\n")
+    return MappingProxyType({key: tuple(value) if type(value) is list else value for key, value in pairs})
+
+class ResponseCache:
+    """
+    URLごとにレスポンスのETag / Last-Modified と解析済みの本文を保持するLRUキャッシュ
+    件数と本文の合計サイズのどちらかが上限を超えた場合は、最も長く使われていないものから破棄する
+    """
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
 
+    def put(self, key, etag, last_modified, data, size):
+        if self.max_entries <= 0 or size > self.max_bytes:
+            self.discard(key)
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = {"etag": etag, "last_modified": last_modified, "data": data, "size": size}
+            self.size_bytes += size
+            # 上限を超えた分は最も長く使われていないものから破棄する
+            while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
 
-def load_tracker_mapping():
+    def discard(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= entry["size"]
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+class RedmineClient:
+    """
+    Redmine APIへのリクエストを接続プール付きの共通セッションで送信する
+    呼び出し種別ごとのレイテンシを集計する
+    """
+    def __init__(self, base_url, api_key, session):
+        self.base_url = base_url.rstrip('/')
+        # セッション（接続プール）は全てのインスタンスで共有し、APIキーはリクエストごとに付ける
+        self.session = session
+        self.api_key = api_key
+        # 応答しないRedmineでループが止まらないように接続・読み込みのタイムアウトを設定する
+        self.timeout = (REDMINE_CONNECT_TIMEOUT, REDMINE_READ_TIMEOUT)
+        self._lock = threading.Lock()
+        self.latency = {}          # 呼び出し種別 -> 累計の集計
+        self._cycle_latency = {}   # 呼び出し種別 -> 前回の取り出し以降の集計
+        self.cache = ResponseCache(REDMINE_CACHE_SIZE, REDMINE_CACHE_MAX_BYTES)
+
+    def get(self, path, params=None, name=None, headers=None):
+        """
+        GETリクエストを送信し、レイテンシを記録する
+        """
+        start = time.monotonic()
+        sent_at = time.time()
+        ok = False
+        outcome = "error"
+        response = None
+        try:
+            response = self.session.get(f"{self.base_url}{path}", params=params,
+                                        headers={"X-Redmine-API-Key": self.api_key, **(headers or {})},
+                                        timeout=self.timeout)
+            ok = response.status_code < 500
+            outcome = str(response.status_code)
+            return response
+        except requests.RequestException as e:
+            if recorder.active:
+                recorder.record_redmine(sent_at, path, params, None, e)
+            raise
+        finally:
+            if recorder.active and response is not None:
+                recorder.record_redmine(sent_at, path, params, response)
+            elapsed = time.monotonic() - start
+            self._record(name or path, elapsed, ok)
+            trace_count(redmine_requests=1)
+            metrics.observe("redmine_request_duration_seconds", elapsed, endpoint=name or path)
+            metrics.inc("redmine_requests_total", endpoint=name or path, outcome=outcome)
+
+    def get_json_cached(self, path, params=None, name=None):
+        """
+        条件付きGETでJSONを取得する
+        変更がなければ（304）キャッシュ済みの解析結果を解析し直さずに返す
+        解析結果はキャッシュと共有するため、変更できないマッピングとタプルで返す
+        戻り値は (ステータスコード, 解析済みJSON) で、404の場合はJSONをNoneとする
+        """
+        key = path if not params else f"{path}?{urlencode(sorted(params.items()))}"
+        entry = self.cache.get(key)
+        headers = {}
+        if entry:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = self.get(path, params=params, name=name, headers=headers)
+        if response.status_code == 304 and entry:
+            self.cache.record(hit=True)
+            return 200, entry["data"]
+
+        self.cache.record(hit=False)
+        if response.status_code == 404:
+            self.cache.discard(key)
+            return 404, None
+        if response.status_code != 200:
+            print(f"Response Text: {response.text}")
+        response.raise_for_status()
+        data = json.loads(response.content, object_pairs_hook=freeze_json_object)
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag or last_modified:
+            self.cache.put(key, etag, last_modified, data, len(response.content))
+        return response.status_code, data
+
+    def _record(self, name, elapsed, ok):
+        with self._lock:
+            for table in (self.latency, self._cycle_latency):
+                stats = table.setdefault(name, {"count": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+                stats["count"] += 1
+                stats["errors"] += 0 if ok else 1
+                stats["total_seconds"] += elapsed
+                stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+
+    def take_cycle_latency(self):
+        """
+        前回の呼び出し以降のレイテンシ集計を返してリセットする
+        """
+        with self._lock:
+            stats, self._cycle_latency = self._cycle_latency, {}
+        return stats
+
+def create_redmine_session(pool_connections):
+    """
+    Redmine APIへのリクエストに使う接続プール付きのセッションを作成する
+    pool_connections はホストごとの接続プールを保持する数
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=REDMINE_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip",
+    })
+    return session
+
+# 処理中のインスタンス（未設定の場合は最初のインスタンス）
+current_instance = contextvars.ContextVar("current_instance", default=None)
+
+def get_instance():
+    return current_instance.get() or get_instances()[0]
+
+@contextmanager
+def using_instance(instance):
     """
-    チケットIDとトラッカーIDのマッピングを読み込む
+    ブロックの中の処理（ワーカースレッドを含む）を指定のインスタンスに対して行う
     """
+    token = current_instance.set(instance)
     try:
-        with open(TRACKER_MAPPING_FILE, "r") as f:
-            content = f.read().strip()
-            if content:
-                tracker_mapping = {}
-                for line in content.split('\n'):
-                    if line.strip():
-                        parts = line.strip().split(',')
-                        if len(parts) == 2:
-                            ticket_id = int(parts[0])
-                            tracker_id = int(parts[1])
-                            tracker_mapping[ticket_id] = tracker_id
-                return tracker_mapping
-            return {}
-    except FileNotFoundError:
-        return {}
+        yield instance
+    finally:
+        current_instance.reset(token)
 
-def save_tracker_mapping(ticket_id, tracker_id):
+class InstanceAttribute:
     """
-    チケットIDとトラッカーIDのマッピングを保存する
+    処理中のインスタンスの属性に操作を委ねる
+    モジュール全体で使う state や redmine などを、呼び出し側を変えずにインスタンスごとの値に切り替える
     """
-    tracker_mapping = load_tracker_mapping()
-    tracker_mapping[ticket_id] = tracker_id
-    
-    with open(TRACKER_MAPPING_FILE, "w") as f:
-        for ticket_id, tracker_id in tracker_mapping.items():
-            f.write(f"{ticket_id},{tracker_id}\n")
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(getattr(get_instance(), self._name), attr)
+
+    def __len__(self):
+        return len(getattr(get_instance(), self._name))
+
+# Redmine APIクライアント（インスタンスごとに作成し、接続プールは共有する）
+redmine = InstanceAttribute("redmine")
+# チケットを個別に取得する際のスレッドプール
+fetch_executor = ThreadPoolExecutor(max_workers=REDMINE_MAX_CONCURRENCY, thread_name_prefix="redmine-fetch")
 
-def remove_tracker_mapping(ticket_id):
+def format_latency(stats):
     """
-    チケットIDのトラッカーマッピングを削除する
+    レイテンシ集計を1行の文字列にする
     """
-    tracker_mapping = load_tracker_mapping()
-    if ticket_id in tracker_mapping:
-        del tracker_mapping[ticket_id]
-        
-        with open(TRACKER_MAPPING_FILE, "w") as f:
-            for ticket_id, tracker_id in tracker_mapping.items():
-                f.write(f"{ticket_id},{tracker_id}\n")
+    return " | ".join(
+        f"{name}: {s['count']} calls, avg {s['total_seconds'] / s['count'] * 1000:.0f}ms, "
+        f"max {s['max_seconds'] * 1000:.0f}ms, errors {s['errors']}"
+        for name, s in sorted(stats.items())
+    )
 
-def load_creation_time_mapping():
+def parse_redmine_time(value):
     """
-    チケットIDと作成時刻のマッピングを読み込む
+    RedmineのISO8601形式の日時文字列をdatetimeに変換する
     """
-    try:
-        with open(CREATION_TIME_MAPPING_FILE, "r") as f:
-            content = f.read().strip()
-            if content:
-                creation_time_mapping = {}
-                for line in content.split('\n'):
-                    if line.strip():
-                        parts = line.strip().split(',')
-                        if len(parts) == 2:
-                            ticket_id = int(parts[0])
-                            creation_time = parts[1]
-                            creation_time_mapping[ticket_id] = creation_time
-                return creation_time_mapping
-            return {}
-    except FileNotFoundError:
-        return {}
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
 
-def save_creation_time_mapping(ticket_id, creation_time):
+def format_redmine_time(dt):
     """
-    チケットIDと作成時刻のマッピングを保存する
+    datetimeをRedmineのフィルタで使える秒精度のUTC文字列に変換する
     """
-    creation_time_mapping = load_creation_time_mapping()
-    creation_time_mapping[ticket_id] = creation_time
-    
-    with open(CREATION_TIME_MAPPING_FILE, "w") as f:
-        for ticket_id, creation_time in creation_time_mapping.items():
-            f.write(f"{ticket_id},{creation_time}\n")
+    return dt.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
 
-def remove_creation_time_mapping(ticket_id):
+def normalize_redmine_time(value):
     """
-    チケットIDの作成時刻マッピングを削除する
+    Redmineの日時文字列を秒精度のUTC文字列（...Z）に揃える
+    空や解析できない場合はそのまま返す
     """
-    creation_time_mapping = load_creation_time_mapping()
-    if ticket_id in creation_time_mapping:
-        del creation_time_mapping[ticket_id]
-        
-        with open(CREATION_TIME_MAPPING_FILE, "w") as f:
-            for ticket_id, creation_time in creation_time_mapping.items():
-                f.write(f"{ticket_id},{creation_time}\n")
+    if not value:
+        return value
+    try:
+        return format_redmine_time(parse_redmine_time(value))
+    except ValueError:
+        return value
 
-def load_pending_message_mapping():
+def load_high_water_mark(path=None):
     """
-    チケットIDと再通知メッセージIDのマッピングを読み込む
+    前回までに取得したチケットの最新作成時刻（ハイウォーターマーク）を読み込む
+    SHARD_DIR が設定されている場合は、担当しているバケットのうち最も古いものを返す
     """
+    if path is None and SHARD_DIR:
+        return state.high_water_mark()
     try:
-        with open(PENDING_MESSAGE_MAPPING_FILE, "r") as f:
-            content = f.read().strip()
-            if content:
-                pending_message_mapping = {}
-                for line in content.split('\n'):
-                    if line.strip():
-                        parts = line.strip().split(',')
-                        if len(parts) == 2:
-                            ticket_id = int(parts[0])
-                            message_id = parts[1]
-                            pending_message_mapping[ticket_id] = message_id
-                return pending_message_mapping
-            return {}
-    except FileNotFoundError:
-        return {}
+        with open(path or get_instance().last_check_file, "r") as f:
+            return parse_redmine_time(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
 
-def save_pending_message_mapping(ticket_id, message_id):
+def save_high_water_mark(high_water_mark, path=None):
     """
-    チケットIDと再通知メッセージIDのマッピングを保存する
+    ハイウォーターマークをファイルに保存する
+    SHARD_DIR が設定されている場合は、取得を始めた時点から担当しているバケットのものを進める
     """
-    pending_message_mapping = load_pending_message_mapping()
-    pending_message_mapping[ticket_id] = message_id
+    if path is None and SHARD_DIR:
+        state.save_high_water_mark(high_water_mark)
+        return
+    write_file_atomic(path or get_instance().last_check_file, [high_water_mark.isoformat()])
+
+def iter_issues(params, max_pages=None, page_limited=None):
+    """
+    /issues.json を offset と total_count に従って1ページずつ取得し、チケットを順に返す
+    max_pages を指定した場合はそのページ数で打ち切り、最後に返したチケットを page_limited に追加する
+    """
+    offset = 0
+    pages = 0
+    last_issue = None
+    while max_pages is None or pages < max_pages:
+        page_params = dict(params, limit=REDMINE_PAGE_SIZE, offset=offset)
+        # 前回と同じ検索条件のページが変わっていなければ（304）本文を受け取らずに済ませる
+        status_code, data = redmine.get_json_cached("/issues.json", params=page_params, name="issues")
+        if status_code == 404:
+            # 存在しないプロジェクトを指定した場合など
+            raise requests.exceptions.HTTPError(f"404 Not Found: /issues.json {page_params}")
+        page = data.get("issues", [])
+        pages += 1
+        yield from page
+        
+        offset += len(page)
+        if not page or offset >= data.get("total_count", 0):
+            return
+        last_issue = page[-1]
     
-    with open(PENDING_MESSAGE_MAPPING_FILE, "w") as f:
-        for ticket_id, message_id in pending_message_mapping.items():
-            f.write(f"{ticket_id},{message_id}\n")
+    print(f"  Page limit reached ({max_pages} pages), continuing next cycle")
+    if page_limited is not None and last_issue:
+        page_limited.append(last_issue)
 
-def remove_pending_message_mapping(ticket_id):
+def build_issue_filters():
+    """
+    ルーティングルールの対象のトラッカー・プロジェクトをRedmineの検索条件に変換する
+    「|」区切りの複数指定を使わない場合は、IDの組み合わせごとに検索条件を分ける
+    （ルールの組み合わせより広く取得する場合があり、通知先はチケットごとにルーティング表で決める）
+    """
+    tracker_ids, project_ids = routing.tracker_ids, routing.project_ids
+    if REDMINE_FILTER_PIPE_SYNTAX:
+        filters = {}
+        if tracker_ids:
+            filters["tracker_id"] = "|".join(str(tracker_id) for tracker_id in tracker_ids)
+        if project_ids:
+            filters["project_id"] = "|".join(str(project_id) for project_id in project_ids)
+        return [filters]
+    
+    filters_list = []
+    for tracker_id in tracker_ids or [None]:
+        for project_id in project_ids or [None]:
+            filters = {}
+            if tracker_id is not None:
+                filters["tracker_id"] = tracker_id
+            if project_id is not None:
+                filters["project_id"] = project_id
+            filters_list.append(filters)
+    return filters_list
+
+def iter_issues_created_since(params, since, page_limited):
     """
-    チケットIDの再通知メッセージマッピングを削除する
+    指定時刻以降に作成されたチケットを古い順に返す
     """
-    pending_message_mapping = load_pending_message_mapping()
-    if ticket_id in pending_message_mapping:
-        del pending_message_mapping[ticket_id]
+    for issue in iter_issues(params, max_pages=REDMINE_MAX_PAGES_PER_CYCLE, page_limited=page_limited):
+        try:
+            # チケットの作成日時を解析
+            created_on = parse_redmine_time(issue['created_on'])
+        except Exception as e:
+            print(f"Date parsing error for ticket #{issue['id']}: {e}")
+            continue
         
-        with open(PENDING_MESSAGE_MAPPING_FILE, "w") as f:
-            for ticket_id, message_id in pending_message_mapping.items():
-                f.write(f"{ticket_id},{message_id}\n")
+        # 重なり分を含めた取得範囲のチケットだけを返す
+        if created_on >= since:
+            yield issue
 
-def remove_deleted_tickets_from_tracking(deleted_ticket_ids):
+def get_new_issues(high_water_mark, page_limited=None):
     """
-    削除されたチケットを追跡対象から除外する
+    ハイウォーターマーク以降に作成されたRedmineのチケットを古い順に1件ずつ返す
+    時刻のずれやコミット順の入れ替わりに備え、CURSOR_OVERLAP_SECONDS秒だけ遡って取得する
+    （重なった分は通知済みチェックで除外される）
+    トラッカーとプロジェクトの条件はRedmine側で絞り込み、取得量を抑える
+    1周期で取得するページ数はREDMINE_MAX_PAGES_PER_CYCLEで制限し、残りは次の周期に取得する
     """
-    # 通知済みチケットから削除
-    notified_tickets = load_notified_tickets()
-    for ticket_id in deleted_ticket_ids:
-        if ticket_id in notified_tickets:
-            notified_tickets.remove(ticket_id)
-    
-    with open(NOTIFIED_TICKETS_FILE, "w") as f:
-        for ticket_id in sorted(notified_tickets):
-            f.write(f"{ticket_id}\n")
-    
-    # メッセージマッピングからも削除
-    for ticket_id in deleted_ticket_ids:
-        remove_message_mapping(ticket_id)
-    
-    
-    # トラッカーマッピングからも削除
-    for ticket_id in deleted_ticket_ids:
-        remove_tracker_mapping(ticket_id)
-    
-    # 作成時刻マッピングからも削除
-    for ticket_id in deleted_ticket_ids:
-        remove_creation_time_mapping(ticket_id)
-    
-    # 再通知メッセージマッピングからも削除
-    for ticket_id in deleted_ticket_ids:
-        remove_pending_message_mapping(ticket_id)
+    since = high_water_mark - timedelta(seconds=CURSOR_OVERLAP_SECONDS)
     
-    if deleted_ticket_ids:
-        print(f"  CLEANUP: Removed {len(deleted_ticket_ids)} deleted tickets from tracking")
+    # 秒精度で絞り込み、古い順に取得してカーソルを順に進める
+    # （古い順であれば取得中に作成されたチケットが増えてもoffsetがずれない）
+    params = {
+        "sort": "created_on:asc",
+        "created_on": f">={format_redmine_time(since)}",
+    }
+    streams = [
+        iter_issues_created_since(dict(params, **filters), since, page_limited)
+        for filters in build_issue_filters()
+    ]
 
-def get_slack_username(redmine_user_name):
-    """
-    Redmineの担当者名からSlackのユーザネームを取得する
-    """
-    if not redmine_user_name:
-        return None
-    return USER_MAPPING.get(redmine_user_name, None)
+    try:
+        if len(streams) == 1:
+            yield from streams[0]
+        else:
+            # 検索条件ごとの結果を作成日時順に統合する
+            yield from heapq.merge(*streams, key=lambda issue: issue['created_on'])
+    except requests.exceptions.RequestException as e:
+        print(f"Redmine API call error: {e}")
 
-def create_mention_text(redmine_user_name):
+def advance_high_water_mark(high_water_mark, issue):
     """
-    Redmineの担当者名からSlackの@メンション文字列を作成する
+    チケットの作成時刻までハイウォーターマークを進める
+    ローカル時計ではなくRedmine側の時刻を使うため、時計のずれの影響を受けない
     """
-    slack_username = get_slack_username(redmine_user_name)
-    if slack_username:
-        return f"<@{slack_username}>"
-    return None
+    try:
+        return max(high_water_mark, parse_redmine_time(issue['created_on']))
+    except (KeyError, ValueError):
+        return high_water_mark
 
-def truncate_description(description, max_length=250):
+def notify_new_issue(issue):
     """
-    descriptionが指定の文字数以上の場合、切り詰めて...を追加する
+    新規チケットをSlackに通知し、追跡対象として記録する
     """
-    if not description:
-        return description
-    if len(description) > max_length:
-        return description[:max_length] + "..."
-    return description
+    print(f"  NEW: #{issue['id']} - {issue['subject']} ({issue.get('tracker', {}).get('name', 'Unknown')})")
+    send_slack_notification(issue)
+    record_new_issue(issue)
 
-def is_notification_target(issue):
-    """
-    指定されたトラッカーとプロジェクトの両方の条件を満たすチケットかどうかを判定する
-    """
-    # トラッカーのチェック
-    tracker_match = True
-    if NOTIFY_TRACKER_IDS:  # 空でない場合はフィルタリング
-        tracker_id = issue.get('tracker', {}).get('id')
-        if tracker_id not in NOTIFY_TRACKER_IDS:
-            tracker_match = False
-    
-    # プロジェクトのチェック
-    project_match = True
-    if NOTIFY_PROJECT_IDS:  # 空でない場合はフィルタリング
-        project_id = issue.get('project', {}).get('id')
-        if project_id not in NOTIFY_PROJECT_IDS:
-            project_match = False
-    
-    # 両方の条件を満たす場合のみ通知対象
-    return tracker_match and project_match
+def record_new_issue(issue):
+    """
+    通知した新規チケットを追跡対象として記録する
+    """
+    # 通知済みとして記録
+    state.mark_notified(issue['id'])
+    # トラッカーIDを保存
+    tracker_id = issue.get('tracker', {}).get('id')
+    if tracker_id:
+        state.set_tracker(issue['id'], tracker_id)
+    # 作成時刻を保存（未着手通知用）
+    creation_time = issue.get('created_on', '')
+    if creation_time:
+        state.set_creation_time(issue['id'], creation_time)
 
-def is_already_notified(issue):
+# 通知処理中・完了の処理中のチケットIDの更新を排他する（処理中のチケットIDはインスタンスごとに保持する）
+notifying_lock = threading.Lock()
+
+def notify_new_issue_once(issue):
     """
-    既に通知済みのチケットかどうかを判定する
+    通知済みでも通知処理中でもない場合だけ新規チケットを通知する
+    通知した場合はTrueを返す
     """
-    notified_tickets = load_notified_tickets()
-    return issue['id'] in notified_tickets
+    # Webhookとポーリングが同じチケットを同時に通知しないようにする
+    notifying_tickets = get_instance().notifying_tickets
+    with notifying_lock:
+        if issue['id'] in notifying_tickets or is_already_notified(issue):
+            return False
+        notifying_tickets.add(issue['id'])
+    try:
+        notify_new_issue(issue)
+        return True
+    finally:
+        with notifying_lock:
+            notifying_tickets.discard(issue['id'])
 
-def get_ticket_status(ticket_id):
+def is_burst(count):
     """
-    指定されたチケットIDのステータスを取得する
+    DIGEST_WINDOW_SECONDS の間に通知対象になった新規チケットに count 件を加え、DIGEST_THRESHOLD を超えるかを返す
     """
-    api_url = f"{REDMINE_URL}/issues/{ticket_id}.json"
-    headers = {
-        "X-Redmine-API-Key": REDMINE_API_KEY
-    }
-    
-    try:
-        response = requests.get(api_url, headers=headers)
-        if response.status_code == 404:
-            return "削除済み"
-        response.raise_for_status()
-        data = response.json()
-        issue = data.get("issue", {})
-        return issue.get("status", {}).get("name", "不明")
-    except requests.exceptions.RequestException as e:
-        print(f"Error getting status for ticket #{ticket_id}: {e}")
-        return "不明"
+    if DIGEST_THRESHOLD <= 0:
+        return False
+    now = time.monotonic()
+    arrivals = get_instance().recent_arrivals
+    with notifying_lock:
+        while arrivals and arrivals[0][0] <= now - DIGEST_WINDOW_SECONDS:
+            arrivals.popleft()
+        arrivals.append((now, count))
+        return sum(n for _, n in arrivals) > DIGEST_THRESHOLD
 
-def get_ticket_info(ticket_id):
+def notify_new_issues(issues, notify=notify_new_issue_once):
     """
-    指定されたチケットIDの詳細情報を取得する
+    1回の取得（またはWebhookのイベントのまとまり）で通知対象になった新規チケットを notify で1件ずつ通知する
+    新規チケットが DIGEST_THRESHOLD を超えて続いている場合は、チャンネル・トラッカーごとにまとめて通知する
     """
-    api_url = f"{REDMINE_URL}/issues/{ticket_id}.json"
-    headers = {
-        "X-Redmine-API-Key": REDMINE_API_KEY
-    }
-    
+    if not issues:
+        return
+    if not is_burst(len(issues)):
+        for issue in issues:
+            notify(issue)
+        return
+
+    # 個別の通知と同じく、Webhookとポーリングが同じチケットを同時に通知しないようにする
+    notifying_tickets = get_instance().notifying_tickets
+    with notifying_lock:
+        claimed = list({issue['id']: issue for issue in issues
+                        if issue['id'] not in notifying_tickets and not is_already_notified(issue)}.values())
+        notifying_tickets.update(issue['id'] for issue in claimed)
     try:
-        response = requests.get(api_url, headers=headers)
-        if response.status_code == 404:
-            return None  # チケットが削除された
-        response.raise_for_status()
-        data = response.json()
-        return data.get("issue", {})
-    except requests.exceptions.RequestException as e:
-        print(f"Error getting info for ticket #{ticket_id}: {e}")
-        # HTTPエラーの場合は例外を再発生させて、上位で処理させる
-        raise
+        for issue in claimed:
+            print(f"  NEW: #{issue['id']} - {issue['subject']} ({issue.get('tracker', {}).get('name', 'Unknown')})")
+        send_digest_notifications(claimed)
+        for issue in claimed:
+            record_new_issue(issue)
+    finally:
+        with notifying_lock:
+            notifying_tickets.difference_update(issue['id'] for issue in claimed)
 
-def check_completed_tickets():
+def poll_new_issues(high_water_mark, notify=notify_new_issue_once):
     """
-    通知済みチケットの完了をチェックし、完了した場合はリアクションを追加する
-    また、特定の条件でメッセージを削除する
+    新規チケットを取得しながら順にフィルタリングし、通知対象のチケットを notify に渡す
+    処理済みのチケットまで進めたハイウォーターマークを返す
     """
-    notified_tickets = load_notified_tickets()
-    completed_tickets = load_completed_tickets()
-    tracker_mapping = load_tracker_mapping()
-    newly_completed = []
-    deleted_tickets = []
+    start = time.monotonic()
+    fetched_count = 0
+    notified_count = 0
+    page_limited = []
+    # まとめて通知する場合は、取得を終えてから件数に応じて通知する
+    arrivals = [] if DIGEST_THRESHOLD > 0 else None
     
-    for ticket_id in notified_tickets:
-        if ticket_id not in completed_tickets:
-            try:
-                # チケットの詳細情報を取得
-                issue = get_ticket_info(ticket_id)
-                if issue is None:
-                    # チケットが削除された場合 - 両方のメッセージにゴミ箱リアクションを追加
-                    deleted_tickets.append(ticket_id)
-                    original_reaction = add_deletion_reaction(ticket_id)
-                    pending_reaction = add_pending_deletion_reaction(ticket_id)
-                    
-                    if original_reaction and pending_reaction:
-                        print(f"  TICKET DELETED: #{ticket_id} (Both messages marked with wastebasket reaction)")
-                    elif original_reaction:
-                        print(f"  TICKET DELETED: #{ticket_id} (Original message marked with wastebasket reaction)")
-                    elif pending_reaction:
-                        print(f"  TICKET DELETED: #{ticket_id} (Pending message marked with wastebasket reaction)")
-                    else:
-                        print(f"  TICKET DELETED: #{ticket_id} (No messages found)")
-                    continue
-                elif issue:
-                    status = issue.get("status", {}).get("name", "不明")
-                    current_tracker_id = issue.get("tracker", {}).get("id")
-                    original_tracker_id = tracker_mapping.get(ticket_id)
-                
-                # 完了ステータスかチェック（「完了」「終了」「クローズ」など）
-                if status in ["完了", "終了", "クローズ", "Closed", "Resolved", "Done"]:
-                    newly_completed.append(issue)
-                    save_completed_ticket(ticket_id)
-                    
-                    # トラッカーが変更されている場合は両方のメッセージにゴミ箱リアクションを追加
-                    if original_tracker_id and current_tracker_id != original_tracker_id:
-                        original_reaction = add_deletion_reaction(ticket_id)
-                        pending_reaction = add_pending_deletion_reaction(ticket_id)
-                        
-                        if original_reaction and pending_reaction:
-                            print(f"  COMPLETED (tracker changed): #{ticket_id} - {issue.get('subject', 'No subject')} (Both messages marked with wastebasket reaction)")
-                        elif original_reaction:
-                            print(f"  COMPLETED (tracker changed): #{ticket_id} - {issue.get('subject', 'No subject')} (Original message marked with wastebasket reaction)")
-                        elif pending_reaction:
-                            print(f"  COMPLETED (tracker changed): #{ticket_id} - {issue.get('subject', 'No subject')} (Pending message marked with wastebasket reaction)")
-                        else:
-                            print(f"  COMPLETED (tracker changed): #{ticket_id} - {issue.get('subject', 'No subject')} (No messages found)")
-                    else:
-                        # 元のメッセージにリアクションを追加
-                        add_completion_reaction(ticket_id)
-                        # 再通知メッセージにもリアクションを追加
-                        add_pending_completion_reaction(ticket_id)
-                        print(f"  COMPLETED: #{ticket_id} - {issue.get('subject', 'No subject')}")
-                    
-                    # トラッカーマッピングを削除
-                    remove_tracker_mapping(ticket_id)
-                    # 作成時刻マッピングを削除
-                    remove_creation_time_mapping(ticket_id)
-                    # 再通知メッセージマッピングを削除
-                    remove_pending_message_mapping(ticket_id)
-            except requests.exceptions.RequestException as e:
-                # HTTPエラーの場合はスキップして次回に再試行
-                print(f"  ERROR: Failed to check ticket #{ticket_id}: {e}")
-                continue
+    for issue in trace_iter("fetch", get_new_issues(high_water_mark, page_limited)):
+        fetched_count += 1
+        high_water_mark = advance_high_water_mark(high_water_mark, issue)
+        
+        # トラッカーとプロジェクトのフィルタリング（Redmine側の絞り込みの確認）と通知済みチェックを適用
+        with trace_span("filter"):
+            target = owns_ticket(issue['id']) and is_notification_target(issue) and not is_already_notified(issue)
+        if not target:
+            continue
+        
+        notified_count += 1
+        if arrivals is not None:
+            arrivals.append(issue)
+            continue
+        with trace_span("notify"):
+            notify(issue)
     
-    # 削除されたチケットを追跡対象から除外
-    if deleted_tickets:
-        remove_deleted_tickets_from_tracking(deleted_tickets)
+    if arrivals:
+        with trace_span("notify"):
+            notify_new_issues(arrivals, notify)
     
-    return newly_completed
+    # ページ数の上限で打ち切った検索条件がある場合は、次の周期を打ち切った位置から再開する
+    # （重なり分を遡ると同じページを取得し続けるため、その分だけ先に進めておく）
+    if page_limited:
+        limit = min(parse_redmine_time(issue['created_on']) for issue in page_limited)
+        high_water_mark = limit + timedelta(seconds=CURSOR_OVERLAP_SECONDS)
+    
+    if notified_count:
+        print(f"Notified {notified_count} new tickets (fetched: {fetched_count})")
+    elif fetched_count:
+        print(f"No new tickets to notify (fetched: {fetched_count})")
+    else:
+        print("No new tickets found")
+    
+    metrics.observe("job_duration_seconds", time.monotonic() - start, job="poll")
+    trace_count(fetched=fetched_count, notified=notified_count)
+    get_instance().last_poll = time.time()
+    return high_water_mark
+
+class TicketIdSet:
+    """
+    チケットIDをソート済みの array('q') で保持する集合
+    要素ごとにintオブジェクトを持たないため、件数が増えてもメモリと読み込み時間が小さい
+    所属判定は二分探索で行い、with_stamps=True の場合はIDごとの時刻（UNIX秒）も同じ順に保持する
+    """
+    def __init__(self, with_stamps=False):
+        self.ids = array("q")
+        self.stamps = array("q") if with_stamps else None
+        self.restamped = 0                  # 読み込み時に時刻を補ったチケットIDの数
 
+    @classmethod
+    def read(cls, path, with_stamps=False):
+        """
+        1行に1つのチケットID（with_stamps=True の場合は「チケットID,時刻」）を記録したファイルを読み込む
+        時刻のない行は読み込んだ時点の時刻とする
+        """
+        id_set = cls(with_stamps)
+        try:
+            with open(path, "r") as f:
+                lines = f.read().split()
+        except FileNotFoundError:
+            return id_set
+        if not with_stamps:
+            id_set.ids = array("q", sorted(set(map(int, lines))))
+            return id_set
 
+        now = int(time.time())
+        stamps = {}
+        for line in lines:
+            ticket_id, _, stamp = line.partition(',')
+            stamps[int(ticket_id)] = int(stamp) if stamp else now
+            id_set.restamped += 0 if stamp else 1
+        ticket_ids = sorted(stamps)
+        id_set.ids = array("q", ticket_ids)
+        id_set.stamps = array("q", (stamps[ticket_id] for ticket_id in ticket_ids))
+        return id_set
 
-def display_ticket_info(issue):
+    def _index(self, ticket_id):
+        index = bisect_left(self.ids, ticket_id)
+        return index if index < len(self.ids) and self.ids[index] == ticket_id else -1
+
+    def __contains__(self, ticket_id):
+        return self._index(ticket_id) >= 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def add(self, ticket_id, stamp=0):
+        index = bisect_left(self.ids, ticket_id)
+        if index < len(self.ids) and self.ids[index] == ticket_id:
+            if self.stamps is not None:
+                self.stamps[index] = stamp
+            return
+        # チケットIDは概ね昇順に増えるため、挿入はほとんどが末尾への追加になる
+        self.ids.insert(index, ticket_id)
+        if self.stamps is not None:
+            self.stamps.insert(index, stamp)
+
+    def discard(self, ticket_id):
+        index = self._index(ticket_id)
+        if index >= 0:
+            del self.ids[index]
+            if self.stamps is not None:
+                del self.stamps[index]
+
+    def discard_all(self, ticket_ids):
+        """
+        複数のチケットIDを1回の詰め直しで取り除く
+        """
+        ticket_ids = set(ticket_ids)
+        keep = [i for i, ticket_id in enumerate(self.ids) if ticket_id not in ticket_ids]
+        self.ids = array("q", (self.ids[i] for i in keep))
+        if self.stamps is not None:
+            self.stamps = array("q", (self.stamps[i] for i in keep))
+
+    def stamp(self, ticket_id):
+        index = self._index(ticket_id)
+        return self.stamps[index] if index >= 0 and self.stamps is not None else None
+
+    def discard_before(self, cutoff):
+        """
+        時刻が cutoff より前の要素を取り除き、取り除いたチケットIDのリストを返す
+        """
+        if not self.stamps or min(self.stamps) >= cutoff:
+            return []
+        expired = [ticket_id for ticket_id, stamp in zip(self.ids, self.stamps) if stamp < cutoff]
+        self.discard_all(expired)
+        return expired
+
+    def copy(self):
+        id_set = TicketIdSet()
+        id_set.ids = array("q", self.ids)
+        id_set.stamps = array("q", self.stamps) if self.stamps is not None else None
+        return id_set
+
+    def filter(self, predicate):
+        """
+        predicate に一致するチケットIDだけの集合を返す
+        """
+        keep = [i for i, ticket_id in enumerate(self.ids) if predicate(ticket_id)]
+        id_set = TicketIdSet()
+        id_set.ids = array("q", (self.ids[i] for i in keep))
+        id_set.stamps = array("q", (self.stamps[i] for i in keep)) if self.stamps is not None else None
+        return id_set
+
+    def lines(self):
+        """
+        ファイルに書き出す行を返す
+        """
+        if self.stamps is None:
+            return (f"{ticket_id}\n" for ticket_id in self.ids)
+        return (f"{ticket_id},{stamp}\n" for ticket_id, stamp in zip(self.ids, self.stamps))
+
+def read_mapping(path, value_type=str):
     """
-    チケット情報をコンソールに表示する
+    「チケットID,値」形式で記録したマッピングファイルを読み込む
     """
-    project = issue.get('project', {}).get('name', 'Unknown')
-    tracker = issue.get('tracker', {}).get('name', 'Unknown')
-    subject = issue.get('subject', 'No subject')
-    author = issue.get('author', {}).get('name', 'Unknown')
-    created_on = issue.get('created_on', 'Unknown')
-    status = issue.get('status', {}).get('name', 'Unknown')
-    priority = issue.get('priority', {}).get('name', 'Unknown')
-    url = f"{REDMINE_URL}/issues/{issue['id']}"
-    
-    print(f"  NEW: #{issue['id']} - {subject} | Project: {project} | Tracker: {tracker} | Author: {author} | Status: {status} | Priority: {priority} | Created: {created_on} | URL: {url}")
+    mapping = {}
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                parts = line.strip().split(',')
+                if len(parts) == 2:
+                    mapping[int(parts[0])] = value_type(parts[1])
+    except FileNotFoundError:
+        pass
+    return mapping
 
-def send_slack_notification(issue):
+def channel_mapping_path(path, channel):
     """
-    Slackにチケット情報を送信する
+    チャンネルごとのメッセージマッピングファイルのパスを返す
+    SLACK_CHANNEL_ID のマッピングは従来のファイル、それ以外は「ファイル名.チャンネルID.拡張子」に保存する
     """
-    # 担当者の@メンションを作成
-    assigned_to_name = issue.get('assigned_to', {}).get('name', '未割り当て')
-    mention_text = create_mention_text(assigned_to_name)
-    
-    # 本文を作成
-    text = f"新しいチケットが作成されました。"
-    if mention_text:
-        text += f" {mention_text}"
-    
-    # descriptionを切り詰める
-    description = issue.get('description', '')
-    truncated_description = truncate_description(description)
-    
-    # Slackに送信するメッセージを構築
-    message = {
-        "text": text,
-        "attachments": [
-            {
-                "color": "#ae1500",
-                "title": f"{issue['tracker']['name']} #{issue['id']}: {issue['subject']}",
-                "title_link": f"{REDMINE_URL}/issues/{issue['id']}",
-                "footer": f"{truncated_description}\n担当者: {issue.get('assigned_to', {}).get('name', '未割り当て')}",
-                "ts": int(datetime.fromisoformat(issue['created_on'].replace('Z', '+00:00')).timestamp())
-            }
-        ]
-    }
-    
-    try:
-        response = slack_client.chat_postMessage(
-            channel=SLACK_CHANNEL_ID,
-            text=text,
-            attachments=message["attachments"]
-        )
-        # メッセージIDを保存
-        message_id = response['ts']
-        save_message_mapping(issue['id'], message_id)
-        pass  # 通知送信は成功
-    except SlackApiError as e:
-        print(f"  ERROR: Failed to send notification for #{issue['id']}: {e.response['error']}")
+    if channel == SLACK_CHANNEL_ID:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{channel}{ext}"
 
-def send_pending_notification_with_mention(issue):
+def read_channel_mappings(path):
     """
-    未着手チケットの通知をSlackに送信する（@メンション付き）
+    チャンネルごとのメッセージマッピングファイルをすべて読み込み、チャンネル -> マッピング を返す
     """
-    # 担当者の@メンションを作成
-    assigned_to_name = issue.get('assigned_to', {}).get('name', '未割り当て')
-    mention_text = create_mention_text(assigned_to_name)
-    
-    # 本文を作成
-    text = f"未着手のチケットがあります。"
-    if mention_text:
-        text += f" {mention_text}"
-    
-    # descriptionを切り詰める
-    description = issue.get('description', '')
-    truncated_description = truncate_description(description)
-    
-    # Slackに送信するメッセージを構築
-    message = {
-        "text": text,
-        "attachments": [
-            {
-                "color": "#FFCC01",  # 黄色
-                "title": f"{issue['tracker']['name']} #{issue['id']}: {issue['subject']}",
-                "title_link": f"{REDMINE_URL}/issues/{issue['id']}",
-                "footer": f"{truncated_description}\n担当者: {issue.get('assigned_to', {}).get('name', '未割り当て')}",
-                "ts": int(datetime.fromisoformat(issue['created_on'].replace('Z', '+00:00')).timestamp())
-            }
-        ]
-    }
-    
-    try:
-        response = slack_client.chat_postMessage(
-            channel=SLACK_CHANNEL_ID,
-            text=text,
-            attachments=message["attachments"]
+    mappings = {SLACK_CHANNEL_ID: read_mapping(path)}
+    root, ext = os.path.splitext(path)
+    for channel_path in glob.glob(f"{glob.escape(root)}.*{glob.escape(ext)}"):
+        channel = channel_path[len(root) + 1:len(channel_path) - len(ext)]
+        if channel and "." not in channel:
+            mappings[channel] = read_mapping(channel_path)
+    return mappings
+
+def state_path(directory, path):
+    """
+    状態ファイルのパスを返す（ディレクトリを指定した場合は、設定されたファイル名でそのディレクトリに置く）
+    """
+    return os.path.join(directory, os.path.basename(path)) if directory else path
+
+def write_file_atomic(path, lines):
+    """
+    一時ファイルに書き込んでからリネームし、書き込み途中の内容が残らないようにする
+    書き込んだバイト数を返す
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+        written = f.tell()
+    os.replace(tmp_path, path)
+    return written
+
+def write_snapshot_file(path, data):
+    """
+    チケットIDの集合またはマッピングをファイルに書き出し、書き込んだバイト数を返す
+    """
+    if isinstance(data, TicketIdSet):
+        return write_file_atomic(path, data.lines())
+    return write_file_atomic(path, (f"{ticket_id},{value}\n" for ticket_id, value in data.items()))
+
+class TicketState:
+    """
+    チケットの追跡状態をメモリ上に保持する
+    起動時に一度だけ読み込み、変更はジャーナルへの追記、
+    またはジャーナル無効時は変更のあったファイルの周期ごとの書き出しで永続化する
+    """
+    # ジャーナルのレコード種別と、対応するスナップショットファイル
+    # メッセージIDのレコードは SLACK_CHANNEL_ID 以外のチャンネルの場合「チャンネルID:メッセージID」
+    # （削除のレコードはチャンネルID）を値とし、チャンネルごとのファイルに対応する
+    JOURNAL_OPS = {
+        "notified": "notified",
+        "completed": "completed",
+        "message": "message",
+        "tracker": "tracker",
+        "creation_time": "creation_time",
+        "pending_message": "pending_message",
+        "-message": "message",
+        "-tracker": "tracker",
+        "-creation_time": "creation_time",
+        "-pending_message": "pending_message",
+        "deleted": None,
+    }
+
+    def __init__(self, directory=None):
+        self.directory = directory           # 状態ファイルの保存先（省略時は各ファイルの設定のパス）
+        self.journal_path = self._path(STATE_JOURNAL_FILE) if STATE_JOURNAL_FILE else ""
+        self.notified = TicketIdSet()        # 通知済みチケットID
+        self.completed = TicketIdSet(with_stamps=True)  # 完了したチケットIDと完了時刻
+        self.message_mappings = {SLACK_CHANNEL_ID: {}}          # チャンネル -> (チケットID -> SlackメッセージID)
+        self.tracker_mapping = {}            # チケットID -> トラッカーID
+        self.creation_time_mapping = {}      # チケットID -> 作成時刻
+        self.pending_message_mappings = {SLACK_CHANNEL_ID: {}}  # チャンネル -> (チケットID -> 再通知メッセージID)
+        self._message_tickets = {}           # (チャンネル, SlackメッセージID) -> チケットIDの集合（message_mappings の逆引き）
+        self._dirty = set()
+        self._journal = None
+        self._compaction_thread = None
+        self._discarded = False              # 他のプロセスに引き継がれ、ファイルに書き込まなくなったか
+        self.bytes_written = 0               # ジャーナルとスナップショットファイルに書き込んだバイト数
+        # 非同期エンジンでは複数のスレッドから更新されるため、更新と書き出しを排他する
+        self._lock = threading.RLock()
+
+    def _files(self):
+        files = {
+            "notified": (self._path(NOTIFIED_TICKETS_FILE), self.notified),
+            "completed": (self._path(COMPLETED_TICKETS_FILE), self.completed),
+            "tracker": (self._path(TRACKER_MAPPING_FILE), self.tracker_mapping),
+            "creation_time": (self._path(CREATION_TIME_MAPPING_FILE), self.creation_time_mapping),
+        }
+        for kind, path in (("message", MESSAGE_MAPPING_FILE), ("pending_message", PENDING_MESSAGE_MAPPING_FILE)):
+            for channel, mapping in self._channel_mappings(kind).items():
+                files[self._file_name(kind, channel)] = (channel_mapping_path(self._path(path), channel), mapping)
+        return files
+
+    def _path(self, path):
+        return state_path(self.directory, path)
+
+    def _channel_mappings(self, kind):
+        return self.message_mappings if kind == "message" else self.pending_message_mappings
+
+    @staticmethod
+    def _file_name(kind, channel):
+        return kind if channel == SLACK_CHANNEL_ID else f"{kind}:{channel}"
+
+    @staticmethod
+    def _split_channel(op, value):
+        """
+        メッセージIDのレコードの値を (チャンネル, メッセージID) に分ける
+        """
+        if op.startswith("-"):
+            return value or SLACK_CHANNEL_ID, ""
+        channel, _, message_id = value.rpartition(":")
+        return channel or SLACK_CHANNEL_ID, message_id
+
+    @staticmethod
+    def _channel_value(channel, message_id=""):
+        channel = channel or SLACK_CHANNEL_ID
+        if channel == SLACK_CHANNEL_ID:
+            return message_id
+        return f"{channel}:{message_id}" if message_id else channel
+
+    def load(self, read_only=False):
+        """
+        スナップショットファイルから状態を読み込み、ジャーナルを再生する
+        read_only=True の場合はジャーナルを開かず、ファイルを変更しない
+        """
+        self.notified = TicketIdSet.read(self._path(NOTIFIED_TICKETS_FILE))
+        self.completed = TicketIdSet.read(self._path(COMPLETED_TICKETS_FILE), with_stamps=True)
+        self.message_mappings = read_channel_mappings(self._path(MESSAGE_MAPPING_FILE))
+        self.tracker_mapping = read_mapping(self._path(TRACKER_MAPPING_FILE), int)
+        self.creation_time_mapping = read_mapping(self._path(CREATION_TIME_MAPPING_FILE))
+        self.pending_message_mappings = read_channel_mappings(self._path(PENDING_MESSAGE_MAPPING_FILE))
+        self._reindex_messages()
+        self._dirty.clear()
+        # 時刻のない完了チケットには読み込んだ時点の時刻を補うため、読み込むたびに保持期間が延びないように書き戻す
+        if self.completed.restamped:
+            self._dirty.add("completed")
+
+        if not self.journal_path:
+            return
+
+        # 圧縮途中で停止した場合は退避済みのジャーナルから先に再生する
+        rotated_path = f"{self.journal_path}.old"
+        replayed = self._replay(rotated_path) + self._replay(self.journal_path)
+        if replayed:
+            print(f"Replayed {replayed} state journal records")
+        if read_only:
+            return
+        self._journal = open(self.journal_path, "a")
+        if os.path.exists(rotated_path) or self.completed.restamped:
+            self.compact(background=False)
+
+    def _replay(self, path):
+        """
+        ジャーナルファイルのレコードを順に適用する
+        """
+        count = 0
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    parts = line.rstrip('\n').split(',', 2)
+                    # 書き込み途中で停止した末尾のレコードなどは読み飛ばす
+                    if len(parts) != 3 or parts[0] not in self.JOURNAL_OPS:
+                        continue
+                    try:
+                        self._apply(parts[0], int(parts[1]), parts[2])
+                    except ValueError:
+                        continue
+                    count += 1
+        except FileNotFoundError:
+            pass
+        return count
+
+    def _apply(self, op, ticket_id, value):
+        """
+        1件の状態変更をメモリ上の状態に適用する
+        """
+        if op == "notified":
+            self.notified.add(ticket_id)
+        elif op == "completed":
+            self.completed.add(ticket_id, int(value) if value else int(time.time()))
+            self.completed.restamped += 0 if value else 1
+        elif op in ("message", "pending_message"):
+            channel, message_id = self._split_channel(op, value)
+            mapping = self._channel_mappings(op).setdefault(channel, {})
+            if op == "message":
+                self._unindex_message(channel, ticket_id, mapping.get(ticket_id))
+                self._message_tickets.setdefault((channel, message_id), set()).add(ticket_id)
+            mapping[ticket_id] = message_id
+        elif op == "tracker":
+            self.tracker_mapping[ticket_id] = int(value)
+        elif op == "creation_time":
+            self.creation_time_mapping[ticket_id] = value
+        elif op in ("-message", "-pending_message"):
+            channel, _ = self._split_channel(op, value)
+            message_id = self._channel_mappings(op[1:]).get(channel, {}).pop(ticket_id, None)
+            if op == "-message":
+                self._unindex_message(channel, ticket_id, message_id)
+        elif op == "-tracker":
+            self.tracker_mapping.pop(ticket_id, None)
+        elif op == "-creation_time":
+            self.creation_time_mapping.pop(ticket_id, None)
+        elif op == "deleted":
+            self.notified.discard(ticket_id)
+            self.tracker_mapping.pop(ticket_id, None)
+            self.creation_time_mapping.pop(ticket_id, None)
+            for channel, mapping in self.message_mappings.items():
+                self._unindex_message(channel, ticket_id, mapping.pop(ticket_id, None))
+            for mapping in self.pending_message_mappings.values():
+                mapping.pop(ticket_id, None)
+
+    def _unindex_message(self, channel, ticket_id, message_id):
+        """
+        メッセージIDの逆引きからチケットIDを取り除く
+        """
+        tickets = self._message_tickets.get((channel, message_id))
+        if tickets is None:
+            return
+        tickets.discard(ticket_id)
+        if not tickets:
+            del self._message_tickets[(channel, message_id)]
+
+    def _reindex_messages(self):
+        """
+        message_mappings からメッセージIDの逆引きを作り直す
+        """
+        self._message_tickets = {}
+        for channel, mapping in self.message_mappings.items():
+            for ticket_id, message_id in mapping.items():
+                self._message_tickets.setdefault((channel, message_id), set()).add(ticket_id)
+
+    def _update(self, op, ticket_id, value=""):
+        """
+        状態変更を適用し、ジャーナルに追記する（ジャーナル無効時は対応ファイルを変更済みにする）
+        """
+        with self._lock:
+            self._apply(op, ticket_id, value)
+            if self._journal:
+                record = f"{op},{ticket_id},{value}\n"
+                self._journal.write(record)
+                self._journal.flush()
+                self.bytes_written += len(record)
+            elif self.JOURNAL_OPS[op] in ("message", "pending_message"):
+                self._dirty.add(self._file_name(self.JOURNAL_OPS[op], self._split_channel(op, value)[0]))
+            elif self.JOURNAL_OPS[op]:
+                self._dirty.add(self.JOURNAL_OPS[op])
+            else:
+                self._dirty.update(self._files())
+
+    def flush(self):
+        """
+        周期の終わりに状態を永続化する
+        ジャーナル有効時はfsyncのみ行い、サイズが閾値を超えていれば圧縮する
+        """
+        with self._lock:
+            if self._discarded:
+                return
+            if self._journal:
+                os.fsync(self._journal.fileno())
+                if self._journal.tell() >= STATE_JOURNAL_COMPACT_BYTES:
+                    self.compact()
+                return
+
+            files = self._files()
+            for name in sorted(self._dirty):
+                path, data = files[name]
+                self.bytes_written += write_snapshot_file(path, data)
+            self._dirty.clear()
+
+    def close(self):
+        """
+        未保存の状態を書き出し、ジャーナルを閉じる
+        """
+        self.flush()
+        if self._compaction_thread:
+            self._compaction_thread.join()
+        with self._lock:
+            if self._journal:
+                self._journal.close()
+                self._journal = None
+
+    def discard(self):
+        """
+        状態を書き出さずにジャーナルを閉じる（ファイルを他のプロセスが使い始めた場合）
+        実行中の圧縮は残りのスナップショットファイルを書き出さずに終わる
+        """
+        with self._lock:
+            self._discarded = True
+            if self._journal:
+                self._journal.close()
+                self._journal = None
+            self._dirty.clear()
+
+    def compact(self, background=True):
+        """
+        現在の状態をスナップショットファイルに書き出し、ジャーナルを空にする
+        書き出しの間に発生した変更は新しいジャーナルに追記される
+        """
+        if self._compaction_thread and self._compaction_thread.is_alive():
+            return
+
+        rotated_path = f"{self.journal_path}.old"
+        self._journal.close()
+        if os.path.exists(rotated_path):
+            # 前回の圧縮が完了していない場合は退避済みのジャーナルに追記する
+            with open(self.journal_path, "r") as src, open(rotated_path, "a") as dst:
+                dst.write(src.read())
+            os.remove(self.journal_path)
+        else:
+            os.replace(self.journal_path, rotated_path)
+        self._journal = open(self.journal_path, "a")
+
+        # 書き出し中もメインループが状態を更新できるようにコピーを渡す
+        snapshot = [(path, data.copy()) for path, data in self._files().values()]
+
+        def write_snapshot():
+            for path, data in snapshot:
+                with self._lock:
+                    if self._discarded:
+                        # 退避済みのジャーナルは引き継いだプロセスが読み込む
+                        return
+                written = write_snapshot_file(path, data)
+                with self._lock:
+                    self.bytes_written += written
+            os.remove(rotated_path)
+            print(f"  STATE: Compacted journal into snapshot files")
+
+        if background:
+            self._compaction_thread = threading.Thread(target=write_snapshot, daemon=True)
+            self._compaction_thread.start()
+        else:
+            write_snapshot()
+
+    def partition(self, directory, predicate):
+        """
+        predicate に一致するチケットの状態だけを指定のディレクトリのスナップショットファイルに書き出す
+        書き出した通知済みチケットの件数を返す
+        """
+        part = TicketState(directory)
+        with self._lock:
+            part.notified = self.notified.filter(predicate)
+            part.completed = self.completed.filter(predicate)
+            part.tracker_mapping = {k: v for k, v in self.tracker_mapping.items() if predicate(k)}
+            part.creation_time_mapping = {k: v for k, v in self.creation_time_mapping.items() if predicate(k)}
+            part.message_mappings = {channel: {k: v for k, v in mapping.items() if predicate(k)}
+                                     for channel, mapping in self.message_mappings.items()}
+            part.pending_message_mappings = {channel: {k: v for k, v in mapping.items() if predicate(k)}
+                                             for channel, mapping in self.pending_message_mappings.items()}
+        for path, data in part._files().values():
+            write_snapshot_file(path, data)
+        return len(part.notified)
+
+    def open_tickets(self):
+        """
+        通知済みで未完了のチケットIDを返す
+        """
+        with self._lock:
+            return [ticket_id for ticket_id in self.notified if ticket_id not in self.completed]
+
+    def pending_candidates(self, created_before):
+        """
+        未着手通知が未送信で、指定時刻より前に作成された未完了チケットIDを返す
+        """
+        candidates = []
+        with self._lock:
+            creation_times = list(self.creation_time_mapping.items())
+        for ticket_id, creation_time in creation_times:
+            if ticket_id not in self.notified or ticket_id in self.completed:
+                continue
+            try:
+                created_on = datetime.fromisoformat(creation_time.replace('Z', '+00:00'))
+            except ValueError:
+                continue
+            if created_on <= created_before:
+                candidates.append(ticket_id)
+        return sorted(candidates)
+
+    def counts(self):
+        """
+        通知済み・完了チケットの件数を返す
+        """
+        return len(self.notified), len(self.completed)
+
+    def is_notified(self, ticket_id):
+        return ticket_id in self.notified
+
+    def is_open(self, ticket_id):
+        return ticket_id in self.notified and ticket_id not in self.completed
+
+    def get_messages(self, ticket_id):
+        """
+        チケットの通知メッセージを チャンネル -> メッセージID で返す
+        """
+        with self._lock:
+            return {channel: mapping[ticket_id] for channel, mapping in self.message_mappings.items()
+                    if ticket_id in mapping}
+
+    def tickets_for_message(self, message_id, channel=None):
+        """
+        同じメッセージで通知したチケットIDを返す（まとめて通知したメッセージの確認用）
+        """
+        with self._lock:
+            return sorted(self._message_tickets.get((channel or SLACK_CHANNEL_ID, message_id), ()))
+
+    def get_tracker(self, ticket_id):
+        return self.tracker_mapping.get(ticket_id)
+
+    def get_creation_time(self, ticket_id):
+        return self.creation_time_mapping.get(ticket_id)
+
+    def get_pending_messages(self, ticket_id):
+        """
+        チケットの再通知メッセージを チャンネル -> メッセージID で返す
+        """
+        with self._lock:
+            return {channel: mapping[ticket_id] for channel, mapping in self.pending_message_mappings.items()
+                    if ticket_id in mapping}
+
+    def set_status(self, ticket_id, status):
+        # テキストファイルにはステータスを保存しない
+        pass
+
+    def mark_notified(self, ticket_id):
+        self._update("notified", ticket_id)
+
+    def mark_completed(self, ticket_id):
+        self._update("completed", ticket_id, int(time.time()))
+
+    def set_message(self, ticket_id, message_id, channel=None):
+        self._update("message", ticket_id, self._channel_value(channel, message_id))
+
+    def remove_message(self, ticket_id, channel=None):
+        """
+        チケットのメッセージIDを削除する（チャンネルを省略した場合はすべてのチャンネル）
+        """
+        for message_channel in [channel] if channel else list(self.get_messages(ticket_id)):
+            if ticket_id in self.message_mappings.get(message_channel, {}):
+                self._update("-message", ticket_id, self._channel_value(message_channel))
+
+    def set_tracker(self, ticket_id, tracker_id):
+        self._update("tracker", ticket_id, tracker_id)
+
+    def remove_tracker(self, ticket_id):
+        if ticket_id in self.tracker_mapping:
+            self._update("-tracker", ticket_id)
+
+    def set_creation_time(self, ticket_id, creation_time):
+        self._update("creation_time", ticket_id, creation_time)
+
+    def remove_creation_time(self, ticket_id):
+        if ticket_id in self.creation_time_mapping:
+            self._update("-creation_time", ticket_id)
+
+    def set_pending_message(self, ticket_id, message_id, channel=None):
+        self._update("pending_message", ticket_id, self._channel_value(channel, message_id))
+
+    def remove_pending_message(self, ticket_id):
+        """
+        チケットの再通知メッセージIDをすべてのチャンネルから削除する
+        """
+        for channel in self.get_pending_messages(ticket_id):
+            self._update("-pending_message", ticket_id, self._channel_value(channel))
+
+    def forget(self, ticket_id):
+        """
+        削除されたチケットを追跡対象から除外する
+        """
+        self._update("deleted", ticket_id)
+
+    def evict_completed(self, completed_before):
+        """
+        指定時刻より前に完了したチケットを通知済み・完了の記録とマッピングから取り除き、件数を返す
+        一度に大量に取り除く場合があるため、ジャーナルには追記せずスナップショットとして書き出す
+        """
+        with self._lock:
+            evicted = self.completed.discard_before(int(completed_before.timestamp()))
+            if not evicted:
+                return 0
+            self.notified.discard_all(evicted)
+            for mapping in itertools.chain((self.tracker_mapping, self.creation_time_mapping),
+                                           self.message_mappings.values(), self.pending_message_mappings.values()):
+                for ticket_id in evicted:
+                    mapping.pop(ticket_id, None)
+            self._reindex_messages()
+            if self._journal:
+                self.compact()
+            else:
+                self._dirty.update(self._files())
+        return len(evicted)
+
+class SqliteTicketState:
+    """
+    チケットの追跡状態をSQLiteデータベースに保持する
+    TicketStateと同じ操作を提供し、未完了チケットや未着手通知の対象をインデックスで検索する
+    SLACK_CHANNEL_ID のメッセージIDは tickets テーブル、それ以外のチャンネルは channel_messages テーブルに保存する
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tickets (
+            id INTEGER PRIMARY KEY,
+            tracker_id INTEGER,
+            created_on TEXT,
+            status TEXT,
+            message_ts TEXT,
+            pending_ts TEXT,
+            notified INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            completed_at INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_tickets_status ON tickets(status);
+        CREATE INDEX IF NOT EXISTS idx_tickets_created_on ON tickets(created_on);
+        CREATE INDEX IF NOT EXISTS idx_tickets_open ON tickets(notified, completed);
+        CREATE INDEX IF NOT EXISTS idx_tickets_message_ts ON tickets(message_ts);
+        CREATE TABLE IF NOT EXISTS channel_messages (
+            ticket_id INTEGER NOT NULL,
+            channel TEXT NOT NULL,
+            message_ts TEXT,
+            pending_ts TEXT,
+            PRIMARY KEY (ticket_id, channel)
+        );
+        CREATE INDEX IF NOT EXISTS idx_channel_messages_ts ON channel_messages(channel, message_ts);
+    """
+
+    def __init__(self, path, directory=None):
+        self.path = path
+        self.directory = directory           # 取り込むテキストファイルの場所（省略時は各ファイルの設定のパス）
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        データベースを開き、空の場合は既存のテキストファイルから状態を取り込む
+        """
+        # 各更新を即時にコミットし、WALモードでfsyncの回数を抑える
+        self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._migrate()
+
+        if self._query_one("SELECT COUNT(*) FROM tickets") == 0:
+            imported = self.import_text_files()
+            if imported:
+                print(f"Imported {imported} tickets from text state files into {self.path}")
+
+    def _migrate(self):
+        """
+        以前のスキーマで作成されたデータベースに完了時刻の列を追加する
+        完了時刻のない完了チケットは移行した時点で完了したものとする
+        作成時刻はUTCの文字列に揃える
+        """
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(tickets)")}
+        if "completed_at" not in columns:
+            self._conn.execute("ALTER TABLE tickets ADD COLUMN completed_at INTEGER")
+            self._conn.execute("UPDATE tickets SET completed_at = ? WHERE completed = 1", (int(time.time()),))
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tickets_completed_at ON tickets(completed_at)")
+        # 時差付き（+09:00 など）で保存された作成時刻をUTCに揃える
+        rows = self._conn.execute(
+            "SELECT id, created_on FROM tickets WHERE created_on IS NOT NULL AND created_on NOT LIKE '%Z'"
+        ).fetchall()
+        if rows:
+            self._conn.executemany(
+                "UPDATE tickets SET created_on = ? WHERE id = ?",
+                [(normalize_redmine_time(created_on), ticket_id) for ticket_id, created_on in rows],
+            )
+
+    def import_text_files(self):
+        """
+        テキストファイル（およびジャーナル）の状態をデータベースに一括で取り込む
+        """
+        text_state = TicketState(self.directory)
+        text_state.load(read_only=True)
+        ticket_ids = set(itertools.chain(
+            text_state.notified, text_state.completed, text_state.tracker_mapping, text_state.creation_time_mapping,
+            *text_state.message_mappings.values(), *text_state.pending_message_mappings.values(),
+        ))
+        rows = [
+            (
+                ticket_id,
+                text_state.get_tracker(ticket_id),
+                normalize_redmine_time(text_state.get_creation_time(ticket_id)),
+                text_state.get_messages(ticket_id).get(SLACK_CHANNEL_ID),
+                text_state.get_pending_messages(ticket_id).get(SLACK_CHANNEL_ID),
+                int(ticket_id in text_state.notified),
+                int(ticket_id in text_state.completed),
+                text_state.completed.stamp(ticket_id),
+            )
+            for ticket_id in sorted(ticket_ids)
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO tickets "
+                "(id, tracker_id, created_on, message_ts, pending_ts, notified, completed, completed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            channels = (set(text_state.message_mappings) | set(text_state.pending_message_mappings)) - {SLACK_CHANNEL_ID}
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO channel_messages (ticket_id, channel, message_ts, pending_ts) VALUES (?, ?, ?, ?)",
+                [
+                    (ticket_id, channel, text_state.message_mappings.get(channel, {}).get(ticket_id),
+                     text_state.pending_message_mappings.get(channel, {}).get(ticket_id))
+                    for channel in sorted(channels)
+                    for ticket_id in sorted(set(text_state.message_mappings.get(channel, {}))
+                                            | set(text_state.pending_message_mappings.get(channel, {})))
+                ],
+            )
+            self._conn.execute("COMMIT")
+        return len(rows)
+
+    def _query_one(self, sql, params=()):
+        with self._lock:
+            row = self._conn.execute(sql, params).fetchone()
+        return row[0] if row else None
+
+    def _query_ids(self, sql, params=()):
+        with self._lock:
+            return [row[0] for row in self._conn.execute(sql, params)]
+
+    def _set(self, ticket_id, column, value):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO tickets (id, {column}) VALUES (?, ?) "
+                f"ON CONFLICT(id) DO UPDATE SET {column} = excluded.{column}",
+                (ticket_id, value),
+            )
+
+    def _clear(self, ticket_id, column):
+        with self._lock:
+            self._conn.execute(f"UPDATE tickets SET {column} = NULL WHERE id = ?", (ticket_id,))
+
+    def _get(self, ticket_id, column):
+        return self._query_one(f"SELECT {column} FROM tickets WHERE id = ?", (ticket_id,))
+
+    def _get_channel_messages(self, ticket_id, column):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {column} FROM tickets WHERE id = ?", (ticket_id,)).fetchone()
+            messages = {SLACK_CHANNEL_ID: row[0]} if row and row[0] else {}
+            messages.update(self._conn.execute(
+                f"SELECT channel, {column} FROM channel_messages WHERE ticket_id = ? AND {column} IS NOT NULL",
+                (ticket_id,),
+            ))
+        return messages
+
+    def _set_channel_message(self, ticket_id, column, message_id, channel):
+        if not channel or channel == SLACK_CHANNEL_ID:
+            self._set(ticket_id, column, message_id)
+            return
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO channel_messages (ticket_id, channel, {column}) VALUES (?, ?, ?) "
+                f"ON CONFLICT(ticket_id, channel) DO UPDATE SET {column} = excluded.{column}",
+                (ticket_id, channel, message_id),
+            )
+
+    def _clear_channel_messages(self, ticket_id, column, channel=None):
+        if not channel or channel == SLACK_CHANNEL_ID:
+            self._clear(ticket_id, column)
+        if channel != SLACK_CHANNEL_ID:
+            with self._lock:
+                self._conn.execute(
+                    f"UPDATE channel_messages SET {column} = NULL WHERE ticket_id = ? AND (? IS NULL OR channel = ?)",
+                    (ticket_id, channel, channel),
+                )
+
+    def flush(self):
+        # 更新は即時にコミット済み
+        pass
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # 更新は即時にコミット済みのため、書き出さずに閉じる場合も接続を閉じるだけでよい
+    discard = close
+
+    def open_tickets(self):
+        """
+        通知済みで未完了のチケットIDを返す
+        """
+        return self._query_ids("SELECT id FROM tickets WHERE notified = 1 AND completed = 0 ORDER BY id")
+
+    def pending_candidates(self, created_before):
+        """
+        未着手通知が未送信で、指定時刻より前に作成された未完了チケットIDを返す
+        """
+        # created_onは保存時に秒精度のUTC文字列（...Z）に揃えているため文字列比較で判定できる
+        cutoff = format_redmine_time(created_before)
+        return self._query_ids(
+            "SELECT id FROM tickets WHERE created_on IS NOT NULL AND created_on <= ? "
+            "AND notified = 1 AND completed = 0 ORDER BY id",
+            (cutoff,),
         )
-        # 再通知メッセージIDを保存
-        message_id = response['ts']
-        save_pending_message_mapping(issue['id'], message_id)
-        return True
-    except SlackApiError as e:
-        print(f"  ERROR: Failed to send pending notification for #{issue['id']}: {e.response['error']}")
+
+    def counts(self):
+        """
+        通知済み・完了チケットの件数を返す
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT SUM(notified), SUM(completed) FROM tickets").fetchone()
+        return row[0] or 0, row[1] or 0
+
+    def is_notified(self, ticket_id):
+        return bool(self._get(ticket_id, "notified"))
+
+    def is_open(self, ticket_id):
+        return bool(self._query_one("SELECT notified = 1 AND completed = 0 FROM tickets WHERE id = ?", (ticket_id,)))
+
+    def get_messages(self, ticket_id):
+        return self._get_channel_messages(ticket_id, "message_ts")
+
+    def tickets_for_message(self, message_id, channel=None):
+        if (channel or SLACK_CHANNEL_ID) == SLACK_CHANNEL_ID:
+            return self._query_ids("SELECT id FROM tickets WHERE message_ts = ? ORDER BY id", (message_id,))
+        return self._query_ids(
+            "SELECT ticket_id FROM channel_messages WHERE channel = ? AND message_ts = ? ORDER BY ticket_id",
+            (channel, message_id),
+        )
+
+    def get_tracker(self, ticket_id):
+        return self._get(ticket_id, "tracker_id")
+
+    def get_creation_time(self, ticket_id):
+        return self._get(ticket_id, "created_on")
+
+    def get_pending_messages(self, ticket_id):
+        return self._get_channel_messages(ticket_id, "pending_ts")
+
+    def set_status(self, ticket_id, status):
+        with self._lock:
+            self._conn.execute("UPDATE tickets SET status = ? WHERE id = ?", (status, ticket_id))
+
+    def mark_notified(self, ticket_id):
+        self._set(ticket_id, "notified", 1)
+
+    def mark_completed(self, ticket_id):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO tickets (id, completed, completed_at) VALUES (?, 1, ?) "
+                "ON CONFLICT(id) DO UPDATE SET completed = 1, completed_at = excluded.completed_at",
+                (ticket_id, int(time.time())),
+            )
+
+    def set_message(self, ticket_id, message_id, channel=None):
+        self._set_channel_message(ticket_id, "message_ts", message_id, channel)
+
+    def remove_message(self, ticket_id, channel=None):
+        self._clear_channel_messages(ticket_id, "message_ts", channel)
+
+    def set_tracker(self, ticket_id, tracker_id):
+        self._set(ticket_id, "tracker_id", tracker_id)
+
+    def remove_tracker(self, ticket_id):
+        self._clear(ticket_id, "tracker_id")
+
+    def set_creation_time(self, ticket_id, creation_time):
+        self._set(ticket_id, "created_on", normalize_redmine_time(creation_time))
+
+    def remove_creation_time(self, ticket_id):
+        self._clear(ticket_id, "created_on")
+
+    def set_pending_message(self, ticket_id, message_id, channel=None):
+        self._set_channel_message(ticket_id, "pending_ts", message_id, channel)
+
+    def remove_pending_message(self, ticket_id):
+        self._clear_channel_messages(ticket_id, "pending_ts")
+
+    def forget(self, ticket_id):
+        """
+        削除されたチケットを追跡対象から除外する
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM tickets WHERE id = ? AND completed = 0", (ticket_id,))
+            self._conn.execute(
+                "UPDATE tickets SET notified = 0, tracker_id = NULL, created_on = NULL, "
+                "message_ts = NULL, pending_ts = NULL WHERE id = ?",
+                (ticket_id,),
+            )
+            self._conn.execute("DELETE FROM channel_messages WHERE ticket_id = ?", (ticket_id,))
+
+    def evict_completed(self, completed_before):
+        """
+        指定時刻より前に完了したチケットを取り除き、件数を返す
+        """
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM tickets WHERE completed = 1 AND completed_at < ?",
+                                        (int(completed_before.timestamp()),))
+            if cursor.rowcount:
+                self._conn.execute("DELETE FROM channel_messages WHERE ticket_id NOT IN (SELECT id FROM tickets)")
+        return cursor.rowcount
+
+class ShardLeases:
+    """
+    共有ディレクトリのファイルでバケットのリースとレプリカのハートビートを管理する
+    leases/bucket-NNN.json に所有者と有効期限を、members/インスタンスID.json にハートビートの有効期限を書き、
+    生存しているレプリカの中からバケットごとの担当をランデブーハッシュで決める
+    """
+    def __init__(self, directory, instance_id, lease_seconds):
+        self.directory = directory
+        self.instance_id = instance_id
+        self.lease_seconds = lease_seconds
+
+    def _lease_path(self, bucket):
+        return os.path.join(self.directory, "leases", f"bucket-{bucket:03d}.json")
+
+    def _member_path(self, instance_id):
+        return os.path.join(self.directory, "members", f"{instance_id}.json")
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, path, data):
+        # 複数のレプリカが同じファイルを書き換えるため、一時ファイル名にインスタンスIDを含めてからリネームする
+        tmp_path = f"{path}.{self.instance_id}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def join(self):
+        os.makedirs(os.path.join(self.directory, "leases"), exist_ok=True)
+        os.makedirs(os.path.join(self.directory, "members"), exist_ok=True)
+
+    def leave(self):
+        self._remove(self._member_path(self.instance_id))
+
+    def heartbeat(self, now):
+        """
+        このレプリカのハートビートを更新し、生存しているレプリカのIDを返す
+        期限から十分に時間の経ったレプリカのファイルは取り除く
+        """
+        self._write(self._member_path(self.instance_id), {"expires": now + self.lease_seconds})
+        members = {self.instance_id}
+        for path in glob.glob(os.path.join(self.directory, "members", "*.json")):
+            member = self._read(path)
+            if member is None:
+                continue
+            if member.get("expires", 0) >= now:
+                members.add(os.path.basename(path)[:-len(".json")])
+            elif member.get("expires", 0) < now - self.lease_seconds * 10:
+                self._remove(path)
+        return sorted(members)
+
+    def read(self, bucket):
+        """
+        バケットのリースの (所有者, 有効期限) を返す（リースがない場合は (None, 0)）
+        """
+        lease = self._read(self._lease_path(bucket)) or {}
+        return lease.get("owner"), lease.get("expires", 0)
+
+    def write(self, bucket, now):
+        """
+        このレプリカを所有者としてリースを書き込み、有効期限を返す
+        """
+        expires = now + self.lease_seconds
+        self._write(self._lease_path(bucket), {"owner": self.instance_id, "expires": expires})
+        return expires
+
+    def release(self, bucket):
+        if self.read(bucket)[0] == self.instance_id:
+            self._remove(self._lease_path(bucket))
+
+    @staticmethod
+    def preferred_owner(bucket, members):
+        """
+        バケットを担当するレプリカをランデブーハッシュで選ぶ
+        レプリカが増減しても、担当が移るのは増減したレプリカに関係するバケットだけになる
+        """
+        return max(members, key=lambda member: hashlib.sha1(f"{member}/{bucket}".encode()).digest())
+
+class ShardedTicketState:
+    """
+    チケットIDをバケットに振り分け、リースを持つバケットの状態だけを読み込んで扱う
+    バケットごとに SHARD_DIR/bucket-NNN/ に状態とハイウォーターマークを保存し、
+    担当が移ったバケットは新しい担当のレプリカがそのディレクトリから読み込んで引き継ぐ
+    リースの延長と担当の入れ替えはバックグラウンドのスレッドで有効期間の1/3ごとに行う
+    担当していないチケットの参照は未通知として扱い、更新は保存できなかったことを表示して無視する
+    """
+    def __init__(self, directory, bucket_count, leases, legacy_directory=None):
+        self.directory = directory
+        self.bucket_count = bucket_count
+        self.leases = leases
+        self.legacy_directory = legacy_directory    # 分担前の状態ファイルの場所
+        self.buckets = {}             # 担当しているバケット -> 状態
+        self.expires = {}             # 担当しているバケット -> リースの有効期限
+        self.high_water_marks = {}    # 担当しているバケット -> ハイウォーターマーク
+        self._claims = set()          # リースを書き込み、次のハートビートで取得を確認するバケット
+        self._poll_buckets = set()    # 実行中の新規チケットの取得を始めた時点で担当していたバケット
+        self._in_use = 0              # 担当しているバケットの状態をまとめて参照している処理の数
+        self._retired = []            # (バケット, 状態, リースを手放すか) 参照が終わってから閉じるバケット
+        self._legacy = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.RLock()
+
+    def bucket_of(self, ticket_id):
+        return ticket_id % self.bucket_count
+
+    def bucket_dir(self, bucket):
+        return os.path.join(self.directory, f"bucket-{bucket:03d}")
+
+    def load(self):
+        """
+        ハートビートを始める（バケットは次のハートビートでリースを確認してから読み込む）
+        """
+        self.leases.join()
+        self.heartbeat()
+        self._thread = threading.Thread(target=self._run, name="shard-heartbeat", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.leases.lease_seconds / 3):
+            try:
+                self.heartbeat()
+            except OSError as e:
+                print(f"  SHARD: Heartbeat failed: {e}")
+
+    def heartbeat(self):
+        """
+        リースを延長し、担当の変わったバケットを引き渡し・引き継ぐ
+        リースは書き込んだ次のハートビートでも自分が所有者のままであることを確認してから使い始める
+        （同時に書き込んだレプリカのうち、最後に書き込んだものだけが取得する）
+        """
+        now = time.time()
+        me = self.leases.instance_id
+        members = self.leases.heartbeat(now)
+        for bucket in range(self.bucket_count):
+            owner, expires = self.leases.read(bucket)
+            preferred = self.leases.preferred_owner(bucket, members)
+            if bucket in self.buckets:
+                if owner != me:
+                    print(f"  SHARD: Lost bucket {bucket} to {owner or 'expiry'}")
+                    self._drop(bucket)
+                elif preferred != me:
+                    self._drop(bucket, release=True)
+                    print(f"  SHARD: Handed over bucket {bucket} to {preferred}")
+                else:
+                    with self._lock:
+                        if self.expires[bucket] < now:
+                            # 延長が間に合わなかった間は担当していないものとして取得したチケットを読み飛ばしたため、
+                            # 実行中の取得ではこのバケットのハイウォーターマークを進めない
+                            print(f"  SHARD: Lease of bucket {bucket} lapsed before renewal")
+                            self._poll_buckets.discard(bucket)
+                        self.expires[bucket] = self.leases.write(bucket, now)
+            elif bucket in self._claims:
+                self._claims.discard(bucket)
+                if owner == me and preferred == me:
+                    self._acquire(bucket, self.leases.write(bucket, now))
+                elif owner == me:
+                    self.leases.release(bucket)
+            elif preferred == me and (owner is None or expires < now):
+                self.leases.write(bucket, now)
+                self._claims.add(bucket)
+        # 分担前の状態は最初に引き継いだバケットの作成にだけ使う
+        self._legacy = None
+
+    def _acquire(self, bucket, expires):
+        """
+        バケットの状態とハイウォーターマークを読み込み、担当を始める
+        """
+        directory = self.bucket_dir(bucket)
+        mark_path = state_path(directory, LAST_CHECK_FILE)
+        if not os.path.exists(mark_path):
+            os.makedirs(directory, exist_ok=True)
+            # ハイウォーターマークはバケットの作成が完了した印として最後に書き込む
+            save_high_water_mark(self._initialize(bucket, directory), mark_path)
+        bucket_state = create_state(directory)
+        bucket_state.load()
+        high_water_mark = load_high_water_mark(mark_path) or datetime.now(timezone.utc)
+        with self._lock:
+            self.buckets[bucket] = bucket_state
+            self.expires[bucket] = expires
+            self.high_water_marks[bucket] = high_water_mark
+        notified_count, _ = bucket_state.counts()
+        print(f"  SHARD: Took over bucket {bucket} ({notified_count} notified tickets)")
+
+    def _initialize(self, bucket, directory):
+        """
+        初めて担当するバケットに、分担前の状態ファイルから該当するチケットを書き出す
+        バケットのハイウォーターマークの初期値（分担前のもの、なければ現在時刻）を返す
+        """
+        if self._legacy is None:
+            self._legacy = TicketState(self.legacy_directory)
+            self._legacy.load(read_only=True)
+        count = self._legacy.partition(directory, lambda ticket_id: self.bucket_of(ticket_id) == bucket)
+        if count:
+            print(f"  SHARD: Moved {count} notified tickets into bucket {bucket}")
+        return load_high_water_mark(state_path(self.legacy_directory, LAST_CHECK_FILE)) or datetime.now(timezone.utc)
+
+    def _drop(self, bucket, release=False):
+        """
+        バケットの担当をやめる
+        release=True の場合は状態を書き出して閉じ、その後にリースを手放す
+        リースを失った場合はバケットのファイルを他のレプリカが使い始めているため、状態を書き出さずに破棄する
+        メインループが担当しているバケットの状態をまとめて参照している間は、参照が終わるまで閉じるのを待つ
+        """
+        with self._lock:
+            bucket_state = self.buckets.pop(bucket)
+            self.expires.pop(bucket, None)
+            self.high_water_marks.pop(bucket, None)
+            # 実行中の取得の間に引き継ぎ直した場合も、手放していた間のチケットは取得していない
+            self._poll_buckets.discard(bucket)
+            if self._in_use:
+                self._retired.append((bucket, bucket_state, release))
+                return
+        self._retire(bucket, bucket_state, release)
+
+    def _retire(self, bucket, bucket_state, release):
+        if release:
+            bucket_state.close()
+            self.leases.release(bucket)
+        else:
+            bucket_state.discard()
+
+    def close(self):
+        """
+        ハートビートを止め、担当しているバケットの状態を書き出してリースを手放す
+        手放したバケットは他のレプリカが次のハートビートで引き継ぐ
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        for bucket in list(self.buckets):
+            self._drop(bucket, release=True)
+        for bucket in self._claims:
+            self.leases.release(bucket)
+        self.leases.leave()
+
+    def owns(self, ticket_id):
+        return self._bucket_state(ticket_id) is not None
+
+    def owned_buckets(self):
+        """
+        担当しているバケットの番号を返す（ハートビートのスレッドが入れ替えるため、ロックを取って読む）
+        """
+        with self._lock:
+            return sorted(self.buckets)
+
+    def _bucket_state(self, ticket_id):
+        # リースの延長が間に合っていないバケットは担当していないものとして扱う
+        bucket = self.bucket_of(ticket_id)
+        with self._lock:
+            if self.expires.get(bucket, 0) < time.time():
+                return None
+            return self.buckets.get(bucket)
+
+    def _call(self, ticket_id, method, *args, default=None):
+        with self._lock:
+            bucket_state = self._bucket_state(ticket_id)
+            if bucket_state is None:
+                return default
+            return getattr(bucket_state, method)(ticket_id, *args)
+
+    def _update(self, ticket_id, method, *args):
+        """
+        担当しているバケットの状態を更新する
+        通知などの処理の途中でリースが切れた場合は、新しい担当が同じ処理を繰り返す可能性があるため表示しておく
+        """
+        with self._lock:
+            bucket_state = self._bucket_state(ticket_id)
+            if bucket_state is not None:
+                getattr(bucket_state, method)(ticket_id, *args)
+                return
+        print(f"  SHARD: Bucket {self.bucket_of(ticket_id)} is not owned, {method} for #{ticket_id} was not saved")
+
+    @contextmanager
+    def _states(self):
+        """
+        担当しているバケットの状態のリストを返す
+        使っている間にハートビートで担当をやめたバケットは、使い終わってから閉じる
+        """
+        with self._lock:
+            states = list(self.buckets.values())
+            self._in_use += 1
+        try:
+            yield states
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                retired = [] if self._in_use else self._retired
+                if not self._in_use:
+                    self._retired = []
+            for bucket, bucket_state, release in retired:
+                self._retire(bucket, bucket_state, release)
+
+    def begin_poll(self):
+        """
+        新規チケットの取得を始める前に呼び、担当しているバケットのうち最も古いハイウォーターマークを返す
+        （担当しているバケットがない場合は現在時刻）
+        """
+        with self._lock:
+            self._poll_buckets = set(self.high_water_marks)
+        return self.high_water_mark() or datetime.now(timezone.utc)
+
+    def high_water_mark(self):
+        with self._lock:
+            return min(self.high_water_marks.values(), default=None)
+
+    def save_high_water_mark(self, high_water_mark):
+        """
+        取得を始めた時点から途切れずにリースを持っているバケットのハイウォーターマークを進める
+        （取得中に引き継いだバケットやリースが切れていたバケットは、担当していない間のチケットを読み飛ばしたため進めない）
+        """
+        now = time.time()
+        with self._lock:
+            for bucket in self._poll_buckets & self.high_water_marks.keys():
+                if self.expires.get(bucket, 0) < now:
+                    continue
+                if self.high_water_marks[bucket] < high_water_mark:
+                    self.high_water_marks[bucket] = high_water_mark
+                    save_high_water_mark(high_water_mark, state_path(self.bucket_dir(bucket), LAST_CHECK_FILE))
+
+    @property
+    def bytes_written(self):
+        with self._states() as states:
+            return sum(getattr(bucket_state, "bytes_written", 0) for bucket_state in states)
+
+    def _leased(self, bucket_state):
+        # リースが切れたバケットのファイルは他のレプリカが使い始めている場合があるため書き込まない
+        now = time.time()
+        with self._lock:
+            return any(state is bucket_state and self.expires.get(bucket, 0) >= now
+                       for bucket, state in self.buckets.items())
+
+    def flush(self):
+        with self._states() as states:
+            for bucket_state in states:
+                if self._leased(bucket_state):
+                    bucket_state.flush()
+
+    def open_tickets(self):
+        with self._states() as states:
+            return sorted(itertools.chain.from_iterable(s.open_tickets() for s in states))
+
+    def pending_candidates(self, created_before):
+        with self._states() as states:
+            return sorted(itertools.chain.from_iterable(s.pending_candidates(created_before) for s in states))
+
+    def counts(self):
+        with self._states() as states:
+            counts = [bucket_state.counts() for bucket_state in states]
+        return sum(c[0] for c in counts), sum(c[1] for c in counts)
+
+    def evict_completed(self, completed_before):
+        with self._states() as states:
+            return sum(bucket_state.evict_completed(completed_before) for bucket_state in states
+                       if self._leased(bucket_state))
+
+    def is_notified(self, ticket_id):
+        return self._call(ticket_id, "is_notified", default=False)
+
+    def is_open(self, ticket_id):
+        return self._call(ticket_id, "is_open", default=False)
+
+    def get_messages(self, ticket_id):
+        return self._call(ticket_id, "get_messages", default={})
+
+    def tickets_for_message(self, message_id, channel=None):
+        # まとめて通知したチケットは通知時に担当していたバケットのいずれかにある
+        with self._states() as states:
+            return sorted(itertools.chain.from_iterable(s.tickets_for_message(message_id, channel) for s in states))
+
+    def get_tracker(self, ticket_id):
+        return self._call(ticket_id, "get_tracker")
+
+    def get_creation_time(self, ticket_id):
+        return self._call(ticket_id, "get_creation_time")
+
+    def get_pending_messages(self, ticket_id):
+        return self._call(ticket_id, "get_pending_messages", default={})
+
+    def set_status(self, ticket_id, status):
+        self._update(ticket_id, "set_status", status)
+
+    def mark_notified(self, ticket_id):
+        self._update(ticket_id, "mark_notified")
+
+    def mark_completed(self, ticket_id):
+        self._update(ticket_id, "mark_completed")
+
+    def set_message(self, ticket_id, message_id, channel=None):
+        self._update(ticket_id, "set_message", message_id, channel)
+
+    def remove_message(self, ticket_id, channel=None):
+        self._update(ticket_id, "remove_message", channel)
+
+    def set_tracker(self, ticket_id, tracker_id):
+        self._update(ticket_id, "set_tracker", tracker_id)
+
+    def remove_tracker(self, ticket_id):
+        self._update(ticket_id, "remove_tracker")
+
+    def set_creation_time(self, ticket_id, creation_time):
+        self._update(ticket_id, "set_creation_time", creation_time)
+
+    def remove_creation_time(self, ticket_id):
+        self._update(ticket_id, "remove_creation_time")
+
+    def set_pending_message(self, ticket_id, message_id, channel=None):
+        self._update(ticket_id, "set_pending_message", message_id, channel)
+
+    def remove_pending_message(self, ticket_id):
+        self._update(ticket_id, "remove_pending_message")
+
+    def forget(self, ticket_id):
+        self._update(ticket_id, "forget")
+
+def create_state(directory=None, shard_dir=None):
+    """
+    STATE_BACKENDに応じた状態の保存先を作成する
+    directory を指定した場合は、設定されたファイル名でそのディレクトリに保存する
+    shard_dir を指定した場合は、バケットごとの状態をまとめて扱う ShardedTicketState を作成する
+    """
+    if shard_dir:
+        leases = ShardLeases(shard_dir, SHARD_INSTANCE_ID, SHARD_LEASE_SECONDS)
+        return ShardedTicketState(shard_dir, SHARD_BUCKETS, leases, legacy_directory=directory)
+    if STATE_BACKEND == "sqlite":
+        return SqliteTicketState(state_path(directory, STATE_DB_FILE), directory)
+    return TicketState(directory)
+
+# チケットの追跡状態（インスタンスごとに作成し、main()の開始時に読み込む）
+state = InstanceAttribute("state")
+
+def evict_expired_tickets(now):
+    """
+    完了から COMPLETED_RETENTION_DAYS を過ぎたチケットを追跡状態から取り除く
+    """
+    if COMPLETED_RETENTION_DAYS <= 0:
+        return 0
+    evicted = state.evict_completed(now - timedelta(days=COMPLETED_RETENTION_DAYS))
+    if evicted:
+        print(f"  STATE: Evicted {evicted} tickets completed more than {COMPLETED_RETENTION_DAYS:g} days ago")
+    return evicted
+
+def remove_deleted_tickets_from_tracking(deleted_ticket_ids):
+    """
+    削除されたチケットを追跡対象から除外する
+    """
+    for ticket_id in deleted_ticket_ids:
+        state.forget(ticket_id)
+
+    if deleted_ticket_ids:
+        print(f"  CLEANUP: Removed {len(deleted_ticket_ids)} deleted tickets from tracking")
+
+class TokenBucket:
+    """
+    一定のレートでトークンを補充し、トークンがない間は呼び出し元を待たせる
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate                  # 1秒あたりの補充数
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                # 停止中の時間分はトークンを補充しない
+                refill_from = max(self.updated_at, self.blocked_until)
+                if now > refill_from:
+                    self.tokens = min(self.capacity, self.tokens + (now - refill_from) * self.rate)
+                self.updated_at = now
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Retry-Afterなどで指定された時間、トークンの払い出しを止める
+        """
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+class SlackDispatcher:
+    """
+    Slack Web APIの呼び出しをメソッドごとのレート制限に合わせて送信する
+    ratelimited の場合はRetry-Afterに従い、一時的なエラーはジッター付きの指数バックオフで再試行する
+    """
+    def __init__(self, client):
+        self.client = client
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.queue_depth = 0       # レート制限や再試行で送信を待っている呼び出しの数
+        self.stats = {"calls": 0, "retries": 0, "ratelimited": 0, "failures": 0, "max_queue_depth": 0}
+
+    def _bucket(self, method, channel):
+        # chat.postMessage はチャンネルごと、それ以外はメソッドごとに制限する
+        key = (method, channel if method == "chat_postMessage" else None)
+        with self._lock:
+            if key not in self._buckets:
+                rate, capacity = SLACK_RATE_LIMITS.get(method, SLACK_DEFAULT_RATE_LIMIT)
+                self._buckets[key] = TokenBucket(rate, capacity)
+            return self._buckets[key]
+
+    def _update(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                if name == "queue_depth":
+                    self.queue_depth += delta
+                    self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], self.queue_depth)
+                else:
+                    self.stats[name] += delta
+
+    def call(self, method, **kwargs):
+        """
+        Slack Web APIのメソッドを呼び出す
+        再試行しても失敗した場合は最後のSlackApiErrorを送出する
+        """
+        bucket = self._bucket(method, kwargs.get("channel"))
+        self._update(queue_depth=1)
+        try:
+            for attempt in range(SLACK_MAX_RETRIES + 1):
+                bucket.acquire()
+                self._update(calls=1)
+                start = time.monotonic()
+                outcome = "error"
+                try:
+                    response = getattr(self.client, method)(**kwargs)
+                    outcome = "ok"
+                    if recorder.active:
+                        recorder.record_slack(method, kwargs, getattr(response, "status_code", 200),
+                                              getattr(response, "data", response))
+                    return response
+                except SlackApiError as e:
+                    status_code = getattr(e.response, "status_code", None)
+                    if recorder.active:
+                        recorder.record_slack(method, kwargs, status_code, getattr(e.response, "data", None))
+                    if status_code == 429 or e.response.get("error") == "ratelimited":
+                        # Retry-Afterの間はこのメソッドの送信を止めて待つ
+                        outcome = "ratelimited"
+                        self._update(ratelimited=1)
+                        retry_after = float(e.response.headers.get("Retry-After", 1))
+                        bucket.pause(retry_after + random.uniform(0, 1))
+                    elif status_code is not None and status_code >= 500:
+                        outcome = "server_error"
+                        bucket.pause(min(2 ** attempt, 30) * random.uniform(0.5, 1.5))
+                    else:
+                        self._update(failures=1)
+                        raise
+                    if attempt == SLACK_MAX_RETRIES:
+                        self._update(failures=1)
+                        raise
+                    self._update(retries=1)
+                finally:
+                    trace_count(slack_calls=1)
+                    metrics.observe("slack_call_duration_seconds", time.monotonic() - start, method=method)
+                    metrics.inc("slack_requests_total", method=method, outcome=outcome)
+        finally:
+            self._update(queue_depth=-1)
+
+# Slack Web APIの呼び出し（レート制限と再試行を行う）
+slack = SlackDispatcher(slack_client)
+
+def get_slack_username(redmine_user_name):
+    """
+    Redmineの担当者名からSlackのユーザネームを取得する
+    """
+    if not redmine_user_name:
+        return None
+    return USER_MAPPING.get(redmine_user_name, None)
+
+def create_mention_text(issue, mentions=()):
+    """
+    チケットの担当者と、ルーティングルールで指定されたメンバーへのSlackの@メンション文字列を作成する
+    """
+    slack_username = get_slack_username(issue.get('assigned_to', {}).get('name', '未割り当て'))
+    user_ids = [slack_username] if slack_username else []
+    user_ids += [user_id for user_id in mentions if user_id not in user_ids]
+    if user_ids:
+        return " ".join(f"<@{user_id}>" for user_id in user_ids)
+    return None
+
+def truncate_description(description, max_length=250):
+    """
+    descriptionが指定の文字数以上の場合、切り詰めて...を追加する
+    """
+    if not description:
+        return description
+    if len(description) > max_length:
+        return description[:max_length] + "..."
+    return description
+
+class RoutingTable:
+    """
+    (プロジェクト, トラッカー, 優先度) の組み合わせから通知先のチャンネルとメンションを引く表
+    起動時にルールを各IDの組み合わせ（指定のない項目はNone）をキーとする辞書に展開しておき、
+    チケットごとの振り分けはルールの数によらず、指定あり・なしの組み合わせ8通りの辞書引きで行う
+    """
+    FIELDS = (("projects", "project"), ("trackers", "tracker"), ("priorities", "priority"))
+
+    def __init__(self, rules):
+        if not isinstance(rules, list):
+            raise ValueError("routing rules must be a JSON list")
+        self.rules = []
+        self._table = {}    # (プロジェクトID, トラッカーID, 優先度ID) -> 該当するルールのリスト
+        self._routes = {}   # 振り分け結果のキャッシュ
+        for index, rule in enumerate(rules):
+            if not isinstance(rule, dict) or not isinstance(rule.get("channel"), str) or not rule["channel"]:
+                raise ValueError(f"rule {index}: a channel is required")
+            rule = {
+                "channel": rule["channel"],
+                "mentions": [str(user_id) for user_id in rule.get("mentions", [])],
+                **{field: [int(x) for x in rule.get(field) or []] for field, _ in self.FIELDS},
+            }
+            self.rules.append(rule)
+            for key in itertools.product(*(rule[field] or [None] for field, _ in self.FIELDS)):
+                self._table.setdefault(key, []).append(rule)
+
+        self.channels = sorted({rule["channel"] for rule in self.rules})
+        # 全てのルールがIDを指定している項目だけ、Redmine側の検索条件に使う
+        self.project_ids, self.tracker_ids = (
+            sorted({x for rule in self.rules for x in rule[field]}) if all(rule[field] for rule in self.rules) else []
+            for field in ("projects", "trackers")
+        )
+
+    def routes(self, issue):
+        """
+        チケットの通知先を チャンネル -> メンションするSlackのメンバーIDのリスト で返す（対象外の場合は空）
+        """
+        ids = tuple(issue.get(attr, {}).get('id') for _, attr in self.FIELDS)
+        routes = self._routes.get(ids)
+        if routes is None:
+            routes = {}
+            for key in itertools.product(*((x, None) for x in ids)):
+                for rule in self._table.get(key, ()):
+                    mentions = routes.setdefault(rule["channel"], [])
+                    mentions += [user_id for user_id in rule["mentions"] if user_id not in mentions]
+            self._routes[ids] = routes
+        return routes
+
+def load_routing_table(rules_file=ROUTING_RULES_FILE, channel=SLACK_CHANNEL_ID,
+                       project_ids=NOTIFY_PROJECT_IDS, tracker_ids=NOTIFY_TRACKER_IDS):
+    """
+    ルールファイルからルーティング表を作成する
+    ファイルの指定がない場合はチャンネルとトラッカー・プロジェクトの条件を1つのルールとする
+    """
+    if not rules_file:
+        return RoutingTable([{"channel": channel, "projects": project_ids, "trackers": tracker_ids}])
+    try:
+        with open(rules_file, "r") as f:
+            return RoutingTable(json.load(f))
+    except (OSError, ValueError, TypeError) as e:
+        print(f"ルーティングルールを読み込めません ({rules_file}): {e}")
+        sys.exit(1)
+
+# チケットの通知先のルーティング表（インスタンスごとに作成する）
+routing = InstanceAttribute("routing")
+
+def is_notification_target(issue):
+    """
+    いずれかのルーティングルールに該当するチケットかどうかを判定する
+    """
+    return bool(routing.routes(issue))
+
+def owns_ticket(ticket_id):
+    """
+    このレプリカが担当するチケットかどうかを判定する（SHARD_DIR が未設定の場合は常に担当する）
+    """
+    return not SHARD_DIR or state.owns(ticket_id)
+
+def is_already_notified(issue):
+    """
+    既に通知済みのチケットかどうかを判定する
+    """
+    return state.is_notified(issue['id'])
+
+def get_ticket_status(ticket_id):
+    """
+    指定されたチケットIDのステータスを取得する
+    """
+    try:
+        status_code, data = redmine.get_json_cached(f"/issues/{ticket_id}.json", name="issue")
+        if status_code == 404:
+            return "削除済み"
+        issue = data.get("issue", {})
+        return issue.get("status", {}).get("name", "不明")
+    except requests.exceptions.RequestException as e:
+        print(f"Error getting status for ticket #{ticket_id}: {e}")
+        return "不明"
+
+def get_ticket_info(ticket_id):
+    """
+    指定されたチケットIDの詳細情報を取得する
+    """
+    try:
+        # 前回から変更がなければキャッシュ済みの内容を使う
+        status_code, data = redmine.get_json_cached(f"/issues/{ticket_id}.json", name="issue")
+        if status_code == 404:
+            return None  # チケットが削除された
+        return data.get("issue", {})
+    except requests.exceptions.RequestException as e:
+        print(f"Error getting info for ticket #{ticket_id}: {e}")
+        # HTTPエラーの場合は例外を再発生させて、上位で処理させる
+        raise
+
+def fetch_tickets_parallel(ticket_ids):
+    """
+    チケットの詳細情報をスレッドプールで並行して取得する
+    結果は (チケットID, チケット情報, 例外) のリストとして、ticket_idsと同じ順序で返す
+    取得に失敗したチケットは例外を格納し、他のチケットの取得には影響させない
+    """
+    def fetch(ticket_id):
+        try:
+            return ticket_id, get_ticket_info(ticket_id), None
+        except requests.exceptions.RequestException as e:
+            return ticket_id, None, e
+
+    # 実行中のスパンをワーカースレッドに引き継ぐ
+    futures = [fetch_executor.submit(contextvars.copy_context().run, fetch, ticket_id) for ticket_id in ticket_ids]
+    return [future.result() for future in futures]
+
+def get_tickets_info_bulk(ticket_ids):
+    """
+    複数チケットの詳細情報を /issues.json でまとめて取得する
+    レスポンスに含まれなかったチケットIDは削除候補として返す
+    """
+    issues = {}
+    missing = []
+    ticket_ids = sorted(ticket_ids)
+    
+    for i in range(0, len(ticket_ids), BULK_FETCH_CHUNK_SIZE):
+        chunk = ticket_ids[i:i + BULK_FETCH_CHUNK_SIZE]
+        chunk_issues = {}
+        try:
+            # 終了済みも含めて取得するため status_id=* を指定する
+            params = {
+                "issue_id": ",".join(str(ticket_id) for ticket_id in chunk),
+                "status_id": "*"
+            }
+            for issue in iter_issues(params):
+                chunk_issues[issue['id']] = issue
+        except requests.exceptions.RequestException as e:
+            # 取得に失敗したチャンクは削除扱いにせず、次回に再試行
+            print(f"  ERROR: Failed to bulk check tickets #{chunk[0]}-#{chunk[-1]}: {e}")
+            continue
+        
+        issues.update(chunk_issues)
+        missing.extend(ticket_id for ticket_id in chunk if ticket_id not in chunk_issues)
+    
+    return issues, missing
+
+def describe_deletion_reactions(original_reaction, pending_reaction):
+    """
+    ゴミ箱リアクションの追加結果をログ用の文字列にする
+    """
+    if original_reaction and pending_reaction:
+        return "Both messages marked with wastebasket reaction"
+    elif original_reaction:
+        return "Original message marked with wastebasket reaction"
+    elif pending_reaction:
+        return "Pending message marked with wastebasket reaction"
+    return "No messages found"
+
+def handle_deleted_ticket(ticket_id):
+    """
+    削除されたチケットの両方のメッセージにゴミ箱リアクションを追加する
+    """
+    original_reaction = add_deletion_reaction(ticket_id)
+    pending_reaction = add_pending_deletion_reaction(ticket_id)
+    print(f"  TICKET DELETED: #{ticket_id} ({describe_deletion_reactions(original_reaction, pending_reaction)})")
+
+def handle_completed_ticket(ticket_id, issue):
+    """
+    完了ステータスのチケットを完了として記録し、メッセージにリアクションを追加する
+    トラッカーが変更されている場合は完了ではなくゴミ箱リアクションを追加する
+    完了として処理した場合はTrueを返す
+    """
+    status = issue.get("status", {}).get("name", "不明")
+    # 完了ステータスかチェック（「完了」「終了」「クローズ」など）
+    if status not in ["完了", "終了", "クローズ", "Closed", "Resolved", "Done"]:
+        return False
+
+    state.mark_completed(ticket_id)
+
+    if not handle_tracker_change(ticket_id, issue):
+        # 元のメッセージにリアクションを追加
+        add_completion_reaction(ticket_id)
+        # 再通知メッセージにもリアクションを追加
+        add_pending_completion_reaction(ticket_id)
+        print(f"  COMPLETED: #{ticket_id} - {issue.get('subject', 'No subject')}")
+
+    # トラッカーマッピングを削除
+    state.remove_tracker(ticket_id)
+    # 作成時刻マッピングを削除
+    state.remove_creation_time(ticket_id)
+    # 再通知メッセージマッピングを削除
+    state.remove_pending_message(ticket_id)
+    return True
+
+def handle_tracker_change(ticket_id, issue):
+    """
+    完了したチケットのトラッカーが通知時から変更されている場合は両方のメッセージにゴミ箱リアクションを追加する
+    トラッカーが変更されていた場合はTrueを返す
+    """
+    current_tracker_id = issue.get("tracker", {}).get("id")
+    original_tracker_id = state.get_tracker(ticket_id)
+    if not original_tracker_id or current_tracker_id == original_tracker_id:
         return False
 
+    original_reaction = add_deletion_reaction(ticket_id)
+    pending_reaction = add_pending_deletion_reaction(ticket_id)
+    print(f"  COMPLETED (tracker changed): #{ticket_id} - {issue.get('subject', 'No subject')} ({describe_deletion_reactions(original_reaction, pending_reaction)})")
+    return True
+
+def handle_pending_ticket(ticket_id, issue, current_time):
+    """
+    作成から指定時間が経過しても未着手のチケットを再通知する
+    """
+    status = issue.get("status", {}).get("name", "不明")
+    # 未着手ステータスかチェック（「未着手」のみ）
+    if status not in ["未着手"]:
+        return
+
+    # 作成時刻を取得
+    creation_time_str = state.get_creation_time(ticket_id)
+    if not creation_time_str:
+        return
+    try:
+        creation_time = parse_redmine_time(creation_time_str)
+    except ValueError as e:
+        print(f"  ERROR: Failed to parse creation time for #{ticket_id}: {e}")
+        return
+
+    # 指定時間経過しているかチェック
+    time_elapsed = (current_time - creation_time).total_seconds()
+    if time_elapsed >= PENDING_NOTIFICATION_INTERVAL_SECONDS:
+        # 未着手通知を送信
+        if send_pending_notification_with_mention(issue):
+            print(f"  PENDING NOTIFICATION: #{ticket_id} - {issue.get('subject', 'No subject')} (elapsed: {int(time_elapsed/60)} minutes)")
+            # 作成時刻マッピングから削除（一度通知したら再通知しない）
+            state.remove_creation_time(ticket_id)
+
+def handle_open_ticket(ticket_id, issue, current_time, check_pending):
+    """
+    通知済みで未完了のチケットの現在の状態を完了（トラッカー変更）・未着手の各処理に振り分ける
+    完了として処理した場合はTrueを返す
+    """
+    state.set_status(ticket_id, issue.get("status", {}).get("name", "不明"))
+    if handle_completed_ticket(ticket_id, issue):
+        return True
+    if check_pending:
+        handle_pending_ticket(ticket_id, issue, current_time)
+    return False
+
+def handle_open_ticket_once(ticket_id, issue, current_time, check_pending):
+    """
+    他の処理が同じチケットを処理中でなく、まだ未完了の場合だけ handle_open_ticket を実行する
+    完了として処理した場合はTrue、処理しなかった場合はNoneを返す
+    """
+    # Webhookと通知済みチケットの確認が同じチケットの完了・未着手を同時に処理しないようにする
+    handling_tickets = get_instance().handling_tickets
+    with notifying_lock:
+        if ticket_id in handling_tickets or not state.is_open(ticket_id):
+            return None
+        handling_tickets.add(ticket_id)
+    try:
+        return handle_open_ticket(ticket_id, issue, current_time, check_pending)
+    finally:
+        with notifying_lock:
+            handling_tickets.discard(ticket_id)
+
+def observe_ticket_update(ticket_id, issue):
+    """
+    前回の確認から更新されたチケットかどうかを判定する
+    初めて確認したチケットは変化なしとする
+    """
+    updated_on = issue.get("updated_on")
+    ticket_updated_on = get_instance().ticket_updated_on
+    previous = ticket_updated_on.get(ticket_id)
+    ticket_updated_on[ticket_id] = updated_on
+    return previous is not None and previous != updated_on
+
+def forget_ticket_update(ticket_id):
+    """
+    追跡をやめたチケットの前回の更新日時を破棄する
+    """
+    get_instance().ticket_updated_on.pop(ticket_id, None)
+
+def completion_check_interval(ticket_id, issue, now):
+    """
+    チケットの次回の完了確認までの間隔（秒）を返す
+    最後の更新から時間が経っているほど間隔を延ばし、未着手通知の予定時刻は過ぎないようにする
+    """
+    try:
+        last_change = parse_redmine_time(issue.get("updated_on") or issue["created_on"])
+        age = max((now - last_change).total_seconds(), 0)
+    except (KeyError, ValueError):
+        age = 0
+    interval = min(max(age * COMPLETION_CHECK_AGE_RATIO, SWEEP_INTERVAL), COMPLETION_CHECK_MAX_INTERVAL)
+
+    if PENDING_NOTIFICATION_ENABLED:
+        creation_time_str = state.get_creation_time(ticket_id)
+        try:
+            pending_due = parse_redmine_time(creation_time_str) + timedelta(seconds=PENDING_NOTIFICATION_INTERVAL_SECONDS)
+            if pending_due > now:
+                interval = min(interval, (pending_due - now).total_seconds())
+        except (AttributeError, ValueError):
+            # 未着手通知を送信済みで作成時刻の記録がない場合など
+            pass
+    return interval
+
+class CompletionCheckQueue:
+    """
+    通知済みチケットの次回の完了確認の時刻を優先度付きキューで管理する
+    取り出したチケットのうち再登録されなかったもの（取得の失敗など）は、次の周期に初めて見るチケットとしてすぐに確認する
+    確認時刻は実際に確認を始めた時刻から数えるため、確認の開始の遅れで次の確認を1周期逃さないように、
+    tolerance 秒以内に確認時刻が来るチケットは確認時刻を過ぎたものとして扱う
+    """
+    def __init__(self, tolerance=SWEEP_INTERVAL / 2):
+        self.tolerance = tolerance
+        self._heap = []               # (次回の確認時刻, チケットID)
+        self._next_check = {}         # チケットID -> 次回の確認時刻（UNIX時刻）
+        self._lock = threading.Lock()
+
+    def pop_due(self, open_tickets, now):
+        """
+        確認時刻を過ぎたチケットIDを取り出す
+        キューにない通知済みチケットは確認時刻を過ぎたものとして扱い、未完了でなくなったチケットは取り除く
+        """
+        now_ts = now.timestamp()
+        open_set = set(open_tickets)
+        with self._lock:
+            for ticket_id in open_set - self._next_check.keys():
+                self._next_check[ticket_id] = now_ts
+                heapq.heappush(self._heap, (now_ts, ticket_id))
+            for ticket_id in self._next_check.keys() - open_set:
+                del self._next_check[ticket_id]
+
+            due = []
+            while self._heap and self._heap[0][0] <= now_ts + self.tolerance:
+                check_at, ticket_id = heapq.heappop(self._heap)
+                # 再登録や取り除きで古くなった要素は読み飛ばす
+                if self._next_check.get(ticket_id) != check_at:
+                    continue
+                del self._next_check[ticket_id]
+                due.append(ticket_id)
+        return sorted(due)
+
+    def schedule(self, ticket_id, issue, now):
+        """
+        チケットの次回の確認時刻を登録する（登録済みの場合は置き換える）
+        """
+        check_at = now.timestamp() + completion_check_interval(ticket_id, issue, now)
+        with self._lock:
+            self._next_check[ticket_id] = check_at
+            heapq.heappush(self._heap, (check_at, ticket_id))
+
+    def seconds_until_next(self, now):
+        with self._lock:
+            if not self._next_check:
+                return None
+            return max(min(self._next_check.values()) - self.tolerance - now.timestamp(), 0)
+
+    def __len__(self):
+        return len(self._next_check)
+
+# 通知済みチケットの完了確認の予定（インスタンスごとに作成する）
+completion_checks = InstanceAttribute("completion_checks")
+
+class Instance:
+    """
+    1台のRedmineサーバーを扱うための設定と状態
+    Slackへの送信・Redmineへの接続プール・ワーカースレッドは全てのインスタンスで共有する
+    """
+    def __init__(self, name, redmine_client, routing_table, state_dir=None, shard_dir=None):
+        self.name = name
+        self.redmine = redmine_client
+        self.routing = routing_table
+        self.state_dir = state_dir               # 状態ファイルの保存先（省略時は各ファイルの設定のパス）
+        self.state = create_state(state_dir, shard_dir)
+        self.last_check_file = state_path(state_dir, LAST_CHECK_FILE)
+        self.completion_checks = CompletionCheckQueue()
+        self.ticket_updated_on = {}              # チケットID -> 前回確認した時点の更新日時（変化の検出用）
+        self.notifying_tickets = set()           # 通知処理中のチケットID
+        self.handling_tickets = set()            # 完了・未着手の処理中のチケットID
+        self.recent_arrivals = deque()           # (時刻, 件数) 直近に通知対象になった新規チケット（まとめて通知するかの判定用）
+        self.high_water_mark = None
+        self.last_poll = None                    # 最後に新規チケットの取得を終えた時刻（UNIX時刻）
+        self.scheduler = None
+
+def load_instances():
+    """
+    INSTANCES_FILE からインスタンスを作成する
+    ファイルの指定がない場合は REDMINE_URL のサーバーを1つのインスタンスとして扱う
+    各インスタンスの状態は state_dir（省略時は LAST_CHECK_FILE と同じディレクトリの下のインスタンス名）に保存する
+    """
+    if not INSTANCES_FILE:
+        session = create_redmine_session(REDMINE_POOL_SIZE)
+        return [Instance("default", RedmineClient(REDMINE_URL, REDMINE_API_KEY, session), load_routing_table(),
+                         shard_dir=SHARD_DIR)]
+    try:
+        with open(INSTANCES_FILE, "r") as f:
+            configs = json.load(f)
+        if not isinstance(configs, list) or not configs:
+            raise ValueError("instances must be a non-empty JSON list")
+        names = [config["name"] for config in configs]
+        if len(set(names)) != len(names) or not all(isinstance(name, str) and name for name in names):
+            raise ValueError("each instance needs a unique name")
+        # 同じホストのインスタンスは接続プールを共有する
+        session = create_redmine_session(max(REDMINE_POOL_SIZE, len(configs)))
+        instances = []
+        for config in configs:
+            name = config["name"]
+            api_key = config.get("redmine_api_key") or os.getenv(config.get("redmine_api_key_env", ""), "")
+            routing_table = load_routing_table(
+                config.get("routing_rules_file", ""),
+                config.get("slack_channel_id", SLACK_CHANNEL_ID),
+                [int(x) for x in config.get("notify_project_ids", [])],
+                [int(x) for x in config.get("notify_tracker_ids", [])],
+            )
+            state_dir = config.get("state_dir") or os.path.join(os.path.dirname(LAST_CHECK_FILE), name)
+            os.makedirs(state_dir, exist_ok=True)
+            instances.append(Instance(name, RedmineClient(config["redmine_url"], api_key, session), routing_table,
+                                      state_dir, os.path.join(SHARD_DIR, name) if SHARD_DIR else None))
+        return instances
+    except (OSError, ValueError, TypeError, KeyError) as e:
+        print(f"インスタンス定義を読み込めません ({INSTANCES_FILE}): {e}")
+        sys.exit(1)
+
+# 通知するRedmineサーバー（最初に使う時に読み込み、最初のインスタンスを既定とする）
+instances = []
+instances_lock = threading.Lock()
+
+def get_instances():
+    """
+    通知するRedmineサーバーのインスタンスを返す
+    モジュールの読み込み時には設定を読まず、最初の呼び出しで INSTANCES_FILE から作成する
+    """
+    if not instances:
+        with instances_lock:
+            if not instances:
+                instances.extend(load_instances())
+    return instances
+
+def sweep_open_tickets():
+    """
+    通知済みで未完了のチケットのうち確認時刻を過ぎたものの現在の状態を1周期につき1回だけ取得し、
+    削除・完了（トラッカー変更）・未着手の各処理に振り分ける
+    前回から変化（更新・完了・削除）のあったチケットIDのリストを返す
+    """
+    start = time.monotonic()
+    current_time = datetime.now(timezone.utc)
+    changed_tickets = []
+    deleted_tickets = []
+
+    all_open_tickets = state.open_tickets()
+    open_tickets = completion_checks.pop_due(all_open_tickets, current_time)
+    with trace_span("fetch"):
+        issues, missing = get_tickets_info_bulk(open_tickets)
+        # 一括取得に含まれなかったチケットは個別に取得して削除を確認する
+        # （閲覧権限やプロジェクトの状態で一覧に出ないだけの場合がある）
+        fetched_individually = fetch_tickets_parallel(missing)
 
-def add_completion_reaction(ticket_id):
+    for ticket_id, issue, error in fetched_individually:
+        if error:
+            # HTTPエラーの場合はスキップして次回に再試行
+            print(f"  ERROR: Failed to check ticket #{ticket_id}: {error}")
+            continue
+
+        if issue is None:
+            # チケットが削除された場合
+            deleted_tickets.append(ticket_id)
+            changed_tickets.append(ticket_id)
+            forget_ticket_update(ticket_id)
+            with trace_span("handle"):
+                handle_deleted_ticket(ticket_id)
+            # まとめて通知した他のチケットの完了を同じ周期で処理する際に、未完了として数えないようにすぐに除外する
+            state.forget(ticket_id)
+        elif issue:
+            issues[ticket_id] = issue
+
+    # 未着手通知の対象になりうるチケット（作成から指定時間が経過し、未通知のもの）
+    pending_candidates = set()
+    if PENDING_NOTIFICATION_ENABLED:
+        created_before = current_time - timedelta(seconds=PENDING_NOTIFICATION_INTERVAL_SECONDS)
+        pending_candidates = set(state.pending_candidates(created_before))
+
+    with trace_span("handle"):
+        for ticket_id in open_tickets:
+            issue = issues.get(ticket_id)
+            if not issue:
+                continue
+
+            updated = observe_ticket_update(ticket_id, issue)
+            completed = handle_open_ticket_once(ticket_id, issue, current_time, ticket_id in pending_candidates)
+            if completed is None:
+                # Webhookで処理中か処理済みのチケットは、その処理で次回の確認時刻を決める
+                continue
+            if completed:
+                forget_ticket_update(ticket_id)
+                changed_tickets.append(ticket_id)
+                continue
+            if updated:
+                changed_tickets.append(ticket_id)
+            # 最後の更新からの経過時間に応じて次回の確認時刻を決める
+            completion_checks.schedule(ticket_id, issue, current_time)
+
+    if deleted_tickets:
+        print(f"  CLEANUP: Removed {len(deleted_tickets)} deleted tickets from tracking")
+    # 保持期間を過ぎた完了チケットの記録を取り除く
+    evict_expired_tickets(current_time)
+
+    next_check = completion_checks.seconds_until_next(current_time)
+    if open_tickets or next_check is None:
+        print(f"Checked {len(open_tickets)} of {len(all_open_tickets)} open tickets")
+    else:
+        print(f"Checked 0 of {len(all_open_tickets)} open tickets (next due in {int(next_check)}s)")
+
+    metrics.observe("job_duration_seconds", time.monotonic() - start, job="sweep")
+    trace_count(checked=len(open_tickets), changed=len(changed_tickets))
+    return changed_tickets
+
+
+def display_ticket_info(issue):
     """
-    完了したチケットの元のメッセージにリアクションを追加する
+    チケット情報をコンソールに表示する
+    """
+    project = issue.get('project', {}).get('name', 'Unknown')
+    tracker = issue.get('tracker', {}).get('name', 'Unknown')
+    subject = issue.get('subject', 'No subject')
+    author = issue.get('author', {}).get('name', 'Unknown')
+    created_on = issue.get('created_on', 'Unknown')
+    status = issue.get('status', {}).get('name', 'Unknown')
+    priority = issue.get('priority', {}).get('name', 'Unknown')
+    url = f"{redmine.base_url}/issues/{issue['id']}"
+    
+    print(f"  NEW: #{issue['id']} - {subject} | Project: {project} | Tracker: {tracker} | Author: {author} | Status: {status} | Priority: {priority} | Created: {created_on} | URL: {url}")
+
+def build_ticket_attachment(issue, color):
+    """
+    チケット情報のSlack添付を作成する
+    """
+    # descriptionを切り詰める
+    description = issue.get('description', '')
+    truncated_description = truncate_description(description)
+    return {
+        "color": color,
+        "title": f"{issue['tracker']['name']} #{issue['id']}: {issue['subject']}",
+        "title_link": f"{redmine.base_url}/issues/{issue['id']}",
+        "footer": f"{truncated_description}\n担当者: {issue.get('assigned_to', {}).get('name', '未割り当て')}",
+        "ts": int(datetime.fromisoformat(issue['created_on'].replace('Z', '+00:00')).timestamp())
+    }
+
+def send_slack_notification(issue):
+    """
+    ルーティングルールで決まる各チャンネルにチケット情報を送信する
+    """
+    for channel, mentions in routing.routes(issue).items():
+        send_channel_notification(issue, channel, mentions)
+
+def send_channel_notification(issue, channel, mentions):
+    """
+    1つのチャンネルにチケット情報を送信する
     """
-    message_mapping = load_message_mapping()
-    message_id = message_mapping.get(ticket_id)
+    attachments = [build_ticket_attachment(issue, "#ae1500")]
+    # 担当者とルールで指定されたメンバーの@メンションを作成
+    mention_text = create_mention_text(issue, mentions)
     
-    if not message_id:
-        return
+    # 本文を作成
+    text = f"新しいチケットが作成されました。"
+    if mention_text:
+        text += f" {mention_text}"
     
     try:
-        response = slack_client.reactions_add(
-            channel=SLACK_CHANNEL_ID,
-            timestamp=message_id,
-            name=SLACK_COMPLETION_EMOJI  # 完了時のリアクション絵文字
+        response = slack.call(
+            "chat_postMessage",
+            channel=channel,
+            text=text,
+            attachments=attachments
         )
-        pass  # リアクション追加は成功
+        # チャンネルごとにメッセージIDを保存
+        message_id = response['ts']
+        state.set_message(issue['id'], message_id, channel)
     except SlackApiError as e:
-        print(f"  ERROR: Failed to add reaction for #{ticket_id}: {e.response['error']}")
+        print(f"  ERROR: Failed to send notification for #{issue['id']} to {channel}: {e.response['error']}")
 
-def add_pending_completion_reaction(ticket_id):
+def build_digest_attachment(issues, title):
     """
-    完了したチケットの再通知メッセージに完了リアクションを追加する
+    まとめて通知するチケットの一覧のSlack添付を作成する（1チケット1行）
+    """
+    lines = [
+        f"<{redmine.base_url}/issues/{issue['id']}|#{issue['id']}> {issue['subject']}"
+        f"（{issue.get('assigned_to', {}).get('name', '未割り当て')}）"
+        for issue in issues
+    ]
+    return {"color": "#ae1500", "title": title, "text": "\n".join(lines)}
+
+def send_digest_notifications(issues):
+    """
+    新規チケットをチャンネル・トラッカーごとに1つのメッセージにまとめて送信する
+    各チケットのメッセージIDにはまとめたメッセージのIDを保存し、完了時はそのスレッドに返信する
+    1件だけのチャンネル・トラッカーは通常の通知として送信する
     """
-    pending_message_mapping = load_pending_message_mapping()
-    message_id = pending_message_mapping.get(ticket_id)
+    groups = {}
+    for issue in issues:
+        tracker = issue.get('tracker', {})
+        for channel, mentions in routing.routes(issue).items():
+            groups.setdefault((channel, tracker.get('id'), tracker.get('name', 'Unknown')), []).append((issue, mentions))
     
-    if not message_id:
-        return False
+    for (channel, _, tracker_name), entries in groups.items():
+        if len(entries) == 1:
+            issue, mentions = entries[0]
+            send_channel_notification(issue, channel, mentions)
+            continue
+        chunks = [entries[i:i + DIGEST_MAX_TICKETS] for i in range(0, len(entries), DIGEST_MAX_TICKETS)]
+        for number, chunk in enumerate(chunks, 1):
+            chunk_issues = [issue for issue, _ in chunk]
+            # 担当者とルールで指定されたメンバーの@メンションをまとめる（重複は除く）
+            mention_texts = filter(None, (create_mention_text(issue, mentions) for issue, mentions in chunk))
+            mention_text = " ".join(dict.fromkeys(" ".join(mention_texts).split()))
+            
+            text = f"新しいチケットが{len(entries)}件作成されました（{tracker_name}）。"
+            if len(chunks) > 1:
+                text += f" ({number}/{len(chunks)})"
+            if mention_text:
+                text += f" {mention_text}"
+            attachments = [build_digest_attachment(chunk_issues, f"{tracker_name} {len(chunk_issues)}件")]
+            
+            try:
+                response = slack.call(
+                    "chat_postMessage",
+                    channel=channel,
+                    text=text,
+                    attachments=attachments
+                )
+                # チケットごとにまとめたメッセージのIDを保存
+                for issue in chunk_issues:
+                    state.set_message(issue['id'], response['ts'], channel)
+                print(f"  DIGEST: {len(chunk_issues)} {tracker_name} tickets to {channel} "
+                      f"(#{', #'.join(str(issue['id']) for issue in chunk_issues)})")
+            except SlackApiError as e:
+                print(f"  ERROR: Failed to send digest of {len(chunk_issues)} tickets to {channel}: {e.response['error']}")
+
+def send_pending_notification_with_mention(issue):
+    """
+    未着手チケットの通知をSlackに送信する（@メンション付き）
+    元の通知を送ったチャンネルに送り、元の通知がない場合は現在のルールで決まるチャンネルに送る
+    1つ以上のチャンネルに送信できた場合はTrueを返す
+    """
+    routes = routing.routes(issue)
+    channels = list(state.get_messages(issue['id'])) or list(routes)
+    attachments = [build_ticket_attachment(issue, "#FFCC01")]  # 黄色
+    sent = False
+    
+    for channel in channels:
+        # 担当者とルールで指定されたメンバーの@メンションを作成
+        mention_text = create_mention_text(issue, routes.get(channel, ()))
+        
+        # 本文を作成
+        text = f"未着手のチケットがあります。"
+        if mention_text:
+            text += f" {mention_text}"
+        
+        try:
+            response = slack.call(
+                "chat_postMessage",
+                channel=channel,
+                text=text,
+                attachments=attachments
+            )
+            # 再通知メッセージIDを保存
+            message_id = response['ts']
+            state.set_pending_message(issue['id'], message_id, channel)
+            sent = True
+        except SlackApiError as e:
+            print(f"  ERROR: Failed to send pending notification for #{issue['id']} to {channel}: {e.response['error']}")
+    return sent
+
+
+def add_reaction(ticket_id, messages, name, description):
+    """
+    チャンネルごとのメッセージにリアクションを追加する
+    1つ以上のメッセージに追加できた場合はTrueを返す
+    """
+    added = False
+    for channel, message_id in messages.items():
+        try:
+            slack.call(
+                "reactions_add",
+                channel=channel,
+                timestamp=message_id,
+                name=name
+            )
+            added = True
+        except SlackApiError as e:
+            print(f"  ERROR: Failed to add {description} for #{ticket_id} in {channel}: {e.response['error']}")
+    return added
+
+def mark_original_messages(ticket_id, name, description):
+    """
+    チケットの元のメッセージにリアクションを追加する
+    まとめて通知したメッセージの場合は、スレッドにチケットごとに返信し、
+    まとめたチケットがすべて完了・削除された時点でメッセージにリアクションを追加する
+    （まとめたチケットがすべて削除された場合を除き、完了のリアクションにする）
+    1つ以上のメッセージに追加（返信）できた場合はTrueを返す
+    """
+    messages = state.get_messages(ticket_id)
+    if DIGEST_THRESHOLD <= 0:
+        return add_reaction(ticket_id, messages, name, description)
     
+    added = False
+    for channel, message_id in messages.items():
+        others = [other for other in state.tickets_for_message(message_id, channel) if other != ticket_id]
+        if not others:
+            added |= add_reaction(ticket_id, {channel: message_id}, name, description)
+            continue
+        text = f":{name}: <{redmine.base_url}/issues/{ticket_id}|#{ticket_id}>"
+        added |= reply_in_thread(ticket_id, channel, message_id, text)
+        if not any(state.is_open(other) for other in others):
+            # 削除されたチケットは追跡対象から除外済みのため、残っている他のチケットはすべて完了している
+            add_reaction(ticket_id, {channel: message_id}, SLACK_COMPLETION_EMOJI, "reaction")
+    return added
+
+def reply_in_thread(ticket_id, channel, message_id, text):
+    """
+    メッセージのスレッドに返信する
+    返信できた場合はTrueを返す
+    """
     try:
-        response = slack_client.reactions_add(
-            channel=SLACK_CHANNEL_ID,
-            timestamp=message_id,
-            name=SLACK_COMPLETION_EMOJI  # 完了時のリアクション絵文字
+        slack.call(
+            "chat_postMessage",
+            channel=channel,
+            thread_ts=message_id,
+            text=text
         )
         return True
     except SlackApiError as e:
-        print(f"  ERROR: Failed to add pending completion reaction for #{ticket_id}: {e.response['error']}")
+        print(f"  ERROR: Failed to reply for #{ticket_id} in {channel}: {e.response['error']}")
         return False
 
+def add_completion_reaction(ticket_id):
+    """
+    完了したチケットの元のメッセージにリアクションを追加する
+    """
+    # 完了時のリアクション絵文字
+    return mark_original_messages(ticket_id, SLACK_COMPLETION_EMOJI, "reaction")
+
+def add_pending_completion_reaction(ticket_id):
+    """
+    完了したチケットの再通知メッセージに完了リアクションを追加する
+    """
+    return add_reaction(ticket_id, state.get_pending_messages(ticket_id), SLACK_COMPLETION_EMOJI,
+                        "pending completion reaction")
+
 def add_deletion_reaction(ticket_id):
     """
     削除されたチケットの元のメッセージにゴミ箱リアクションを追加する
     """
-    message_mapping = load_message_mapping()
-    message_id = message_mapping.get(ticket_id)
-    
-    if not message_id:
-        return False
-    
-    try:
-        response = slack_client.reactions_add(
-            channel=SLACK_CHANNEL_ID,
-            timestamp=message_id,
-            name=SLACK_DELETION_EMOJI  # 削除時のリアクション絵文字
-        )
-        return True
-    except SlackApiError as e:
-        print(f"  ERROR: Failed to add deletion reaction for #{ticket_id}: {e.response['error']}")
-        return False
+    # 削除時のリアクション絵文字
+    return mark_original_messages(ticket_id, SLACK_DELETION_EMOJI, "deletion reaction")
 
 def add_pending_deletion_reaction(ticket_id):
     """
     削除されたチケットの再通知メッセージにゴミ箱リアクションを追加する
     """
-    pending_message_mapping = load_pending_message_mapping()
-    message_id = pending_message_mapping.get(ticket_id)
-    
-    if not message_id:
-        return False
-    
-    try:
-        response = slack_client.reactions_add(
-            channel=SLACK_CHANNEL_ID,
-            timestamp=message_id,
-            name=SLACK_DELETION_EMOJI  # 削除時のリアクション絵文字
-        )
-        return True
-    except SlackApiError as e:
-        print(f"  ERROR: Failed to add pending deletion reaction for #{ticket_id}: {e.response['error']}")
-        return False
+    return add_reaction(ticket_id, state.get_pending_messages(ticket_id), SLACK_DELETION_EMOJI,
+                        "pending deletion reaction")
 
 def delete_slack_message(ticket_id):
     """
-    チケットのSlackメッセージを削除する
+    チケットのSlackメッセージをすべてのチャンネルから削除する
+    """
+    deleted = False
+    for channel, message_id in state.get_messages(ticket_id).items():
+        try:
+            slack.call(
+                "chat_delete",
+                channel=channel,
+                ts=message_id
+            )
+            # メッセージマッピングからも削除
+            state.remove_message(ticket_id, channel)
+            deleted = True
+        except SlackApiError as e:
+            print(f"  ERROR: Failed to delete message for #{ticket_id} in {channel}: {e.response['error']}")
+    return deleted
+
+class AdaptiveJob:
+    """
+    定期的に実行するジョブと、その実行間隔を管理する
+    変化がない間は間隔を指数的に延ばし、変化があれば基本の間隔に戻す
+    次回の予定時刻は前回の予定時刻から数え、処理にかかった時間で周期がずれないようにする
+    """
+    def __init__(self, name, func, interval, max_interval, deadline=None):
+        self.name = name
+        self.func = func                    # 変化があった場合にTrueを返す（asyncエンジンではNone）
+        self.base_interval = interval
+        self.max_interval = max(max_interval, interval)
+        self.interval = interval
+        self.deadline = deadline            # 次回の予定時刻の上限までの秒数を返す（Noneの場合は上限なし）
+        self.next_run = time.monotonic()
+
+    def time_until_next(self):
+        return self.next_run - time.monotonic()
+
+    def complete(self, active):
+        """
+        実行結果（変化があったかどうか）に応じて次回の間隔と予定時刻を決める
+        """
+        if active:
+            self.interval = self.base_interval
+        else:
+            self.interval = min(self.interval * IDLE_BACKOFF_FACTOR, self.max_interval)
+        # 処理が長引いて予定時刻を過ぎた場合は、遅れを取り戻そうとせずにすぐ実行する
+        scheduled = self.next_run
+        now = time.monotonic()
+        self.next_run = max(scheduled + self.interval, now)
+        # 間隔を延ばしていても上限の時刻（完了確認の予定など）は過ぎないようにする（基本の間隔より短くはしない）
+        seconds = self.deadline() if self.deadline else None
+        if seconds is not None:
+            self.next_run = min(self.next_run, max(now + seconds, scheduled + self.base_interval))
+
+    def snap_back(self):
+        """
+        間隔を基本の間隔に戻し、延ばしていた予定時刻を早める
+        """
+        self.interval = self.base_interval
+        self.next_run = min(self.next_run, time.monotonic() + self.base_interval)
+
+class Scheduler:
+    """
+    複数のジョブをそれぞれの間隔で実行する
+    いずれかのジョブで変化があった場合は、すべてのジョブを基本の間隔に戻す
     """
-    message_mapping = load_message_mapping()
-    message_id = message_mapping.get(ticket_id)
-    
-    if not message_id:
-        return False
-    
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    def time_until_next(self):
+        return min(job.time_until_next() for job in self.jobs)
+
+    def run_pending(self):
+        """
+        予定時刻を過ぎたジョブを順に実行し、実行したジョブの名前のリストを返す
+        """
+        ran = []
+        for job in self.jobs:
+            if job.time_until_next() > 0:
+                continue
+            ran.append(job.name)
+            self.complete(job, job.func())
+        return ran
+
+    def complete(self, job, active):
+        """
+        ジョブの実行結果を記録し、変化があった場合はすべてのジョブを基本の間隔に戻す
+        """
+        job.complete(active)
+        if active:
+            self.snap_back()
+
+    def snap_back(self):
+        for job in self.jobs:
+            job.snap_back()
+
+    def describe(self):
+        return ", ".join(f"{job.name} every {job.interval:g}s" for job in self.jobs)
+
+# Webhookで受け取ったイベント（インスタンス, アクション, チケットID）
+webhook_events = queue.Queue()
+
+def webhook_instance(path):
+    """
+    Webhookを受け付けたパスに対応するインスタンスを返す
+    複数のインスタンスがある場合は WEBHOOK_PATH/<インスタンス名> で受け付ける
+    """
+    if len(get_instances()) == 1:
+        return instances[0] if path == WEBHOOK_PATH else None
+    for instance in instances:
+        if path == f"{WEBHOOK_PATH}/{instance.name}":
+            return instance
+    return None
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """
+    RedmineのWebhook（redmine_webhookプラグインの形式）を受け付け、処理待ちのイベントとして登録する
+    チケットの内容はイベントの処理時にRedmineから取得し直すため、ここではアクションとチケットIDだけを取り出す
+    """
+    def do_POST(self):
+        url = urlparse(self.path)
+        instance = webhook_instance(url.path)
+        if instance is None:
+            self.send_error(404)
+            return
+
+        if WEBHOOK_TOKEN:
+            token = self.headers.get("X-Webhook-Token") or parse_qs(url.query).get("token", [""])[0]
+            if not hmac.compare_digest(token, WEBHOOK_TOKEN):
+                self.send_error(403)
+                return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            data = json.loads(self.rfile.read(length))
+            # {"payload": {"action": ..., "issue": {...}}} と payload を省いた形式の両方を受け付ける
+            payload = data.get("payload", data)
+            action = payload["action"]
+            ticket_id = int(payload["issue"]["id"])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.send_error(400)
+            return
+
+        if action in ("opened", "updated"):
+            webhook_events.put((instance, action, ticket_id))
+        self.send_response(202)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        # アクセスログは出力しない
+        pass
+
+def start_webhook_server():
+    """
+    Webhookを受け付けるHTTPサーバーをバックグラウンドのスレッドで起動する
+    """
+    server = ThreadingHTTPServer(("", WEBHOOK_PORT), WebhookHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    if len(get_instances()) == 1:
+        print(f"Webhook listener: http://0.0.0.0:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    else:
+        print(f"Webhook listener: http://0.0.0.0:{WEBHOOK_PORT}{WEBHOOK_PATH}/{{{', '.join(i.name for i in instances)}}}")
+    return server
+
+def handle_webhook_event(action, ticket_id, notify=notify_new_issue_once):
+    """
+    Webhookのイベントを受けたチケットの現在の状態を取得し、新規通知（notify）または完了・未着手の処理に振り分ける
+    取得に失敗した場合は取りこぼしの確認のポーリングで処理する
+    """
+    if not owns_ticket(ticket_id):
+        # 他のレプリカが担当するチケットは、そのレプリカの取りこぼしの確認で処理される
+        return
+
     try:
-        response = slack_client.chat_delete(
-            channel=SLACK_CHANNEL_ID,
-            ts=message_id
-        )
-        # メッセージマッピングからも削除
-        remove_message_mapping(ticket_id)
-        return True
-    except SlackApiError as e:
-        print(f"  ERROR: Failed to delete message for #{ticket_id}: {e.response['error']}")
-        return False
+        issue = get_ticket_info(ticket_id)
+    except requests.exceptions.RequestException:
+        return
 
-def check_pending_tickets():
+    if issue is None:
+        if state.is_open(ticket_id):
+            handle_deleted_ticket(ticket_id)
+            remove_deleted_tickets_from_tracking([ticket_id])
+        return
+
+    print(f"  WEBHOOK: {action} #{ticket_id}")
+    if action == "opened":
+        if is_notification_target(issue):
+            notify(issue)
+    elif state.is_open(ticket_id):
+        current_time = datetime.now(timezone.utc)
+        observe_ticket_update(ticket_id, issue)
+        completed = handle_open_ticket_once(ticket_id, issue, current_time, PENDING_NOTIFICATION_ENABLED)
+        if completed:
+            forget_ticket_update(ticket_id)
+        elif completed is False:
+            completion_checks.schedule(ticket_id, issue, current_time)
+
+def process_webhook_events(timeout):
     """
-    通知済みチケットの未着手状況をチェックし、指定時間経過後に未着手の場合は通知する
+    Webhookのイベントが届くまで最大timeout秒待ち、届いているイベントを順にまとめて処理する
+    イベントを処理したインスタンスのリストを返す
     """
-    notified_tickets = load_notified_tickets()
-    completed_tickets = load_completed_tickets()
-    creation_time_mapping = load_creation_time_mapping()
-    current_time = datetime.now(timezone.utc)
+    try:
+        event = webhook_events.get(timeout=max(timeout, 0))
+    except queue.Empty:
+        return []
     
-    for ticket_id in notified_tickets:
-        if ticket_id not in completed_tickets:
+    processed = []
+    arrivals = {}   # インスタンス -> まとめて通知するかを判定する新規チケット
+    with trace_cycle("webhook"):
+        while event:
+            instance, action, ticket_id = event
+            notify = arrivals.setdefault(instance, []).append if DIGEST_THRESHOLD > 0 else notify_new_issue_once
+            with using_instance(instance), trace_span(action, events=1):
+                handle_webhook_event(action, ticket_id, notify)
+            if instance not in processed:
+                processed.append(instance)
             try:
-                # チケットの詳細情報を取得
-                issue = get_ticket_info(ticket_id)
-                if issue is None:
-                    # チケットが削除された場合
-                    continue
-                elif issue:
-                    status = issue.get("status", {}).get("name", "不明")
-                    # 未着手ステータスかチェック（「未着手」のみ）
-                    if status in ["未着手"]:
-                        # 作成時刻を取得
-                        creation_time_str = creation_time_mapping.get(ticket_id)
-                        if creation_time_str:
-                            try:
-                                creation_time = datetime.fromisoformat(creation_time_str.replace('Z', '+00:00'))
-                                # 指定時間経過しているかチェック
-                                time_elapsed = (current_time - creation_time).total_seconds()
-                                if time_elapsed >= PENDING_NOTIFICATION_INTERVAL_SECONDS:
-                                    # 未着手通知を送信
-                                    if send_pending_notification_with_mention(issue):
-                                        print(f"  PENDING NOTIFICATION: #{ticket_id} - {issue.get('subject', 'No subject')} (elapsed: {int(time_elapsed/60)} minutes)")
-                                        # 作成時刻マッピングから削除（一度通知したら再通知しない）
-                                        remove_creation_time_mapping(ticket_id)
-                            except Exception as e:
-                                print(f"  ERROR: Failed to parse creation time for #{ticket_id}: {e}")
-                                continue
-            except requests.exceptions.RequestException as e:
-                # HTTPエラーの場合はスキップして次回に再試行
-                print(f"  ERROR: Failed to check pending ticket #{ticket_id}: {e}")
-                continue
+                event = webhook_events.get_nowait()
+            except queue.Empty:
+                event = None
+        for instance, issues in arrivals.items():
+            with using_instance(instance), trace_span("notify"):
+                notify_new_issues(issues)
+        with trace_span("persist"):
+            for instance in processed:
+                instance.state.flush()
+    return processed
+
+def polling_interval():
+    """
+    ポーリングの周期を返す（Webhook有効時は取りこぼしを確認する低頻度の周期）
+    """
+    return WEBHOOK_RECONCILE_INTERVAL if WEBHOOK_PORT else POLLING_INTERVAL
+
+def create_scheduler(poll_func=None, sweep_func=None):
+    """
+    新規チケットの取得（poll）と通知済みチケットの確認（sweep）のジョブを作成する
+    """
+    return Scheduler([
+        AdaptiveJob("poll", poll_func, polling_interval(), MAX_POLLING_INTERVAL),
+        AdaptiveJob("sweep", sweep_func, SWEEP_INTERVAL, MAX_SWEEP_INTERVAL, seconds_until_completion_check),
+    ])
+
+def seconds_until_completion_check():
+    """
+    処理中のインスタンスで次の完了確認の時刻までの秒数を返す（予定がない場合はNone）
+    """
+    return completion_checks.seconds_until_next(datetime.now(timezone.utc))
+
+def time_until_next(instances):
+    """
+    いずれかのインスタンスのジョブの予定時刻までの秒数を返す
+    """
+    return min(instance.scheduler.time_until_next() for instance in instances)
+
+def wait_for_next_cycle(instances):
+    """
+    いずれかのインスタンスの次のジョブの予定時刻まで待つ
+    Webhook有効時は待っている間に届いたイベントをすぐに処理し、イベントがあったインスタンスの各ジョブを基本の間隔に戻す
+    """
+    if not WEBHOOK_PORT:
+        time.sleep(max(time_until_next(instances), 0))
+        return
+    
+    while True:
+        remaining = time_until_next(instances)
+        if remaining <= 0:
+            break
+        for instance in process_webhook_events(remaining):
+            instance.scheduler.snap_back()
+
+def state_file_sizes():
+    """
+    処理中のインスタンスの状態を保存しているファイルごとのサイズ（バイト）を返す
+    """
+    if SHARD_DIR:
+        # 担当しているバケットのディレクトリのファイル
+        paths = [path for bucket in state.owned_buckets()
+                 for path in sorted(glob.glob(os.path.join(state.bucket_dir(bucket), "*")))]
+        return [({"file": os.path.relpath(path, state.directory)}, os.path.getsize(path))
+                for path in paths if os.path.exists(path)]
+    paths = [LAST_CHECK_FILE]
+    if STATE_BACKEND == "sqlite":
+        paths += [STATE_DB_FILE, f"{STATE_DB_FILE}-wal"]
+    else:
+        paths += [NOTIFIED_TICKETS_FILE, COMPLETED_TICKETS_FILE, MESSAGE_MAPPING_FILE, TRACKER_MAPPING_FILE,
+                  CREATION_TIME_MAPPING_FILE, PENDING_MESSAGE_MAPPING_FILE]
+        if STATE_JOURNAL_FILE:
+            paths += [STATE_JOURNAL_FILE, f"{STATE_JOURNAL_FILE}.old"]
+    paths = [state_path(get_instance().state_dir, path) for path in paths]
+    return [({"file": os.path.basename(path)}, os.path.getsize(path)) for path in paths if os.path.exists(path)]
 
+def register_state_metrics():
+    """
+    出力時に値を計算するゲージ（追跡中のチケット数・状態ファイルのサイズ・最終取得からの経過時間など）を登録する
+    """
+    def tickets():
+        notified_count, completed_count = state.counts()
+        return [({"set": "notified"}, notified_count), ({"set": "completed"}, completed_count),
+                ({"set": "open"}, len(state.open_tickets()))]
+
+    def high_water_mark_age():
+        high_water_mark = load_high_water_mark()
+        if not high_water_mark:
+            return []
+        return [({}, (datetime.now(timezone.utc) - high_water_mark).total_seconds())]
+
+    def last_poll_timestamp():
+        last_poll = get_instance().last_poll
+        return [({}, last_poll)] if last_poll else []
+
+    def last_poll_age():
+        last_poll = get_instance().last_poll
+        return [({}, time.time() - last_poll)] if last_poll else []
+
+    def per_instance(collect):
+        # 複数のインスタンスがある場合は、インスタンスごとの値に redmine ラベルを付ける
+        if len(get_instances()) == 1:
+            return collect
+        def collect_all():
+            samples = []
+            for instance in instances:
+                with using_instance(instance):
+                    samples += [({"redmine": instance.name, **labels}, value) for labels, value in collect()]
+            return samples
+        return collect_all
+
+    metrics.describe("tickets", "gauge", "Tracked tickets by set", per_instance(tickets))
+    metrics.describe("state_file_bytes", "gauge", "Size of the state files", per_instance(state_file_sizes))
+    metrics.describe("high_water_mark_age_seconds", "gauge", "Age of the newest ticket creation time seen by the poll",
+                     per_instance(high_water_mark_age))
+    metrics.describe("last_poll_timestamp_seconds", "gauge", "Unix time of the last completed new-ticket poll",
+                     per_instance(last_poll_timestamp))
+    metrics.describe("last_poll_age_seconds", "gauge", "Seconds since the last completed new-ticket poll",
+                     per_instance(last_poll_age))
+    if SHARD_DIR:
+        metrics.describe("shard_buckets", "gauge", "Shard buckets leased by this replica",
+                         per_instance(lambda: [({}, len(state.owned_buckets()))]))
+    metrics.describe("completion_check_queue_size", "gauge", "Open tickets scheduled for completion checks",
+                     per_instance(lambda: [({}, len(completion_checks))]))
+    metrics.describe("slack_queue_depth", "gauge", "Slack calls waiting for rate limits or retries",
+                     lambda: [({}, slack.queue_depth)])
+    metrics.describe("redmine_cache_requests_total", "counter", "Conditional Redmine requests by cache result",
+                     per_instance(lambda: [({"result": "hit"}, redmine.cache.hits),
+                                           ({"result": "miss"}, redmine.cache.misses)]))
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    /metrics でメトリクスをPrometheusのテキスト形式で返す
+    """
+    def do_GET(self):
+        if urlparse(self.path).path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # アクセスログは出力しない
+        pass
+
+def start_metrics_server():
+    """
+    メトリクスを公開するHTTPサーバーをバックグラウンドのスレッドで起動する
+    """
+    register_state_metrics()
+    server = ThreadingHTTPServer(("", METRICS_PORT), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics endpoint: http://0.0.0.0:{METRICS_PORT}/metrics")
+    return server
 
 def signal_handler(sig, frame):
     """
     Ctrl+Cで終了する際のシグナルハンドラー
     """
     print("\nStopping monitoring...")
+    # 未保存の状態を書き出してから終了する
+    for instance in get_instances():
+        instance.state.close()
+    recorder.close()
     sys.exit(0)
 
-def main():
+def print_cycle_stats():
     """
-    メイン処理 - ポーリング方式でチケットを監視
+    この周期のRedmine・Slack呼び出しの集計を表示する
     """
-    # シグナルハンドラーを設定
-    signal.signal(signal.SIGINT, signal_handler)
+    cycle_latency = redmine.take_cycle_latency()
+    if cycle_latency:
+        print(f"Redmine latency: {format_latency(cycle_latency)}")
+    if redmine.cache.hits or redmine.cache.misses:
+        print(f"Redmine cache: {redmine.cache.hits} hits, {redmine.cache.misses} misses, {len(redmine.cache)} entries")
     
-    print("Starting Redmine ticket monitoring...")
-    print(f"Polling interval: {POLLING_INTERVAL}s, Pending notification interval: {PENDING_NOTIFICATION_INTERVAL_SECONDS}s")
-    if NOTIFY_TRACKER_IDS:
-        print(f"Target trackers: {NOTIFY_TRACKER_IDS}")
-    else:
-        print("Target: All trackers")
-    if NOTIFY_PROJECT_IDS:
-        print(f"Target projects: {NOTIFY_PROJECT_IDS}")
-    else:
-        print("Target: All projects")
-    print("Press Ctrl+C to stop")
-    print("-" * 60)
+    if slack.stats["calls"]:
+        print(f"Slack: {slack.stats['calls']} calls, {slack.stats['retries']} retries, "
+              f"{slack.stats['ratelimited']} rate limited, {slack.stats['failures']} failures, "
+              f"queue depth {slack.queue_depth} (max {slack.stats['max_queue_depth']})")
+
+def poll_job(instance):
+    """
+    処理中のインスタンスの新規チケットを取得しながら通知し、ハイウォーターマークを進める
+    変化があった場合はTrueを返す
+    """
+    if SHARD_DIR:
+        # 担当するバケットは入れ替わるため、取得のたびにバケットのハイウォーターマークから始める
+        instance.high_water_mark = state.begin_poll()
+    with trace_span("poll"):
+        next_high_water_mark = poll_new_issues(instance.high_water_mark)
     
-    try:
-        with open(LAST_CHECK_FILE, "r") as f:
-            last_check_time = f.read().strip()
-        print(f"Last check time: {last_check_time}")
-    except FileNotFoundError:
-        # ファイルがない場合は現在時刻を基準にする
-        last_check_time = datetime.now(timezone.utc).isoformat()
-        print(f"First run: {last_check_time}")
+    # 通知済みの記録を保存してからハイウォーターマークを進める
+    with trace_span("persist"):
+        state.flush()
+        if next_high_water_mark == instance.high_water_mark:
+            return False
+        instance.high_water_mark = next_high_water_mark
+        save_high_water_mark(instance.high_water_mark)
+    return True
+
+def sweep_job():
+    """
+    処理中のインスタンスの通知済みチケットの状態を1回だけ取得し、完了・削除・未着手の確認に使う
+    変化があった場合はTrueを返す
+    """
+    with trace_span("sweep"):
+        changed_tickets = sweep_open_tickets()
+    with trace_span("persist"):
+        state.flush()
+    return bool(changed_tickets)
+
+def run_sync_loop(instances):
+    """
+    各インスタンスの新規チケットの取得と通知済みチケットの確認を、それぞれの周期で1つのループから実行する
+    予定時刻が最も早いインスタンスから順に処理する
+    """
+    # シグナルハンドラーを設定
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
     
+    for instance in instances:
+        instance.scheduler = create_scheduler(partial(poll_job, instance), sweep_job)
     check_count = 0
     
     while True:
         check_count += 1
+        instance = min(instances, key=lambda i: i.scheduler.time_until_next())
         current_time = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
-        print(f"\n[{current_time}] Check #{check_count}")
+        print(f"\n[{current_time}] Check #{check_count}" + (f" ({instance.name})" if len(instances) > 1 else ""))
         
-        new_issues = get_new_issues(last_check_time)
-        
-        if new_issues:
-            # トラッカーとプロジェクトのフィルタリングを適用
-            filtered_issues = [issue for issue in new_issues if is_notification_target(issue)]
+        with using_instance(instance):
+            with trace_cycle("cycle", check=check_count):
+                ran = instance.scheduler.run_pending()
             
-            # 通知済みチェックを適用
-            final_filtered_issues = [issue for issue in filtered_issues if not is_already_notified(issue)]
+            # この周期のRedmine・Slack呼び出しの集計を表示
+            print_cycle_stats()
+        print(f"Ran: {', '.join(ran)} (next: {instance.scheduler.describe()})")
+        recorder.flush()
+        
+        wait_for_next_cycle(instances)
+
+async def run_async_engine(instances):
+    """
+    各インスタンスの新規チケットの取得・通知済みチケットの確認・Slackへの送信を並行したタスクとして実行する
+    Redmine・Slackの呼び出しは接続プールを共有したままワーカースレッドで実行し、
+    同時に実行する数を全インスタンスで共有するセマフォで制限する
+    SIGINT / SIGTERM を受けると実行中の処理の完了を待ってから状態を保存して終了する
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    slack_semaphore = asyncio.Semaphore(SLACK_MAX_CONCURRENCY)
+    
+    async def wait_or_stop(seconds):
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+    
+    async def wait_for_job(job):
+        # 他のジョブやWebhookで予定時刻が早まる場合があるため、短い間隔で区切って待つ
+        while not stop.is_set():
+            remaining = job.time_until_next()
+            if remaining <= 0:
+                break
+            await wait_or_stop(min(remaining, 1.0))
+    
+    async def notify(issue):
+        async with slack_semaphore:
+            await asyncio.to_thread(notify_new_issue_once, issue)
+    
+    # インスタンスが複数ある場合は表示にインスタンス名を付ける
+    def label(instance):
+        return f" ({instance.name})" if len(instances) > 1 else ""
+    
+    async def poll_job(instance):
+        # タスクごとにコンテキストが分かれるため、ワーカースレッドの処理もこのインスタンスに対して行われる
+        current_instance.set(instance)
+        scheduler = instance.scheduler
+        poll = scheduler.jobs[0]
+        check_count = 0
+        while not stop.is_set():
+            check_count += 1
+            current_time = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+            print(f"\n[{current_time}] Poll #{check_count}{label(instance)}")
+            if SHARD_DIR:
+                # 担当するバケットは入れ替わるため、取得のたびにバケットのハイウォーターマークから始める
+                instance.high_water_mark = state.begin_poll()
             
-            if final_filtered_issues:
-                print(f"Found {len(final_filtered_issues)} new tickets to notify")
+            with trace_cycle("poll", check=check_count):
+                # 取得と絞り込みはワーカースレッドで行い、通知は並行して送信する
+                issues_to_notify = []
+                next_high_water_mark = await asyncio.to_thread(poll_new_issues, instance.high_water_mark,
+                                                               issues_to_notify.append)
+                with trace_span("notify"):
+                    await asyncio.gather(*(notify(issue) for issue in issues_to_notify))
                 
-                for issue in final_filtered_issues:
-                    print(f"  NEW: #{issue['id']} - {issue['subject']} ({issue.get('tracker', {}).get('name', 'Unknown')})")
-                    send_slack_notification(issue)
-                    # 通知済みとして記録
-                    save_notified_ticket(issue['id'])
-                    # トラッカーIDを保存
-                    tracker_id = issue.get('tracker', {}).get('id')
-                    if tracker_id:
-                        save_tracker_mapping(issue['id'], tracker_id)
-                    # 作成時刻を保存（未着手通知用）
-                    creation_time = issue.get('created_on', '')
-                    if creation_time:
-                        save_creation_time_mapping(issue['id'], creation_time)
-            else:
-                print("No new tickets to notify")
+                # 通知済みの記録を保存してからハイウォーターマークを進める
+                with trace_span("persist"):
+                    await asyncio.to_thread(state.flush)
+                    active = next_high_water_mark != instance.high_water_mark
+                    if active:
+                        instance.high_water_mark = next_high_water_mark
+                        await asyncio.to_thread(save_high_water_mark, instance.high_water_mark)
+            
+            scheduler.complete(poll, active)
+            await wait_for_job(poll)
+    
+    async def sweep_job(instance):
+        current_instance.set(instance)
+        scheduler = instance.scheduler
+        sweep = scheduler.jobs[1]
+        while not stop.is_set():
+            # 通知済みチケットの状態を1回だけ取得し、完了・削除・未着手の確認に使う
+            with trace_cycle("sweep"):
+                changed_tickets = await asyncio.to_thread(sweep_open_tickets)
+                with trace_span("persist"):
+                    await asyncio.to_thread(state.flush)
+            print_cycle_stats()
+            recorder.flush()
+            
+            scheduler.complete(sweep, bool(changed_tickets))
+            print(f"Next{label(instance)}: {scheduler.describe()}")
+            await wait_for_job(sweep)
+    
+    async def webhook_job():
+        while not stop.is_set():
+            # 停止の要求に気付けるように短い間隔で区切ってイベントを処理する
+            for instance in await asyncio.to_thread(process_webhook_events, 1.0):
+                instance.scheduler.snap_back()
+    
+    jobs = []
+    for instance in instances:
+        instance.scheduler = create_scheduler()
+        jobs += [asyncio.create_task(poll_job(instance)), asyncio.create_task(sweep_job(instance))]
+    if WEBHOOK_PORT:
+        jobs.append(asyncio.create_task(webhook_job()))
+    try:
+        # どちらかのジョブが例外で終了した場合も停止する
+        done, _ = await asyncio.wait(jobs, return_when=asyncio.FIRST_EXCEPTION)
+        for job in done:
+            job.result()
+    finally:
+        stop.set()
+        await asyncio.gather(*jobs, return_exceptions=True)
+        print("\nStopping monitoring...")
+        # 未保存の状態を書き出してから終了する
+        for instance in instances:
+            instance.state.close()
+        recorder.close()
+
+def setup_instance(instance):
+    """
+    処理中のインスタンスの設定を表示し、ハイウォーターマークとチケットの追跡状態を読み込む
+    """
+    if len(get_instances()) > 1:
+        print(f"[{instance.name}] {redmine.base_url} (state in {instance.state_dir})")
+    print(f"Routing: {len(routing.rules)} rules to {', '.join(routing.channels)}"
+          f"{f' ({ROUTING_RULES_FILE})' if ROUTING_RULES_FILE and not INSTANCES_FILE else ''}")
+    if routing.tracker_ids:
+        print(f"Target trackers: {routing.tracker_ids}")
+    else:
+        print("Target: All trackers")
+    if routing.project_ids:
+        print(f"Target projects: {routing.project_ids}")
+    else:
+        print("Target: All projects")
+    
+    if SHARD_DIR:
+        # ハイウォーターマークはリースを取得したバケットごとに読み込む
+        print(f"Sharding: {SHARD_BUCKETS} buckets in {state.directory} as {SHARD_INSTANCE_ID} "
+              f"(lease {SHARD_LEASE_SECONDS:g}s)")
+    else:
+        instance.high_water_mark = load_high_water_mark()
+        if instance.high_water_mark:
+            print(f"High-water mark: {instance.high_water_mark.isoformat()}")
         else:
-            print("No new tickets found")
-        
-        # 完了したチケットをチェック
-        completed_issues = check_completed_tickets()
-        
-        # 未着手チケットのチェック
-        # check_pending_tickets()  # コメントアウトで未着手通知機能を無効化
-        
-        # 現在の時刻をファイルに保存
-        with open(LAST_CHECK_FILE, "w") as f:
-            f.write(datetime.now(timezone.utc).isoformat())
-        
-        time.sleep(POLLING_INTERVAL)
+            # ファイルがない場合は現在時刻を基準にする
+            instance.high_water_mark = datetime.now(timezone.utc)
+            print(f"First run: {instance.high_water_mark.isoformat()}")
+            save_high_water_mark(instance.high_water_mark)
+    
+    # チケットの追跡状態を読み込む
+    state.load()
+    notified_count, completed_count = state.counts()
+    print(f"Tracked tickets: {notified_count} notified, {completed_count} completed ({STATE_BACKEND} backend)")
+
+def main():
+    """
+    メイン処理 - ポーリング方式でチケットを監視
+    """
+    print("Starting Redmine ticket monitoring...")
+    instances = get_instances()
+    print(f"Polling interval: {POLLING_INTERVAL}s (max {MAX_POLLING_INTERVAL}s), Sweep interval: {SWEEP_INTERVAL}s (max {MAX_SWEEP_INTERVAL}s), "
+          f"idle backoff x{IDLE_BACKOFF_FACTOR:g}")
+    print(f"Pending notification interval: {PENDING_NOTIFICATION_INTERVAL_SECONDS}s"
+          f" ({'enabled' if PENDING_NOTIFICATION_ENABLED else 'disabled'})")
+    print(f"Engine: {ENGINE}")
+    if WEBHOOK_PORT:
+        print(f"Webhook mode: reconciliation poll every {WEBHOOK_RECONCILE_INTERVAL}s")
+    if INSTANCES_FILE:
+        print(f"Instances: {', '.join(instance.name for instance in instances)} ({INSTANCES_FILE})")
+    print("Press Ctrl+C to stop")
+    print("-" * 60)
+    
+    for instance in instances:
+        with using_instance(instance):
+            setup_instance(instance)
+    if COMPLETED_RETENTION_DAYS > 0:
+        print(f"Completed ticket retention: {COMPLETED_RETENTION_DAYS:g} days")
+    
+    if RECORD_FILE and len(instances) > 1:
+        # 再生は1台のRedmineサーバーの記録だけを扱う
+        print("Recording is only supported with a single Redmine instance; RECORD_FILE ignored")
+    elif RECORD_FILE:
+        with using_instance(instances[0]):
+            recorder.start(instances[0].high_water_mark or datetime.now(timezone.utc))
+        print(f"Recording Redmine and Slack traffic to {RECORD_FILE}")
+    if WEBHOOK_PORT:
+        start_webhook_server()
+    if METRICS_PORT:
+        start_metrics_server()
+    
+    if ENGINE == "async":
+        asyncio.run(run_async_engine(instances))
+    else:
+        run_sync_loop(instances)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
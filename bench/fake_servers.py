@@ -0,0 +1,286 @@
+"""
+ベンチマーク用のRedmine（/issues.json, /issues/{id}.json）とSlack Web API（/api/{method}）の代替サーバー
+
+応答の遅延・エラー率・チケット数を指定して起動し、/_bench/ 以下のエンドポイントで
+チケットの作成・完了・更新を進めたり、受け付けたリクエスト数を取得したりする
+
+例: python bench/fake_servers.py --tickets 10000 --redmine-latency-ms 20 --slack-latency-ms 50
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# 完了として扱うステータス
+CLOSED_STATUS = {"id": 5, "name": "完了"}
+OPEN_STATUSES = [{"id": 1, "name": "新規"}, {"id": 2, "name": "未着手"}, {"id": 3, "name": "進行中"}]
+
+
+def format_time(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def conditional_response(data, if_none_match=None):
+    """
+    本文から計算したETagを付けて (ステータス, 本文, ヘッダー) を返す
+    ETagが一致する場合は本文なしの304を返す
+    """
+    body = json.dumps(data, ensure_ascii=False)
+    etag = '"' + hashlib.md5(body.encode()).hexdigest() + '"'
+    if if_none_match == etag:
+        return 304, None, {"ETag": etag}
+    return 200, data, {"ETag": etag}
+
+
+def issue_response(issue, if_none_match=None):
+    """
+    /issues/{id}.json の応答を (ステータス, 本文, ヘッダー) で返す
+    """
+    if issue is None:
+        return 404, {"errors": ["Not found"]}, {}
+    return conditional_response({"issue": issue}, if_none_match)
+
+
+class FakeRedmine:
+    """
+    チケットをメモリ上に保持し、Redmine REST APIと同じ形式で返す
+    """
+    def __init__(self, tickets, tracker_id, project_id, seed):
+        self.random = random.Random(seed)
+        self.tracker_id = tracker_id
+        self.project_id = project_id
+        self.issues = {}
+        self.open_ids = []
+        self._lock = threading.Lock()
+
+        # 既存のチケットは直近7日間に作成されたものとする
+        now = datetime.now(timezone.utc)
+        for i in range(tickets):
+            self._create(now - timedelta(days=7) * (tickets - i) / tickets)
+
+    def _create(self, created_on):
+        ticket_id = len(self.issues) + 1
+        created = format_time(created_on)
+        self.issues[ticket_id] = {
+            "id": ticket_id,
+            "project": {"id": self.project_id, "name": "bench"},
+            "tracker": {"id": self.tracker_id, "name": "bench"},
+            "status": OPEN_STATUSES[0],
+            "author": {"id": 1, "name": "bench"},
+            "subject": f"Benchmark ticket {ticket_id}",
+            "description": "Benchmark ticket created by bench/fake_servers.py",
+            "created_on": created,
+            "updated_on": created,
+        }
+        self.open_ids.append(ticket_id)
+
+    def tick(self, new=0, close=0, update=0):
+        """
+        チケットを新規作成・完了・更新して、1周期分のRedmine側の変化を進める
+        """
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            for _ in range(new):
+                self._create(now)
+            self.random.shuffle(self.open_ids)
+            for _ in range(min(close, len(self.open_ids))):
+                issue = self.issues[self.open_ids.pop()]
+                issue["status"] = CLOSED_STATUS
+                issue["updated_on"] = format_time(now)
+            for ticket_id in self.open_ids[:update]:
+                issue = self.issues[ticket_id]
+                issue["status"] = self.random.choice(OPEN_STATUSES)
+                issue["updated_on"] = format_time(now)
+            return {"tickets": len(self.issues), "open": len(self.open_ids)}
+
+    def current_issues(self):
+        return self.issues
+
+    def is_closed(self, issue):
+        return issue["status"] is CLOSED_STATUS
+
+    def list_issues(self, query):
+        """
+        /issues.json の絞り込み・並び替え・ページングを行う
+        """
+        with self._lock:
+            issues = self.current_issues()
+            if "issue_id" in query:
+                ids = [int(x) for x in query["issue_id"].split(",") if x]
+                items = [issues[i] for i in ids if i in issues]
+            else:
+                items = list(issues.values())
+            if query.get("status_id") != "*":
+                items = [issue for issue in items if not self.is_closed(issue)]
+            if "created_on" in query:
+                since = query["created_on"].lstrip(">=")
+                items = [issue for issue in items if issue["created_on"] >= since]
+            for key, field in (("tracker_id", "tracker"), ("project_id", "project")):
+                if key in query:
+                    ids = {int(x) for x in re.split(r"[|,]", query[key]) if x}
+                    items = [issue for issue in items if issue[field]["id"] in ids]
+
+        sort = query.get("sort", "id:desc")
+        field, _, order = sort.partition(":")
+        items.sort(key=lambda issue: (issue.get(field, ""), issue["id"]), reverse=order == "desc")
+        offset = int(query.get("offset", 0))
+        limit = min(int(query.get("limit", 25)), 100)
+        return {"issues": items[offset:offset + limit], "total_count": len(items), "offset": offset, "limit": limit}
+
+    def get_issue(self, ticket_id):
+        with self._lock:
+            return self.current_issues().get(ticket_id)
+
+
+class BenchServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, redmine, args):
+        super().__init__(address, BenchHandler)
+        self.redmine = redmine
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = {"redmine_requests": 0, "redmine_errors": 0, "redmine_not_modified": 0,
+                          "slack_calls": 0, "slack_ratelimited": 0, "slack_errors": 0}
+
+    def count(self, name):
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def delay(self, latency_ms):
+        # 指定の遅延を中心に±50%のばらつきを持たせる
+        if latency_ms > 0:
+            time.sleep(latency_ms / 1000 * self.random.uniform(0.5, 1.5))
+
+    def fails(self, rate):
+        return rate > 0 and self.random.random() < rate
+
+
+class BenchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # アクセスログは出力しない
+        pass
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == "/_bench/stats":
+            with server.stats_lock:
+                return self._send_json(200, dict(server.stats))
+
+        server.count("redmine_requests")
+        server.delay(server.args.redmine_latency_ms)
+        if server.fails(server.args.redmine_error_rate):
+            server.count("redmine_errors")
+            return self._send_json(500, {"errors": ["Internal error"]})
+
+        match = re.fullmatch(r"/issues/(\d+)\.json", url.path)
+        if url.path == "/issues.json" or match:
+            if match:
+                status, data, headers = issue_response(server.redmine.get_issue(int(match.group(1))),
+                                                       self.headers.get("If-None-Match"))
+            else:
+                status, data, headers = conditional_response(server.redmine.list_issues(query),
+                                                             self.headers.get("If-None-Match"))
+            if status == 304:
+                server.count("redmine_not_modified")
+                self.send_response(304)
+                self.send_header("ETag", headers["ETag"])
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            return self._send_json(status, data, headers)
+
+        self._send_json(404, {"errors": ["Not found"]})
+
+    def do_POST(self):
+        server = self.server
+        url = urlparse(self.path)
+        body = self._read_body()
+
+        if url.path == "/_bench/tick":
+            params = json.loads(body or b"{}")
+            return self._send_json(200, server.redmine.tick(**params))
+        if url.path == "/_bench/reset":
+            server.reset_stats()
+            return self._send_json(200, {"ok": True})
+
+        if not url.path.startswith("/api/"):
+            return self._send_json(404, {"ok": False, "error": "unknown_method"})
+
+        server.count("slack_calls")
+        server.delay(server.args.slack_latency_ms)
+        if server.fails(server.args.slack_ratelimit_rate):
+            server.count("slack_ratelimited")
+            return self._send_json(429, {"ok": False, "error": "ratelimited"}, {"Retry-After": "1"})
+        if server.fails(server.args.slack_error_rate):
+            server.count("slack_errors")
+            return self._send_json(500, {"ok": False, "error": "internal_error"})
+
+        try:
+            params = json.loads(body) if body.startswith(b"{") else {k: v[0] for k, v in parse_qs(body.decode()).items()}
+        except ValueError:
+            params = {}
+        ts = f"{time.time():.6f}"
+        self._send_json(200, {"ok": True, "channel": params.get("channel", "CBENCH"), "ts": ts})
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Fake Redmine and Slack Web API servers for benchmarking")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port")
+    parser.add_argument("--tickets", type=int, default=1000, help="open tickets to create at startup")
+    parser.add_argument("--tracker-id", type=int, default=28)
+    parser.add_argument("--project-id", type=int, default=2)
+    parser.add_argument("--redmine-latency-ms", type=float, default=0)
+    parser.add_argument("--redmine-error-rate", type=float, default=0, help="fraction of Redmine requests answered with 500")
+    parser.add_argument("--slack-latency-ms", type=float, default=0)
+    parser.add_argument("--slack-ratelimit-rate", type=float, default=0, help="fraction of Slack calls answered with 429")
+    parser.add_argument("--slack-error-rate", type=float, default=0, help="fraction of Slack calls answered with 500")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    redmine = FakeRedmine(args.tickets, args.tracker_id, args.project_id, args.seed)
+    server = BenchServer((args.host, args.port), redmine, args)
+    # 起動したことと待ち受けのURLを呼び出し元に知らせる
+    print(f"Listening on http://{args.host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,491 @@
+"""
+RECORD_FILE に記録したRedmine / Slackとの通信を、ネットワークを使わずに通知処理へ再生する
+
+Redmineへのリクエストには記録された応答から組み立てたチケットの時系列で答え、
+Slackへの呼び出しはその場で成功として応答する。通知処理の時計を仮想化して待ち時間を縮めるため、
+1日分の記録も短時間で再生できる（--speed 0 の場合は待ち時間をすべて飛ばす）
+
+再生後に、記録時と再生時で通知・リアクション・削除の対象になったチケットと
+リクエスト数を比較して表示する。--output で結果をJSONに保存し、--compare で前回の再生結果と比較できる
+
+例: RECORD_FILE=traffic.jsonl.gz python app.py
+    python bench/replay.py traffic.jsonl.gz --output before.json
+    python bench/replay.py traffic.jsonl.gz --speed 1000 --compare before.json
+"""
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from fake_servers import FakeRedmine, conditional_response, issue_response
+from run_benchmark import REPO_DIR, configure_environment, state_bytes
+
+# 再生時のRedmineのURL（名前解決はせず、セッションに登録したアダプターが応答する）
+REPLAY_REDMINE_URL = "http://redmine.replay"
+# 完了として扱うステータス（app.py の完了判定と同じ）
+CLOSED_STATUS_NAMES = {"完了", "終了", "クローズ", "Closed", "Resolved", "Done"}
+ISSUE_PATH = re.compile(r"/issues/(\d+)\.json")
+TICKET_LINK = re.compile(r"/issues/(\d+)")
+# まとめて通知したメッセージのスレッドへの完了・削除の返信（「:絵文字: <URL|#チケットID>」）
+THREAD_REPLY = re.compile(r":([\w+-]+): <[^|>]*/issues/(\d+)\|")
+
+
+class ReplayFinished(BaseException):
+    """
+    仮想時刻が記録の終了時刻に達したことを知らせる（通知処理側の例外処理で握りつぶされないようにする）
+    """
+
+
+class VirtualClock:
+    """
+    記録の開始時刻から speed 倍の速さで進む仮想の時計
+    sleep は実時間を 1/speed に縮めて待つ（speed が0の場合は待たずに時計だけ進める）
+    記録の終了時刻を越えて待とうとすると ReplayFinished を送出する（記録にない時間帯は再生しない）
+    """
+    def __init__(self, start, end, speed):
+        self.start = start
+        self.end = end
+        self.speed = speed
+        self._real_start = time.monotonic()
+        self._skipped = 0.0
+        self._lock = threading.Lock()
+
+    def time(self):
+        with self._lock:
+            return self.start + self._skipped + (time.monotonic() - self._real_start) * self.speed
+
+    def monotonic(self):
+        return self.time()
+
+    def sleep(self, seconds):
+        seconds = max(seconds, 0)
+        if self.time() + seconds > self.end:
+            raise ReplayFinished()
+        if self.speed:
+            time.sleep(seconds / self.speed)
+        else:
+            with self._lock:
+                self._skipped += seconds
+
+
+class VirtualTimeModule:
+    """
+    通知処理の time モジュールの代わりに置き、時刻の取得と待機だけを仮想の時計に向ける
+    """
+    def __init__(self, clock):
+        self.time = clock.time
+        self.monotonic = clock.monotonic
+        self.sleep = clock.sleep
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def virtual_datetime(clock):
+    """
+    now() が仮想の時計の時刻を返す datetime のサブクラスを作る
+    """
+    class VirtualDateTime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.fromtimestamp(clock.time(), tz)
+    return VirtualDateTime
+
+
+def parse_timestamp(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() if value else None
+
+
+class ReplayRedmine(FakeRedmine):
+    """
+    記録されたRedmineの応答からチケットごとの観測を時刻順に並べ、仮想時刻の時点で観測済みの状態を返す
+
+    再生時はリクエストの時刻が記録時と少しずれるため、観測した状態は実際に変化した時刻から有効とする
+    （最初の観測は作成時刻、以降の観測は更新時刻から。ただし前回の観測より前には戻さない）
+    削除（404）を観測したチケットはそれ以降存在しないものとする
+    """
+    def __init__(self, records, clock):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._issues = {}
+        self._applied = 0
+        self.observations = []  # (有効になる時刻, チケットID, チケット or None)
+        effective_since = {}    # チケットID -> 前回の観測が有効になった時刻
+        for record in records:
+            if record["type"] != "redmine":
+                continue
+            body = record.get("body") or {}
+            if record["status"] == 200:
+                for issue in body.get("issues", []) + ([body["issue"]] if "issue" in body else []):
+                    ticket_id = issue["id"]
+                    if ticket_id in effective_since:
+                        changed_at = parse_timestamp(issue.get("updated_on")) or record["time"]
+                        at = max(effective_since[ticket_id], min(record["time"], changed_at))
+                    else:
+                        at = min(record["time"], parse_timestamp(issue.get("created_on")) or record["time"])
+                    effective_since[ticket_id] = at
+                    self.observations.append((at, ticket_id, issue))
+            elif record["status"] == 404:
+                match = ISSUE_PATH.fullmatch(record["path"])
+                if match:
+                    self.observations.append((record["time"], int(match.group(1)), None))
+        self.observations.sort(key=lambda observation: observation[0])
+
+    def current_issues(self):
+        # 時計は戻らないため、前回以降に観測時刻を過ぎた分だけ反映する
+        now = self.clock.time()
+        while self._applied < len(self.observations) and self.observations[self._applied][0] <= now:
+            _, ticket_id, issue = self.observations[self._applied]
+            if issue is None:
+                self._issues.pop(ticket_id, None)
+            else:
+                self._issues[ticket_id] = issue
+            self._applied += 1
+        return self._issues
+
+    def is_closed(self, issue):
+        return issue.get("status", {}).get("name") in CLOSED_STATUS_NAMES
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    通知処理のRedmineセッションに登録し、HTTP通信の代わりに ReplayRedmine から応答する
+    """
+    def __init__(self, redmine):
+        super().__init__()
+        self.redmine = redmine
+        self.requests = 0
+
+    def send(self, request, **kwargs):
+        self.requests += 1
+        url = urlparse(request.url)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        headers = {}
+        match = ISSUE_PATH.fullmatch(url.path)
+        if url.path == "/issues.json":
+            status, data, headers = conditional_response(self.redmine.list_issues(query),
+                                                         request.headers.get("If-None-Match"))
+        elif match:
+            status, data, headers = issue_response(self.redmine.get_issue(int(match.group(1))),
+                                                   request.headers.get("If-None-Match"))
+        else:
+            status, data = 404, {"errors": ["Not found"]}
+
+        response = requests.Response()
+        response.status_code = status
+        response._content = b"" if data is None else json.dumps(data, ensure_ascii=False).encode()
+        response.headers = CaseInsensitiveDict({"Content-Type": "application/json; charset=utf-8", **headers})
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class ReplaySlack:
+    """
+    Slack WebClient の代わりに置き、呼び出しを記録して成功として応答する
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        self.calls = []  # (メソッド, 引数, 応答)
+        self._lock = threading.Lock()
+
+    def __getattr__(self, method):
+        def call(**kwargs):
+            with self._lock:
+                # 待ち時間を飛ばすと同じ時刻に複数の投稿が起きるため、連番でメッセージIDを一意にする
+                response = {"ok": True, "channel": kwargs.get("channel"),
+                            "ts": f"{int(self.clock.time())}.{len(self.calls):06d}"}
+                self.calls.append((method, kwargs, response))
+            return response
+        return call
+
+
+def load_recording(path):
+    """
+    記録ファイルを読み込み、(開始レコード, 時刻順の通信レコード) を返す
+    """
+    start = None
+    records = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                # 書きかけの行は読み飛ばす
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record["type"] == "start":
+                    # 追記で複数回記録された場合は最初の開始時点から再生する
+                    start = start or record
+                else:
+                    records.append(record)
+        except EOFError:
+            # 記録中に強制終了され、圧縮の末尾が書き出されていない場合はそこまでを使う
+            pass
+    if start is None:
+        raise SystemExit(f"{path}: no start record (was it written with RECORD_FILE?)")
+    records.sort(key=lambda record: record["time"])
+    return start, records
+
+
+def summarize_slack(calls, messages):
+    """
+    Slackへの呼び出し (メソッド, 引数, 応答) を、チケットごとの通知・リアクション・削除にまとめる
+    messages は開始時点の メッセージID -> チケットID
+    """
+    messages = dict(messages)
+    summary = {"calls": Counter(), "notified": [], "pending_notified": [], "reactions": {}, "deleted": []}
+    for method, args, response in calls:
+        summary["calls"][method] += 1
+        if not response.get("ok"):
+            continue
+        if method == "chat_postMessage" and args.get("thread_ts"):
+            # まとめて通知したチケットへの返信はリアクションと同じく数える
+            match = THREAD_REPLY.match(args.get("text", ""))
+            if match:
+                summary["reactions"].setdefault(match.group(1), []).append(int(match.group(2)))
+        elif method == "chat_postMessage":
+            ticket_ids = [int(ticket_id) for ticket_id in
+                          TICKET_LINK.findall(json.dumps(args.get("attachments", []), ensure_ascii=False))]
+            if not ticket_ids:
+                continue
+            # まとめて通知したメッセージへのリアクションは、まとめたチケットの組に対するものとする
+            messages[response.get("ts")] = ticket_ids[0] if len(ticket_ids) == 1 else tuple(ticket_ids)
+            kind = "pending_notified" if args.get("text", "").startswith("未着手") else "notified"
+            summary[kind].extend(ticket_ids)
+        elif method == "reactions_add":
+            summary["reactions"].setdefault(args.get("name"), []).append(messages.get(args.get("timestamp")))
+        elif method == "chat_delete":
+            summary["deleted"].append(messages.get(args.get("ts")))
+
+    summary["calls"] = dict(summary["calls"])
+    for key in ("notified", "pending_notified", "deleted"):
+        summary[key] = sorted(summary[key], key=str)
+    summary["reactions"] = {name: sorted(ids, key=str) for name, ids in summary["reactions"].items()}
+    return summary
+
+
+def channel_messages(value):
+    """
+    開始レコードのメッセージIDを チャンネル -> メッセージID にする（チャンネル別になる前の記録はNoneを既定のチャンネルとする）
+    """
+    if isinstance(value, dict):
+        return value
+    return {None: value} if value else {}
+
+
+def initial_messages(start):
+    """
+    開始時点で追跡中のチケットの メッセージID -> チケットID を返す
+    """
+    messages = {}
+    for ticket_id, message_ids, _, _, pending_message_ids in start["tickets"]:
+        for ts in [*channel_messages(message_ids).values(), *channel_messages(pending_message_ids).values()]:
+            messages[ts] = ticket_id
+    return messages
+
+
+def seed_state(app, start):
+    """
+    記録の開始時点のハイウォーターマークと追跡中のチケットを再生用の状態に書き出す
+    """
+    app.save_high_water_mark(app.parse_redmine_time(start["high_water_mark"]))
+    app.state.load()
+    for ticket_id, message_ids, tracker_id, creation_time, pending_message_ids in start["tickets"]:
+        app.state.mark_notified(ticket_id)
+        for channel, message_id in channel_messages(message_ids).items():
+            app.state.set_message(ticket_id, message_id, channel)
+        if tracker_id:
+            app.state.set_tracker(ticket_id, tracker_id)
+        if creation_time:
+            app.state.set_creation_time(ticket_id, creation_time)
+        for channel, message_id in channel_messages(pending_message_ids).items():
+            app.state.set_pending_message(ticket_id, message_id, channel)
+    app.state.flush()
+
+
+def replay(app, start, records, args):
+    """
+    通知処理の時計・Redmineセッション・Slackクライアントを差し替え、記録の終了時刻まで同期ループを実行する
+    """
+    clock = VirtualClock(start["time"], records[-1]["time"] if records else start["time"], args.speed)
+    app.time = VirtualTimeModule(clock)
+    app.datetime = virtual_datetime(clock)
+    adapter = ReplayAdapter(ReplayRedmine(records, clock))
+    app.redmine.session.mount(REPLAY_REDMINE_URL, adapter)
+    app.slack.client = ReplaySlack(clock)
+    if args.no_slack_rate_limit:
+        # レート制限による送信の遅れをなくした場合の動作を確かめる
+        app.SLACK_RATE_LIMITS = {}
+        app.SLACK_DEFAULT_RATE_LIMIT = (float("inf"), float("inf"))
+
+    seed_state(app, start)
+    bytes_before = state_bytes(app)
+
+    # 周期ごとの実時間を、次の周期を待ち始めるまでの時間として測る
+    cycle_seconds = []
+    wait_for_next_cycle = app.wait_for_next_cycle
+    cycle_started = time.perf_counter()
+
+    def timed_wait(instances):
+        nonlocal cycle_started
+        cycle_seconds.append(time.perf_counter() - cycle_started)
+        wait_for_next_cycle(instances)
+        cycle_started = time.perf_counter()
+
+    app.wait_for_next_cycle = timed_wait
+    started = time.perf_counter()
+    try:
+        app.get_instance().high_water_mark = app.load_high_water_mark()
+        app.run_sync_loop(app.get_instances())
+    except ReplayFinished:
+        pass
+    app.state.flush()
+    if getattr(app.state, "_compaction_thread", None):
+        app.state._compaction_thread.join()
+
+    return {
+        "recorded_seconds": clock.end - clock.start,
+        "replay_seconds": time.perf_counter() - started,
+        "cycles": len(cycle_seconds),
+        "cycle_seconds_mean": statistics.mean(cycle_seconds) if cycle_seconds else 0.0,
+        "cycle_seconds_max": max(cycle_seconds, default=0.0),
+        "redmine_requests": adapter.requests,
+        "state_bytes": state_bytes(app) - bytes_before,
+        "slack": summarize_slack(app.slack.client.calls, initial_messages(start)),
+    }
+
+
+def recorded_summary(start, records):
+    """
+    記録時のリクエスト数とSlackへの呼び出しを再生結果と同じ形にまとめる
+    """
+    calls = [(r["method"], r["args"], r["response"]) for r in records if r["type"] == "slack"]
+    return {
+        "redmine_requests": sum(1 for r in records if r["type"] == "redmine"),
+        "slack": summarize_slack(calls, initial_messages(start)),
+    }
+
+
+def compare_tickets(label, recorded, replayed):
+    """
+    記録時と再生時で対象のチケットが異なる場合に差分を表示し、一致したかを返す
+    """
+    missing = sorted(set(recorded) - set(replayed), key=str)
+    extra = sorted(set(replayed) - set(recorded), key=str)
+    status = "ok" if not missing and not extra else "DIFFERS"
+    print(f"{label:<24} {len(recorded):>9} {len(replayed):>9}   {status}")
+    if missing:
+        print(f"  only in recording: {missing[:20]}{' ...' if len(missing) > 20 else ''}")
+    if extra:
+        print(f"  only in replay:    {extra[:20]}{' ...' if len(extra) > 20 else ''}")
+    return status == "ok"
+
+
+def print_report(recorded, result, baseline=None):
+    print(f"Replayed {result['recorded_seconds'] / 3600:.1f}h of traffic in {result['replay_seconds']:.1f}s "
+          f"({result['cycles']} cycles)")
+    print()
+    print(f"{'':<24} {'recorded':>9} {'replayed':>9}")
+    print(f"{'redmine requests':<24} {recorded['redmine_requests']:>9} {result['redmine_requests']:>9}")
+    # 記録時の呼び出し数には再試行も含まれる
+    for method in sorted(set(recorded["slack"]["calls"]) | set(result["slack"]["calls"])):
+        print(f"{'slack ' + method:<24} {recorded['slack']['calls'].get(method, 0):>9} "
+              f"{result['slack']['calls'].get(method, 0):>9}")
+    matched = all([
+        compare_tickets("notified", recorded["slack"]["notified"], result["slack"]["notified"]),
+        compare_tickets("pending notified", recorded["slack"]["pending_notified"], result["slack"]["pending_notified"]),
+        compare_tickets("deleted messages", recorded["slack"]["deleted"], result["slack"]["deleted"]),
+    ] + [
+        compare_tickets(f"reaction :{name}:", recorded["slack"]["reactions"].get(name, []),
+                        result["slack"]["reactions"].get(name, []))
+        for name in sorted(set(recorded["slack"]["reactions"]) | set(result["slack"]["reactions"]))
+    ])
+    print()
+
+    rows = [
+        ("replay (s)", "replay_seconds", "{:.2f}"),
+        ("cycle mean (ms)", "cycle_seconds_mean", "{:.2f}", 1000),
+        ("cycle max (ms)", "cycle_seconds_max", "{:.2f}", 1000),
+        ("redmine requests", "redmine_requests", "{:.0f}"),
+        ("state bytes", "state_bytes", "{:.0f}"),
+    ]
+    for label, key, fmt, *scale in rows:
+        scale = scale[0] if scale else 1
+        value = result[key] * scale
+        line = f"{label:<24} {fmt.format(value):>12}"
+        if baseline and baseline.get(key):
+            change = (result[key] - baseline[key]) / baseline[key] * 100
+            line += f"   (baseline {fmt.format(baseline[key] * scale)}, {change:+.1f}%)"
+        print(line)
+    return matched
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Replay recorded Redmine and Slack traffic against the notifier")
+    parser.add_argument("recording", help="file written with RECORD_FILE")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="virtual seconds per real second (0 skips the waits entirely)")
+    parser.add_argument("--backend", choices=["file", "sqlite"], default="file")
+    parser.add_argument("--no-slack-rate-limit", action="store_true",
+                        help="drop the notifier's client-side Slack rate limits (the replay then diverges from the recording)")
+    parser.add_argument("--output", help="write the replay results as JSON")
+    parser.add_argument("--compare", help="JSON results of a previous replay to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show the notifier's own output")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    start, records = load_recording(args.recording)
+    data_dir = tempfile.mkdtemp(prefix="notifier-replay-")
+
+    # 記録時の設定で再生する（明示的に指定された環境変数はそのまま使う）
+    for name, value in start.get("settings", {}).items():
+        os.environ.setdefault(name, value)
+    configure_environment(REPLAY_REDMINE_URL, data_dir, args)
+    # 再生中は外部からの入力の待ち受けや通信の記録を行わない
+    os.environ.update({"REDMINE_URL": REPLAY_REDMINE_URL, "WEBHOOK_PORT": "0", "METRICS_PORT": "0", "RECORD_FILE": "",
+                       "SHARD_DIR": "", "INSTANCES_FILE": ""})
+    sys.path.insert(0, REPO_DIR)
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        import app
+        result = replay(app, start, records, args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print(f"Replay: {args.recording}, speed {'max' if not args.speed else f'x{args.speed:g}'}, "
+          f"{args.backend} backend (state in {data_dir})")
+    matched = print_report(recorded_summary(start, records), result, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"Results written to {args.output}")
+    sys.exit(0 if matched else 1)
+
+
+if __name__ == "__main__":
+    main()
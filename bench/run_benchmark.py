@@ -0,0 +1,262 @@
+"""
+代替のRedmine / Slackサーバーに対して通知処理を指定の周期数だけ実行し、性能を計測する
+
+周期ごとの所要時間・Redmine / Slackへのリクエスト数・状態ファイルへの書き込みバイト数と、
+プロセスのピークメモリを表示する。--output で結果をJSONに保存し、--compare で前回の結果と比較できる
+
+例: python bench/run_benchmark.py --tickets 10000 --cycles 10 --new 20 --close 50 --output before.json
+    python bench/run_benchmark.py --tickets 10000 --cycles 10 --new 20 --close 50 --compare before.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from urllib.request import Request, urlopen
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+
+def start_fake_servers(args):
+    """
+    代替サーバーを別プロセスで起動し、(プロセス, URL) を返す
+    （サーバー側の処理がメモリや時間の計測に混ざらないようにする）
+    """
+    command = [
+        sys.executable, os.path.join(BENCH_DIR, "fake_servers.py"),
+        "--tickets", str(args.tickets),
+        "--redmine-latency-ms", str(args.redmine_latency_ms),
+        "--redmine-error-rate", str(args.redmine_error_rate),
+        "--slack-latency-ms", str(args.slack_latency_ms),
+        "--slack-ratelimit-rate", str(args.slack_ratelimit_rate),
+        "--slack-error-rate", str(args.slack_error_rate),
+        "--seed", str(args.seed),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline().strip()
+    if not line.startswith("Listening on "):
+        process.kill()
+        raise RuntimeError(f"Fake servers failed to start: {line!r}")
+    return process, line[len("Listening on "):]
+
+
+def call_bench_api(base_url, path, payload=None):
+    data = None if payload is None else json.dumps(payload).encode()
+    request = Request(f"{base_url}{path}", data=data, method="GET" if data is None else "POST",
+                      headers={"Content-Type": "application/json"})
+    with urlopen(request, timeout=60) as response:
+        return json.loads(response.read())
+
+
+def seed_state(data_dir, tickets):
+    """
+    代替サーバーの既存チケット（ID 1〜tickets）をすべて通知済みとして状態ファイルに書き出す
+    """
+    with open(os.path.join(data_dir, "notified_tickets.txt"), "w") as f:
+        f.writelines(f"{ticket_id}\n" for ticket_id in range(1, tickets + 1))
+    with open(os.path.join(data_dir, "message_mapping.txt"), "w") as f:
+        f.writelines(f"{ticket_id},{1700000000 + ticket_id}.000000\n" for ticket_id in range(1, tickets + 1))
+    with open(os.path.join(data_dir, "tracker_mapping.txt"), "w") as f:
+        f.writelines(f"{ticket_id},28\n" for ticket_id in range(1, tickets + 1))
+    with open(os.path.join(data_dir, "last_check.txt"), "w") as f:
+        f.write(datetime.now(timezone.utc).isoformat())
+
+
+def configure_environment(base_url, data_dir, args):
+    """
+    通知処理の設定を環境変数で与える（明示的に指定された環境変数はそのまま使う）
+    """
+    defaults = {
+        "REDMINE_URL": base_url,
+        "REDMINE_API_KEY": "bench",
+        "SLACK_API_URL": f"{base_url}/api/",
+        "SLACK_BOT_TOKEN": "xoxb-bench",
+        "SLACK_CHANNEL_ID": "CBENCH",
+        "POLLING_INTERVAL": "30",
+        "PENDING_NOTIFICATION_INTERVAL_SECONDS": "3600",
+        "NOTIFY_TRACKER_IDS": "28",
+        "NOTIFY_PROJECT_IDS": "2",
+        "USER_MAPPING_JSON": "{}",
+        "STATE_BACKEND": args.backend,
+        # 周期の間で時間を進めないため、通知済みのチケットを毎周期すべて確認する
+        "SWEEP_INTERVAL": "0",
+        "COMPLETION_CHECK_AGE_RATIO": "0",
+    }
+    for name in ("LAST_CHECK_FILE", "NOTIFIED_TICKETS_FILE", "COMPLETED_TICKETS_FILE", "MESSAGE_MAPPING_FILE",
+                 "TRACKER_MAPPING_FILE", "CREATION_TIME_MAPPING_FILE", "PENDING_MESSAGE_MAPPING_FILE",
+                 "STATE_JOURNAL_FILE"):
+        defaults[name] = os.path.join(data_dir, name[:-len("_FILE")].lower() + ".txt")
+    defaults["STATE_DB_FILE"] = os.path.join(data_dir, "state.db")
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+
+def state_bytes(app):
+    """
+    状態の書き込みバイト数を返す
+    書き込み量を数えていないバックエンド（sqlite）は状態ファイルのサイズの合計で代用する
+    """
+    written = getattr(app.state, "bytes_written", None)
+    if written is not None:
+        return written
+    return sum(size for _, size in app.state_file_sizes())
+
+
+def run_cycles(app, base_url, args):
+    """
+    新規チケットの取得・通知済みチケットの確認・状態の保存を1周期として指定の回数だけ実行する
+    """
+    high_water_mark = app.load_high_water_mark()
+    results = []
+    for cycle in range(1, args.cycles + 1):
+        call_bench_api(base_url, "/_bench/tick", {"new": args.new, "close": args.close, "update": args.update})
+        call_bench_api(base_url, "/_bench/reset", {})
+        bytes_before = state_bytes(app)
+
+        start = time.perf_counter()
+        next_high_water_mark = app.poll_new_issues(high_water_mark)
+        changed_tickets = app.sweep_open_tickets()
+        app.state.flush()
+        if next_high_water_mark != high_water_mark:
+            high_water_mark = next_high_water_mark
+            app.save_high_water_mark(high_water_mark)
+        elapsed = time.perf_counter() - start
+
+        stats = call_bench_api(base_url, "/_bench/stats")
+        results.append({
+            "cycle": cycle,
+            "seconds": elapsed,
+            "redmine_requests": stats["redmine_requests"],
+            "slack_calls": stats["slack_calls"],
+            "state_bytes": state_bytes(app) - bytes_before,
+            "changed": len(changed_tickets),
+        })
+    return results
+
+
+def summarize(results, load_seconds, peak_rss_kb, peak_heap_bytes, args):
+    seconds = [r["seconds"] for r in results]
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "verbose")},
+        "load_seconds": load_seconds,
+        "cycle_seconds_mean": statistics.mean(seconds),
+        "cycle_seconds_median": statistics.median(seconds),
+        "cycle_seconds_max": max(seconds),
+        "redmine_requests_per_cycle": statistics.mean(r["redmine_requests"] for r in results),
+        "slack_calls_per_cycle": statistics.mean(r["slack_calls"] for r in results),
+        "state_bytes_per_cycle": statistics.mean(r["state_bytes"] for r in results),
+        "peak_rss_mb": peak_rss_kb / 1024,
+        "peak_python_heap_mb": peak_heap_bytes / 1024 / 1024 if peak_heap_bytes is not None else None,
+        "cycles": results,
+    }
+
+
+def print_report(summary, baseline=None):
+    print(f"{'cycle':>5} {'seconds':>9} {'redmine':>8} {'slack':>6} {'state bytes':>12} {'changed':>8}")
+    for r in summary["cycles"]:
+        print(f"{r['cycle']:>5} {r['seconds']:>9.3f} {r['redmine_requests']:>8} {r['slack_calls']:>6} "
+              f"{r['state_bytes']:>12} {r['changed']:>8}")
+    print()
+
+    rows = [
+        ("state load (s)", "load_seconds", "{:.3f}"),
+        ("cycle mean (s)", "cycle_seconds_mean", "{:.3f}"),
+        ("cycle median (s)", "cycle_seconds_median", "{:.3f}"),
+        ("cycle max (s)", "cycle_seconds_max", "{:.3f}"),
+        ("redmine requests/cycle", "redmine_requests_per_cycle", "{:.1f}"),
+        ("slack calls/cycle", "slack_calls_per_cycle", "{:.1f}"),
+        ("state bytes/cycle", "state_bytes_per_cycle", "{:.0f}"),
+        ("peak RSS (MB)", "peak_rss_mb", "{:.1f}"),
+        ("peak Python heap (MB)", "peak_python_heap_mb", "{:.1f}"),
+    ]
+    for label, key, fmt in rows:
+        value = summary.get(key)
+        if value is None:
+            continue
+        line = f"{label:<24} {fmt.format(value):>12}"
+        if baseline and baseline.get(key):
+            change = (value - baseline[key]) / baseline[key] * 100
+            line += f"   (baseline {fmt.format(baseline[key])}, {change:+.1f}%)"
+        print(line)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the notifier against fake Redmine and Slack servers")
+    parser.add_argument("--tickets", type=int, default=1000, help="tracked open tickets at startup")
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--new", type=int, default=10, help="tickets created before each cycle")
+    parser.add_argument("--close", type=int, default=10, help="tickets completed before each cycle")
+    parser.add_argument("--update", type=int, default=10, help="tickets updated before each cycle")
+    parser.add_argument("--backend", choices=["file", "sqlite"], default="file")
+    parser.add_argument("--redmine-latency-ms", type=float, default=5)
+    parser.add_argument("--redmine-error-rate", type=float, default=0)
+    parser.add_argument("--slack-latency-ms", type=float, default=5)
+    parser.add_argument("--slack-ratelimit-rate", type=float, default=0)
+    parser.add_argument("--slack-error-rate", type=float, default=0)
+    parser.add_argument("--slack-rate-limit", action="store_true",
+                        help="keep the notifier's client-side Slack rate limits (cycle time then includes the waits)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tracemalloc", action="store_true", help="also measure the peak Python heap (slower)")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show the notifier's own output")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    data_dir = tempfile.mkdtemp(prefix="notifier-bench-")
+    process, base_url = start_fake_servers(args)
+    try:
+        seed_state(data_dir, args.tickets)
+        configure_environment(base_url, data_dir, args)
+        sys.path.insert(0, REPO_DIR)
+
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        if args.tracemalloc:
+            tracemalloc.start()
+        with output:
+            import app
+
+            if not args.slack_rate_limit:
+                # Slackのレート制限による待ち時間で通知処理自体の所要時間が見えなくなるため外す
+                app.SLACK_RATE_LIMITS = {}
+                app.SLACK_DEFAULT_RATE_LIMIT = (float("inf"), float("inf"))
+            start = time.perf_counter()
+            app.state.load()
+            load_seconds = time.perf_counter() - start
+            results = run_cycles(app, base_url, args)
+            # 書き出し中の圧縮が残っていれば待つ
+            if getattr(app.state, "_compaction_thread", None):
+                app.state._compaction_thread.join()
+
+        peak_heap = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        summary = summarize(results, load_seconds, peak_rss_kb, peak_heap, args)
+    finally:
+        process.terminate()
+        process.wait()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print(f"Benchmark: {args.tickets} tickets, {args.cycles} cycles, {args.backend} backend (state in {data_dir})")
+    print_report(summary, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+ShardedTicketState のリース（取得・確認・引き渡し・期限切れ）のテスト
+
+ハートビートのスレッドは起動せず、各レプリカの heartbeat() を順に呼んで一時ディレクトリ上で動作を確かめる
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from datetime import timedelta
+
+# app.py は読み込み時に環境変数から設定を読むため、必須の設定を先に与える
+os.environ.setdefault("POLLING_INTERVAL", "60")
+os.environ.setdefault("PENDING_NOTIFICATION_INTERVAL_SECONDS", "3600")
+os.environ.setdefault("NOTIFY_TRACKER_IDS", "")
+os.environ.setdefault("NOTIFY_PROJECT_IDS", "")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+BUCKETS = 4
+
+
+class ShardLeaseTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.shard_dir = os.path.join(self.directory, "shards")
+        self.replicas = []
+
+    def tearDown(self):
+        for replica in self.replicas:
+            replica.close()
+        shutil.rmtree(self.directory)
+
+    def replica(self, instance_id, lease_seconds=30):
+        leases = app.ShardLeases(self.shard_dir, instance_id, lease_seconds)
+        leases.join()
+        replica = app.ShardedTicketState(self.shard_dir, BUCKETS, leases, legacy_directory=self.directory)
+        self.replicas.append(replica)
+        return replica
+
+    def write_lease(self, bucket, owner, expires):
+        path = os.path.join(self.shard_dir, "leases", f"bucket-{bucket:03d}.json")
+        with open(path, "w") as f:
+            json.dump({"owner": owner, "expires": expires}, f)
+
+    def expire(self, replica):
+        """
+        停止したレプリカのハートビートとリースを期限切れにする
+        """
+        past = time.time() - 1
+        with open(os.path.join(self.shard_dir, "members", f"{replica.leases.instance_id}.json"), "w") as f:
+            json.dump({"expires": past}, f)
+        for bucket in replica.buckets:
+            self.write_lease(bucket, replica.leases.instance_id, past)
+
+    def test_claim_is_confirmed_on_next_heartbeat(self):
+        a = self.replica("a")
+        a.heartbeat()
+        # 書き込んだリースは次のハートビートで確認するまで使わない
+        self.assertEqual(a.buckets, {})
+        self.assertFalse(a.owns(0))
+        self.assertEqual(a.leases.read(0)[0], "a")
+
+        a.heartbeat()
+        self.assertEqual(sorted(a.buckets), list(range(BUCKETS)))
+        self.assertTrue(all(a.owns(ticket_id) for ticket_id in range(BUCKETS)))
+
+    def test_claim_overwritten_by_another_replica_is_not_acquired(self):
+        a = self.replica("a")
+        a.heartbeat()
+        # 同時に書き込んだ別のレプリカが最後に書き込んだ場合は、そのレプリカが取得する
+        self.write_lease(1, "b", time.time() + 30)
+        a.heartbeat()
+        self.assertNotIn(1, a.buckets)
+        self.assertEqual(sorted(a.buckets), [0, 2, 3])
+
+    def test_handover_to_joining_replica(self):
+        a = self.replica("a")
+        a.heartbeat()
+        a.heartbeat()
+        for ticket_id in range(BUCKETS):
+            a.mark_notified(ticket_id)
+
+        b = self.replica("b")
+        b.heartbeat()
+        # 有効なリースのあるバケットは、所有者が引き渡すまで取得しない
+        self.assertEqual(b.buckets, {})
+
+        a.heartbeat()
+        handed_over = [bucket for bucket in range(BUCKETS) if bucket not in a.buckets]
+        self.assertTrue(handed_over)
+        for bucket in handed_over:
+            self.assertIsNone(a.leases.read(bucket)[0])
+
+        b.heartbeat()
+        b.heartbeat()
+        self.assertEqual(sorted(b.buckets), handed_over)
+        # 各バケットはどちらか一方だけが担当する
+        self.assertFalse(set(a.buckets) & set(b.buckets))
+        self.assertEqual(set(a.buckets) | set(b.buckets), set(range(BUCKETS)))
+        # 引き継いだバケットの状態は引き渡したレプリカが書き出したものを読み込む
+        for ticket_id in handed_over:
+            self.assertTrue(b.is_notified(ticket_id))
+            self.assertFalse(a.is_notified(ticket_id))
+
+    def test_expired_replica_buckets_are_taken_over(self):
+        a = self.replica("a")
+        a.heartbeat()
+        a.heartbeat()
+        a.mark_notified(2)
+        a.flush()
+
+        b = self.replica("b")
+        self.expire(a)
+        b.heartbeat()
+        b.heartbeat()
+        self.assertEqual(sorted(b.buckets), list(range(BUCKETS)))
+        self.assertTrue(b.is_notified(2))
+
+        # 期限切れの間に別のレプリカが取得したバケットは手放す
+        a.heartbeat()
+        self.assertEqual(a.buckets, {})
+
+    def test_lapsed_lease_does_not_advance_high_water_mark(self):
+        a = self.replica("a")
+        a.heartbeat()
+        a.heartbeat()
+        start = a.begin_poll()
+        marks = dict(a.high_water_marks)
+
+        # 取得の途中でリースの延長が遅れ、バケット1のチケットを読み飛ばした
+        a.expires[1] = time.time() - 1
+        self.assertFalse(a.owns(1))
+        a.heartbeat()
+        self.assertTrue(a.owns(1))
+
+        a.save_high_water_mark(start + timedelta(hours=1))
+        self.assertEqual(a.high_water_marks[1], marks[1])
+        self.assertEqual(a.high_water_marks[0], start + timedelta(hours=1))
+
+    def test_unowned_write_is_not_saved(self):
+        a = self.replica("a")
+        a.heartbeat()
+        a.heartbeat()
+        a.expires[3] = time.time() - 1
+        a.mark_notified(3)
+        a.expires[3] = time.time() + 30
+        self.assertFalse(a.is_notified(3))
+
+    def test_lost_bucket_is_discarded_without_writing(self):
+        a = self.replica("a")
+        a.heartbeat()
+        a.heartbeat()
+        written = []
+        bucket_state = a.buckets[1]
+        bucket_state.flush = lambda: written.append("flush")
+        bucket_state.close = lambda: written.append("close")
+
+        # リースが切れたバケットの状態は、別のレプリカが取得していても書き出さない
+        a.expires[1] = time.time() - 1
+        a.flush()
+        self.write_lease(1, "b", time.time() + 30)
+        a.heartbeat()
+        self.assertNotIn(1, a.buckets)
+        self.assertEqual(written, [])
+        self.assertEqual(a.leases.read(1)[0], "b")
+
+    def test_dropped_bucket_is_closed_after_readers_finish(self):
+        a = self.replica("a")
+        a.heartbeat()
+        a.heartbeat()
+        closed = []
+        bucket_state = a.buckets[2]
+        close = bucket_state.close
+        bucket_state.close = lambda: (closed.append(2), close())
+
+        with a._states() as states:
+            a._drop(2, release=True)
+            self.assertEqual(closed, [])
+            self.assertEqual(a.leases.read(2)[0], "a")
+            self.assertIn(bucket_state, states)
+        self.assertEqual(closed, [2])
+        self.assertIsNone(a.leases.read(2)[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
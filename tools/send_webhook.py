@@ -0,0 +1,58 @@
+"""
+RedmineのWebhook（redmine_webhookプラグインの形式）の代わりにイベントを送信する動作確認用のスクリプト
+
+例: python tools/send_webhook.py --action opened 123
+"""
+import argparse
+import json
+import sys
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+
+def build_payload(action, ticket_id):
+    """
+    redmine_webhookプラグインと同じ形式のペイロードを作成する
+    （通知側はチケットIDだけを使い、内容はRedmineから取得し直す）
+    """
+    return {"payload": {"action": action, "issue": {"id": ticket_id}}}
+
+
+def send_webhook(url, action, ticket_id, token=""):
+    """
+    1件のイベントを送信し、HTTPステータスコードを返す
+    """
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["X-Webhook-Token"] = token
+    body = json.dumps(build_payload(action, ticket_id)).encode()
+    try:
+        with urlopen(Request(url, data=body, headers=headers, method="POST"), timeout=10) as response:
+            return response.status
+    except HTTPError as e:
+        return e.code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send Redmine-style webhook events to the notifier")
+    parser.add_argument("ticket_ids", nargs="+", type=int, help="ticket IDs to send events for")
+    parser.add_argument("--url", default="http://localhost:8080/webhook", help="webhook URL of the notifier")
+    parser.add_argument("--action", choices=["opened", "updated"], default="updated")
+    parser.add_argument("--token", default="", help="value of WEBHOOK_TOKEN")
+    args = parser.parse_args()
+
+    failed = False
+    for ticket_id in args.ticket_ids:
+        try:
+            status = send_webhook(args.url, args.action, ticket_id, args.token)
+        except URLError as e:
+            print(f"#{ticket_id}: {e.reason}")
+            failed = True
+            continue
+        print(f"#{ticket_id}: {args.action} -> HTTP {status}")
+        failed = failed or status != 202
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()